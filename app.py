@@ -4,15 +4,27 @@ Network Interface Manager Web Application
 A comprehensive web interface for managing network interfaces including LAN, WiFi, and USB tethering
 """
 
-from flask import Flask, render_template, jsonify, request, send_from_directory
+from flask import Flask, render_template, jsonify, request, send_from_directory, g
 import subprocess
 import os
+import sys
+import signal
+import atexit
 import json
 import re
 import time
 import threading
+import zlib
+import shutil
 from datetime import datetime
 import logging
+from profiling import (TRACE_ENABLED, PROFILE_ENABLED, traced_class, current_trace,
+                       start_trace, end_trace, TraceLog, RequestProfiler)
+from journal import EventJournal, JournalHandler, SEVERITIES, LOG_FILES, tail_lines
+from fleet import FLEET_AGGREGATOR, FLEET_SERVE
+from throughput import THROUGHPUT_SERVER
+from steering import STEERING_FILE
+from dhcp import LEASE_FILE as DHCP_LEASE_FILE
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,16 +32,267 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PORT = int(os.environ.get('NIM_PORT', '5020'))
+
+# Last interface snapshot, served at boot while the first collection runs
+SNAPSHOT_FILE = os.environ.get('NIM_SNAPSHOT_FILE', os.path.join(BASE_DIR, 'snapshot.json'))
+SNAPSHOT_INTERVAL = int(os.environ.get('NIM_SNAPSHOT_INTERVAL', '60'))  # seconds
+
+@traced_class
 class NetworkManager:
-    def __init__(self):
+    def __init__(self, snapshot_file=SNAPSHOT_FILE):
         self.interface_stats_cache = {}
         self.last_update = 0
         self.cache_duration = 2  # seconds
+        
+        # Warm snapshot state
+        self.snapshot_file = snapshot_file
+        self.warm_snapshot = {}
+        self.warm_snapshot_time = None
+        self.warming_up = False
+        self._collect_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        
+        # Interface, route and tethering events, shared with usb-monitor.sh
+        self.journal = EventJournal()
+        
+        # Heavy subsystems, created on first use
+        self._wireless = None
+        self._mihomo = None
+        self._prober = None
+        self._failover = None
+        self._conntrack = None
+        self._fleet_agent = None
+        self._throughput = None
+        self._throughput_server = None
+        self._health = None
+        self._checkpoints = None
+        self._steering = None
+        self._dhcp = None
+        
+        self.load_snapshot()
+    
+    @property
+    def wireless(self):
+        if self._wireless is None:
+            from wireless import WirelessScanner
+            self._wireless = WirelessScanner(self.run_command)
+        return self._wireless
+    
+    @property
+    def mihomo(self):
+        if self._mihomo is None:
+            from mihomo import MihomoInspector
+            self._mihomo = MihomoInspector(self.run_command)
+        return self._mihomo
+    
+    @property
+    def prober(self):
+        if self._prober is None:
+            from probing import Prober
+            self._prober = Prober(self.run_command)
+        return self._prober
+    
+    @property
+    def failover(self):
+        if self._failover is None:
+            from failover import FailoverController
+            self._failover = FailoverController(self.run_command, on_event=self.journal_failover_event)
+        return self._failover
+    
+    @property
+    def throughput(self):
+        if self._throughput is None:
+            from throughput import ThroughputTester
+            self._throughput = ThroughputTester()
+        return self._throughput
+    
+    @property
+    def throughput_server(self):
+        if self._throughput_server is None:
+            from throughput import ThroughputServer
+            self._throughput_server = ThroughputServer()
+        return self._throughput_server
+    
+    @property
+    def health(self):
+        if self._health is None:
+            from health import RoutingHealth
+            self._health = RoutingHealth(self.run_command, probe=self.probe_gateway)
+        return self._health
+    
+    @property
+    def checkpoints(self):
+        if self._checkpoints is None:
+            from checkpoints import ConfigCheckpoints
+            self._checkpoints = ConfigCheckpoints(self.run_command, on_event=self.journal_checkpoint_event)
+        return self._checkpoints
+    
+    @property
+    def steering(self):
+        if self._steering is None:
+            from steering import SteeringController
+            self._steering = SteeringController(self.run_command, uplink_up=self.uplink_up,
+                                                on_event=self.journal_steering_event)
+        return self._steering
+    
+    @property
+    def dhcp(self):
+        if self._dhcp is None:
+            from dhcp import DhcpManager
+            self._dhcp = DhcpManager(self.run_command, on_event=self.journal_dhcp_event)
+        return self._dhcp
+    
+    @property
+    def conntrack(self):
+        if self._conntrack is None:
+            from conntrack import ConntrackReader
+            self._conntrack = ConntrackReader()
+        return self._conntrack
+    
+    def journal_failover_event(self, entry):
+        """Record failover state changes in the event journal"""
+        severity = 'warning' if entry['event'] in ('declared_down', 'reroute_skipped') else 'info'
+        if entry['event'] == 'reroute_failed':
+            severity = 'error'
+        details = {key: value for key, value in entry.items() if key not in ('event', 'interface', 'time', 't_ms')}
+        self.journal.record('route', f"Failover: {entry['event'].replace('_', ' ')}", severity=severity,
+                            interface=entry.get('interface'), **details)
+        if self._steering and entry['event'] in ('declared_down', 'restored'):
+            # Move steered classes now rather than on the next poll
+            self._steering.notify()
+    
+    def journal_steering_event(self, event, message, severity='info', **details):
+        """Record traffic steering changes in the event journal"""
+        self.journal.record('route', message, severity=severity, event=event, **details)
+    
+    def journal_dhcp_event(self, event, message, severity='info', **details):
+        """Record lease changes in the event journal"""
+        self.last_update = 0
+        self.journal.record('interface', message, severity=severity, event=event, source='dhcp', **details)
+    
+    def uplink_up(self, interface):
+        """Uplink liveness, from the failover monitor when it watches the uplink, else carrier"""
+        if self._failover and self._failover.running:
+            for uplink in self._failover.get_status()['uplinks']:
+                if uplink['interface'] == interface:
+                    return uplink['state'] == 'up'
+        from failover import read_carrier
+        return read_carrier(interface) is not False
+    
+    def journal_checkpoint_event(self, event, message, severity='info', **details):
+        """Record checkpoint restores and confirm-or-revert guards in the event journal"""
+        self.last_update = 0
+        self.journal.record('interface', message, severity=severity, event=event, **details)
+    
+    def apply_with_confirmation(self, confirm_within, reason, change):
+        """Run change(), reverting it unless confirmed within `confirm_within` seconds"""
+        if not confirm_within:
+            return change()
+        armed = self.checkpoints.arm(confirm_within, reason)
+        if not armed['success']:
+            return armed
+        
+        result = change()
+        if result.get('success') or not armed['new']:
+            result['confirm'] = self.checkpoints.get_guard()
+        else:
+            # Nothing was changed, so there is nothing to revert
+            self.checkpoints.disarm()
+        return result
+    
+    def load_snapshot(self):
+        """Load the last persisted interface snapshot, if any"""
+        try:
+            with open(self.snapshot_file) as f:
+                data = json.load(f)
+            self.warm_snapshot = data.get('interfaces', {})
+            self.warm_snapshot_time = data.get('saved_at')
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable snapshot {self.snapshot_file}: {e}")
+    
+    def save_snapshot(self):
+        """Persist the current interface cache to disk atomically"""
+        if not self.interface_stats_cache:
+            return False
+        
+        data = {'saved_at': self.last_update, 'interfaces': self.interface_stats_cache}
+        tmp_file = f"{self.snapshot_file}.tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_file, self.snapshot_file)
+            return True
+        except OSError as e:
+            logger.error(f"Error saving snapshot {self.snapshot_file}: {e}")
+            return False
+    
+    def get_stale_snapshot(self):
+        """Return the warm snapshot with every interface marked stale"""
+        interfaces = {}
+        for name, iface in self.warm_snapshot.items():
+            interfaces[name] = dict(iface, stale=True, snapshot_time=self.warm_snapshot_time)
+        return interfaces
+    
+    def warm_up(self):
+        """Collect fresh interface data in the background"""
+        try:
+            self.get_network_interfaces(force=True)
+        except Exception as e:
+            logger.error(f"Warm-up collection failed: {e}")
+        finally:
+            self.warming_up = False
     
-    def run_command(self, cmd, timeout=10):
+    def snapshot_loop(self, interval=SNAPSHOT_INTERVAL):
+        """Periodically persist the interface snapshot"""
+        while not self._stop_event.wait(interval):
+            self.save_snapshot()
+    
+    def start_background_tasks(self):
+        """Start warm-up collection and periodic snapshot persistence"""
+        self.warming_up = True
+        threading.Thread(target=self.warm_up, name='warm-up', daemon=True).start()
+        threading.Thread(target=self.snapshot_loop, name='snapshot', daemon=True).start()
+        if FLEET_AGGREGATOR:
+            from fleet import FleetAgent
+            self._fleet_agent = FleetAgent(self.collect_fleet_snapshot)
+            self._fleet_agent.start()
+            logger.info(f"Fleet agent publishing to {FLEET_AGGREGATOR}")
+        if THROUGHPUT_SERVER:
+            self.throughput_server.start()
+        if os.path.exists(STEERING_FILE):
+            threading.Thread(target=self.steering.load, name='steering-load', daemon=True).start()
+        if os.path.exists(DHCP_LEASE_FILE):
+            # Confirm the cached leases with INIT-REBOOT
+            self.dhcp.resume()
+        # A change left unconfirmed by the previous run still reverts
+        self.checkpoints.resume()
+    
+    def shutdown(self):
+        """Stop background tasks and persist the last snapshot"""
+        self._stop_event.set()
+        if self._failover:
+            self._failover.stop()
+        if self._fleet_agent:
+            self._fleet_agent.stop()
+        if self._throughput_server:
+            self._throughput_server.stop()
+        if self._health:
+            self._health.close()
+        if self._steering:
+            self._steering.stop()
+        if self._dhcp:
+            # Leases stay configured and cached for the next start
+            self._dhcp.shutdown()
+        self.save_snapshot()
+    
+    def run_command(self, cmd, timeout=10, input=None):
         """Execute shell command and return output"""
         try:
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout)
+            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout, input=input)
             return {
                 'success': result.returncode == 0,
                 'output': result.stdout.strip(),
@@ -41,14 +304,25 @@ class NetworkManager:
         except Exception as e:
             return {'success': False, 'output': '', 'error': str(e), 'returncode': -1}
 
-    def get_network_interfaces(self):
+    def get_network_interfaces(self, force=False):
         """Get all network interfaces with their details"""
-        current_time = time.time()
-        
         # Use cache if recent
-        if current_time - self.last_update < self.cache_duration:
+        if not force and time.time() - self.last_update < self.cache_duration:
             return self.interface_stats_cache
         
+        # Serve the persisted snapshot while the warm-up collection runs
+        if not force and self.warming_up and not self.interface_stats_cache and self.warm_snapshot:
+            return self.get_stale_snapshot()
+        
+        with self._collect_lock:
+            # Another thread may have refreshed the cache while we waited
+            if not force and time.time() - self.last_update < self.cache_duration:
+                return self.interface_stats_cache
+            return self._collect_interfaces()
+    
+    def _collect_interfaces(self):
+        """Collect interface details from the system"""
+        current_time = time.time()
         interfaces = {}
         
         # Get interface list
@@ -320,8 +594,11 @@ class NetworkManager:
         
         result = self.run_command(f"sudo ip link set {iface_name} {state}")
         if result['success']:
+            self.journal.record('interface', f'Interface set {state}', interface=iface_name)
             return {'success': True, 'message': f'Interface {iface_name} set {state}'}
         else:
+            self.journal.record('interface', f'Failed to set interface {state}: {result["error"]}',
+                                severity='error', interface=iface_name)
             return {'success': False, 'error': result['error']}
 
     def set_interface_ip(self, iface_name, ip_address, netmask=None):
@@ -330,52 +607,36 @@ class NetworkManager:
             address = f"{ip_address}/{netmask}"
         else:
             address = ip_address
-            
-        # Remove existing IP addresses
-        self.run_command(f"sudo ip addr flush dev {iface_name}")
         
-        # Add new IP address
-        result = self.run_command(f"sudo ip addr add {address} dev {iface_name}")
+        # Replace existing global addresses, adding the new one before removing the old
+        result = self.apply_bulk_config({iface_name: {'addresses': [address]}})
         if result['success']:
             return {'success': True, 'message': f'IP address {address} set on {iface_name}'}
         else:
             return {'success': False, 'error': result['error']}
+    
+    def apply_bulk_config(self, desired, dry_run=False):
+        """Apply desired state for many interfaces as one batched transaction"""
+        from ipbatch import BulkInterfaceConfig
+        result = BulkInterfaceConfig(self.run_command).apply(desired, dry_run=dry_run)
+        if not dry_run:
+            # Force the next read to see the new configuration
+            self.last_update = 0
+            if result['success'] and result.get('applied'):
+                for name in desired:
+                    commands = [cmd for cmd in result['applied'] if f" dev {name} " in f"{cmd} "]
+                    if commands:
+                        self.journal.record('interface', 'Configuration applied', interface=name, commands=commands)
+            elif not result['success'] and isinstance(desired, dict):
+                self.journal.record('interface', f"Configuration failed: {result['error']}", severity='error',
+                                    interface=next(iter(desired)) if len(desired) == 1 else None,
+                                    failed_command=result.get('failed_command'),
+                                    rolled_back=result.get('rolled_back'))
+        return result
 
     def get_wireless_networks(self, iface_name):
         """Scan for wireless networks"""
-        if not iface_name.startswith('wl'):
-            return {'success': False, 'error': 'Not a wireless interface'}
-        
-        result = self.run_command(f"sudo iwlist {iface_name} scan")
-        if not result['success']:
-            return {'success': False, 'error': result['error']}
-        
-        networks = []
-        current_network = {}
-        
-        for line in result['output'].split('\n'):
-            line = line.strip()
-            if 'Cell' in line and 'Address:' in line:
-                if current_network:
-                    networks.append(current_network)
-                current_network = {'bssid': line.split('Address: ')[1]}
-            elif 'ESSID:' in line:
-                essid = line.split('ESSID:')[1].strip('"')
-                current_network['ssid'] = essid
-            elif 'Quality=' in line:
-                quality_match = re.search(r'Quality=(\d+/\d+)', line)
-                if quality_match:
-                    current_network['quality'] = quality_match.group(1)
-                signal_match = re.search(r'Signal level=(-?\d+)', line)
-                if signal_match:
-                    current_network['signal'] = f"{signal_match.group(1)} dBm"
-            elif 'Encryption key:' in line:
-                current_network['encrypted'] = 'on' in line.lower()
-        
-        if current_network:
-            networks.append(current_network)
-        
-        return {'success': True, 'networks': networks}
+        return self.wireless.scan(iface_name)
 
     def get_system_info(self):
         """Get system network information"""
@@ -421,106 +682,46 @@ class NetworkManager:
             
             if gateway:
                 # Test gateway ping
-                ping_result = self.run_command(f"ping -c 2 -W 3 -I {iface_name} {gateway}")
+                ping_result = self.prober.ping(gateway, count=2, timeout=3, iface=iface_name)
                 result['ping_gateway'] = ping_result['success']
                 if not ping_result['success']:
                     result['errors'].append(f"Gateway ping failed: {ping_result['error']}")
             
             # Test DNS ping
-            dns_result = self.run_command(f"ping -c 2 -W 3 -I {iface_name} 8.8.8.8")
+            dns_result = self.prober.ping('8.8.8.8', count=2, timeout=3, iface=iface_name)
             result['ping_dns'] = dns_result['success']
             if not dns_result['success']:
                 result['errors'].append(f"DNS ping failed: {dns_result['error']}")
             
             # Test HTTP connectivity and get public IP
-            http_result = self.run_command(f"curl -s --connect-timeout 10 --interface {iface_name} http://httpbin.org/ip")
+            http_result = self.prober.http_public_ip(iface_name)
             if http_result['success']:
-                try:
-                    import json
-                    ip_data = json.loads(http_result['output'])
-                    result['public_ip'] = ip_data.get('origin', 'Unknown')
-                    result['http_test'] = True
-                except:
-                    result['errors'].append("Failed to parse HTTP response")
+                result['public_ip'] = http_result['public_ip']
+                result['http_test'] = True
             else:
-                result['errors'].append(f"HTTP test failed: {http_result['error']}")
+                result['errors'].append(http_result['error'])
                 
         except Exception as e:
             result['errors'].append(f"Test error: {str(e)}")
         
         return result
 
+    def probe_gateway(self, gateway, interface=None):
+        """Gateway reachability, from the failover monitor when it watches that uplink"""
+        if self._failover and self._failover.running:
+            for uplink in self._failover.get_status()['uplinks']:
+                if uplink['gateway'] == gateway and interface in (None, uplink['interface']):
+                    return uplink['state'] == 'up'
+        return self.prober.ping(gateway)['success']
+    
     def check_routing_health(self):
-        """Check routing table health and identify issues"""
-        issues = []
-        suggestions = []
-        
-        # Get routing table
-        route_result = self.run_command("ip route show")
-        if not route_result['success']:
-            return {'issues': ['Cannot read routing table'], 'suggestions': []}
-        
-        routes = route_result['output'].split('\n')
-        default_routes = [r for r in routes if r.startswith('default')]
-        
-        # Check for incomplete default routes (but exclude load balancing configuration)
-        incomplete_routes = []
-        nexthop_routes = [r for r in routes if 'nexthop' in r]
-        
-        for route in default_routes:
-            route_stripped = route.strip()
-            # Only consider it incomplete if it's just "default" and there are no nexthop routes
-            if route_stripped == 'default' and not nexthop_routes:
-                incomplete_routes.append(route)
-            # Also check for other incomplete patterns (default without via or nexthop)
-            elif route_stripped != 'default' and 'via' not in route and 'nexthop' not in route and route_stripped != '':
-                incomplete_routes.append(route)
-        
-        if incomplete_routes:
-            issues.append(f"Found {len(incomplete_routes)} incomplete default route(s)")
-            suggestions.append("Remove incomplete routes with: sudo ip route del default")
-        
-        # Check for too many default routes (but account for load balancing)
-        if len(default_routes) > 3 and not nexthop_routes:
-            issues.append(f"Too many default routes ({len(default_routes)})")
-            suggestions.append("Consider cleaning up redundant routes")
-        
-        # Check for load balancing route
-        if not nexthop_routes and len(default_routes) > 1:
-            issues.append("Multiple default routes without load balancing")
-            suggestions.append("Configure proper load balancing with nexthop")
-        
-        # Check gateway connectivity
-        gateways = []
+        """Check routing table health and identify issues
         
-        # Extract gateways from both regular default routes and nexthop routes
-        for route in default_routes:
-            if 'via' in route:
-                parts = route.split()
-                for i, part in enumerate(parts):
-                    if part == 'via' and i + 1 < len(parts):
-                        gateways.append(parts[i + 1])
-        
-        # Extract gateways from nexthop routes
-        for route in nexthop_routes:
-            if 'via' in route:
-                parts = route.split()
-                for i, part in enumerate(parts):
-                    if part == 'via' and i + 1 < len(parts):
-                        gateways.append(parts[i + 1])
-        
-        for gw in set(gateways):
-            ping_result = self.run_command(f"ping -c 1 -W 2 {gw}")
-            if not ping_result['success']:
-                issues.append(f"Gateway {gw} is not reachable")
-                suggestions.append(f"Check connection to gateway {gw}")
-        
-        return {
-            'issues': issues,
-            'suggestions': suggestions,
-            'default_routes_count': len(default_routes),
-            'load_balancing_active': len(nexthop_routes) > 0
-        }
+        Rules are re-evaluated only when the routes, policy rules, links,
+        addresses or gateway probes they read have changed.
+        """
+        return self.health.check()
+    
     def auto_fix_routing(self):
         """Automatically detect and fix routing issues"""
         result = {
@@ -594,6 +795,10 @@ class NetworkManager:
         except Exception as e:
             result['errors'].append(f"Auto-fix error: {str(e)}")
         
+        for action in result['actions_taken']:
+            self.journal.record('route', f"Auto-fix: {action}")
+        for error in result['errors']:
+            self.journal.record('route', f"Auto-fix: {error}", severity='error')
         return result
 
     def detect_available_gateways(self):
@@ -622,14 +827,14 @@ class NetworkManager:
                                 ]
                                 
                                 for possible_gw in possible_gateways:
-                                    ping_result = self.run_command(f"ping -c 1 -W 2 {possible_gw}")
+                                    ping_result = self.prober.ping(possible_gw)
                                     if ping_result['success']:
                                         gateway = possible_gw
                                         break
                 
                 if gateway:
                     # Verify gateway is reachable
-                    ping_result = self.run_command(f"ping -c 1 -W 2 {gateway}")
+                    ping_result = self.prober.ping(gateway)
                     if ping_result['success']:
                         gateways.append({
                             'interface': name,
@@ -662,6 +867,7 @@ class NetworkManager:
                 if name not in old_interfaces:
                     result['new_interfaces'].append(name)
                     result['changes_detected'].append(f"New interface detected: {name}")
+                    self.journal.record('interface', 'New interface detected', interface=name)
             
             # Detect IP changes
             for name, new_iface in new_interfaces.items():
@@ -676,6 +882,8 @@ class NetworkManager:
                             'new_ips': list(new_addrs)
                         })
                         result['changes_detected'].append(f"IP changed on {name}")
+                        self.journal.record('interface', 'IP address changed', interface=name,
+                                            old_ips=sorted(old_addrs), new_ips=sorted(new_addrs))
             
             # If changes detected, suggest routing refresh
             if result['changes_detected']:
@@ -691,63 +899,27 @@ class NetworkManager:
         return result
     def get_mihomo_info(self):
         """Get Mihomo proxy service information"""
-        info = {
-            'running': False,
-            'config_path': '/etc/mihomo/config.yaml',
-            'tun_interface': None,
-            'configured_interfaces': [],
-            'load_balance_group': None
-        }
-        
-        # Check if Mihomo service is running
-        result = self.run_command("systemctl is-active mihomo 2>/dev/null || pgrep -f mihomo")
-        if result['success'] and ('active' in result['output'] or result['output'].strip()):
-            info['running'] = True
-        
-        # Check for TUN interface
-        tun_result = self.run_command("ip link show | grep Meta")
-        if tun_result['success'] and tun_result['output']:
-            info['tun_interface'] = 'Meta'
-        
-        # Try to read Mihomo config to get interface information
-        try:
-            config_result = self.run_command("cat /etc/mihomo/config.yaml 2>/dev/null")
-            if config_result['success']:
-                config_content = config_result['output']
-                
-                # Look for interface-name configurations
-                import re
-                interface_matches = re.findall(r'interface-name:\s*["\']?([^"\'\\s]+)["\']?', config_content)
-                info['configured_interfaces'] = list(set(interface_matches))
-                
-                # Check for load balance configuration
-                if 'load-balance' in config_content and 'LB-LAN-USB' in config_content:
-                    info['load_balance_group'] = 'LB-LAN-USB'
-                    
-        except Exception as e:
-            logger.error(f"Error reading Mihomo config: {e}")
-        
-        return info
+        return self.mihomo.get_info()
 
-    def enable_dhcp(self, iface_name):
-        """Enable DHCP on the interface"""
-        # Flush existing IPs
-        self.run_command(f"sudo ip addr flush dev {iface_name}")
-        # Start dhclient
-        result = self.run_command(f"sudo dhclient {iface_name}")
-        if result['success']:
-            return {'success': True, 'message': f'DHCP enabled on {iface_name}'}
-        else:
-            return {'success': False, 'error': result['error']}
+    def enable_dhcp(self, iface_name, wait=False):
+        """Enable DHCP on the interface; the lease is acquired in the background"""
+        # Existing addresses stay until the lease replaces them
+        result = self.dhcp.start(iface_name, wait=wait)
+        if 'interfaces' in result:
+            self.journal.record('interface', 'DHCP enabled', interface=iface_name)
+        return result
 
-    def disable_dhcp(self, iface_name):
+    def disable_dhcp(self, iface_name, keep_address=False):
         """Disable DHCP on the interface"""
-        # Stop dhclient
-        result = self.run_command(f"sudo dhclient -r {iface_name}")
-        if result['success']:
+        client = self.dhcp.clients.get(iface_name)
+        if not (client and client.is_alive()) and shutil.which('dhclient'):
+            # Leased by dhclient outside the manager (e.g. configure-usb-tethering.sh)
+            result = self.run_command(f"sudo dhclient -r {iface_name}")
+            if not result['success']:
+                return {'success': False, 'error': result['error']}
+            self.journal.record('interface', 'DHCP released', interface=iface_name)
             return {'success': True, 'message': f'DHCP released on {iface_name}'}
-        else:
-            return {'success': False, 'error': result['error']}
+        return self.dhcp.stop(iface_name, release=True, keep_address=keep_address)
 
     def set_interface_mode(self, iface_name, mode, ip=None, netmask=None):
         """Set interface mode to DHCP or Static"""
@@ -764,19 +936,179 @@ class NetworkManager:
         else:
             return {'success': False, 'error': 'Invalid mode. Use "dhcp" or "static"'}
 
+    def start_failover(self, config):
+        """Start the uplink failover controller"""
+        uplinks = config.get('uplinks')
+        if not uplinks:
+            # Default to every uplink with a reachable gateway
+            uplinks = [{'interface': gw['interface'], 'gateway': gw['gateway']}
+                       for gw in self.detect_available_gateways()]
+        
+        options = {key: config[key] for key in ('interval_ms', 'multiplier', 'budget_ms', 'hold_down_ms')
+                   if config.get(key) is not None}
+        return self.failover.start(uplinks, **options)
+
+    def configure_steering(self, config, dry_run=False):
+        """Apply traffic-class steering, filling in uplinks and gateways that were left out"""
+        from ipbatch import valid_interface_name
+        classes = config.get('classes')
+        if not isinstance(classes, list) or not all(isinstance(spec, dict) for spec in classes):
+            return {'success': False, 'error': 'classes must be a list of objects'}
+        
+        uplinks = config.get('uplinks')
+        if not uplinks:
+            # Every uplink a class refers to
+            names = []
+            for spec in classes:
+                for name in (spec.get('uplink'), spec.get('fallback')):
+                    if name and name not in names:
+                        names.append(name)
+            uplinks = [{'interface': name} for name in names]
+        
+        resolved = []
+        for uplink in uplinks if isinstance(uplinks, list) else []:
+            if isinstance(uplink, dict) and not uplink.get('gateway') and valid_interface_name(uplink.get('interface')):
+                uplink = dict(uplink, gateway=self.get_interface_gateway(uplink['interface']))
+            resolved.append(uplink)
+        return self.steering.apply(dict(config, uplinks=resolved or uplinks), dry_run=dry_run)
+    
+    def run_throughput_test(self, config):
+        """Measure uplink goodput, RTT under load and retransmits against a test server"""
+        from ipbatch import valid_interface_name
+        server = config.get('server')
+        if not server:
+            return {'success': False, 'error': 'Test server required'}
+        
+        interfaces = config.get('interfaces')
+        if not interfaces:
+            # Default to every uplink with a reachable gateway
+            interfaces = [gw['interface'] for gw in self.detect_available_gateways()]
+        if not isinstance(interfaces, list) or not all(valid_interface_name(i) for i in interfaces):
+            return {'success': False, 'error': 'interfaces must be a list of interface names'}
+        if self.throughput.running:
+            return {'success': False, 'error': 'A throughput test is already running'}
+        
+        options = {key: config[key] for key in ('port', 'duration', 'direction', 'streams', 'parallel')
+                   if config.get(key) is not None}
+        # Checked here: in the background thread a bad value would only kill the thread
+        from throughput import MAX_DURATION, MAX_STREAMS
+        if not isinstance(server, str):
+            return {'success': False, 'error': 'server must be a host name or address'}
+        if options.get('direction', 'both') not in ('both', 'download', 'upload'):
+            return {'success': False, 'error': 'direction must be both, download or upload'}
+        duration = options.get('duration', 5)
+        if isinstance(duration, bool) or not isinstance(duration, (int, float)) or not 1 <= duration <= MAX_DURATION:
+            return {'success': False, 'error': f'duration must be a number of seconds between 1 and {MAX_DURATION}'}
+        streams = options.get('streams', 1)
+        if isinstance(streams, bool) or not isinstance(streams, int) or not 1 <= streams <= MAX_STREAMS:
+            return {'success': False, 'error': f'streams must be an integer between 1 and {MAX_STREAMS}'}
+        port = options.get('port', 1)
+        if isinstance(port, bool) or not isinstance(port, int) or not 0 < port < 65536:
+            return {'success': False, 'error': 'port must be an integer between 1 and 65535'}
+        
+        def run():
+            result = self.throughput.run(interfaces, server, **options)
+            for uplink in result.get('results', []):
+                summary = ', '.join(f"{uplink[d]['goodput_mbps']} Mbit/s {d}" for d in ('download', 'upload')
+                                    if uplink.get(d, {}).get('success'))
+                self.journal.record('interface', f"Throughput test: {summary or 'failed'}",
+                                    severity='info' if uplink['success'] else 'warning',
+                                    interface=uplink['interface'], run_id=uplink['run_id'])
+            return result
+        
+        if config.get('wait'):
+            return run()
+        threading.Thread(target=run, name='throughput', daemon=True).start()
+        return {'success': True, 'message': f'Throughput test started on {len(interfaces)} uplinks',
+                'interfaces': interfaces}
+    
+    def get_throughput_results(self, interface=None, limit=50):
+        """Running test and stored throughput results, newest first"""
+        return {
+            'running': self.throughput.running,
+            'server': self.throughput_server.get_status(),
+            'results': self.throughput.history(interface, limit)
+        }
+    
+    def collect_fleet_snapshot(self):
+        """Interfaces, routes and probe results published to the fleet aggregator"""
+        routes = self.run_command("ip route show")
+        probes = {}
+        if self._failover and self._failover.running:
+            probes = {uplink['interface']: uplink for uplink in self._failover.get_status()['uplinks']}
+        
+        return {
+            'interfaces': self.get_network_interfaces(),
+            'routes': [line for line in routes['output'].split('\n') if line] if routes['success'] else [],
+            'probes': probes
+        }
+    
+    def get_fleet_agent_status(self):
+        """Upload statistics of this node's fleet agent"""
+        if not self._fleet_agent:
+            return {'enabled': False}
+        return dict(self._fleet_agent.get_status(), enabled=True)
+    
+    def get_conntrack_stats(self):
+        """Get connection and flow accounting per outgoing interface and mark"""
+        return self.conntrack.aggregate(self.get_network_interfaces())
+
 # Initialize network manager
 network_manager = NetworkManager()
+logging.getLogger().addHandler(JournalHandler(network_manager.journal))
+trace_log = TraceLog()
+request_profiler = RequestProfiler()
+
+if FLEET_SERVE:
+    from fleet import FleetAggregator
+    fleet_aggregator = FleetAggregator()
+else:
+    fleet_aggregator = None
+
+@app.before_request
+def begin_request_timing():
+    """Start the span tree and, if armed, the profiler for this request"""
+    if TRACE_ENABLED:
+        start_trace(request.path)
+    if PROFILE_ENABLED and not request.path.startswith('/api/debug/'):
+        g.profile = request_profiler.begin()
+
+@app.after_request
+def add_server_timing(response):
+    """Report the request's span tree in a Server-Timing header"""
+    trace = current_trace()
+    if trace is not None:
+        trace.finish()
+        response.headers['Server-Timing'] = trace.server_timing()
+    return response
+
+@app.teardown_request
+def end_request_timing(exc):
+    trace = end_trace()
+    if trace is not None and request.path.startswith('/api/') and not request.path.startswith('/api/debug/'):
+        trace_log.add(request.path, trace)
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.end(profile, request.path, trace)
 
 @app.route('/')
 def index():
     """Main dashboard page"""
     return render_template('index.html')
 
+@app.route('/fleet')
+def fleet_dashboard():
+    """Fleet overview page (aggregator mode)"""
+    return render_template('fleet.html')
+
 @app.route('/api/interfaces')
 def api_interfaces():
     """API endpoint to get all network interfaces"""
     interfaces = network_manager.get_network_interfaces()
-    return jsonify(interfaces)
+    response = jsonify(interfaces)
+    if any(iface.get('stale') for iface in interfaces.values()):
+        response.headers['X-Data-Stale'] = '1'
+    return response
 
 @app.route('/api/interface/<iface_name>')
 def api_interface_detail(iface_name):
@@ -804,10 +1136,9 @@ def api_set_interface_ip(iface_name):
     if not data or 'ip' not in data:
         return jsonify({'error': 'IP address required'}), 400
     
-    result = network_manager.set_interface_ip(
-        iface_name, 
-        data['ip'], 
-        data.get('netmask')
+    result = network_manager.apply_with_confirmation(
+        data.get('confirm_within'), f"set IP on {iface_name}",
+        lambda: network_manager.set_interface_ip(iface_name, data['ip'], data.get('netmask'))
     )
     return jsonify(result)
 
@@ -823,6 +1154,50 @@ def api_set_interface_mode(iface_name):
     result = network_manager.set_interface_mode(iface_name, mode, ip, netmask)
     return jsonify(result)
 
+@app.route('/api/dhcp')
+def api_dhcp_status():
+    """API endpoint to get DHCP client states, leases and timings"""
+    return jsonify(network_manager.dhcp.get_status())
+
+@app.route('/api/dhcp/<iface_name>')
+def api_dhcp_interface(iface_name):
+    """API endpoint to get the DHCP lease and timings of one interface"""
+    result = network_manager.dhcp.get_status(iface_name)
+    return jsonify(result), 200 if result['success'] else 404
+
+@app.route('/api/dhcp/start', methods=['POST'])
+def api_dhcp_start():
+    """API endpoint to acquire leases on several interfaces concurrently"""
+    data = request.get_json(silent=True) or {}
+    interfaces = data.get('interfaces')
+    if not interfaces or not isinstance(interfaces, list):
+        return jsonify({'error': 'Interfaces parameter required'}), 400
+    timeout = data.get('timeout', 30)
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not 0 < timeout <= 300:
+        return jsonify({'error': 'timeout must be a number of seconds between 0 and 300'}), 400
+    result = network_manager.dhcp.start(interfaces, wait=bool(data.get('wait')), timeout=timeout)
+    return jsonify(result), 200 if 'interfaces' in result else 400
+
+@app.route('/api/dhcp/<iface_name>/release', methods=['POST'])
+def api_dhcp_release(iface_name):
+    """API endpoint to release the DHCP lease of an interface"""
+    result = network_manager.disable_dhcp(iface_name)
+    return jsonify(result)
+
+@app.route('/api/interfaces/bulk', methods=['POST'])
+def api_bulk_configure():
+    """API endpoint to configure many interfaces in one transaction"""
+    data = request.get_json()
+    if not data or 'interfaces' not in data:
+        return jsonify({'error': 'Interfaces parameter required'}), 400
+    
+    dry_run = bool(data.get('dry_run'))
+    result = network_manager.apply_with_confirmation(
+        None if dry_run else data.get('confirm_within'), 'bulk configuration',
+        lambda: network_manager.apply_bulk_config(data['interfaces'], dry_run=dry_run)
+    )
+    return jsonify(result)
+
 @app.route('/api/interface/<iface_name>/scan')
 def api_scan_wireless(iface_name):
     """API endpoint to scan for wireless networks"""
@@ -832,7 +1207,10 @@ def api_scan_wireless(iface_name):
 @app.route('/api/routing/fix', methods=['POST'])
 def api_fix_routing():
     """API endpoint to automatically fix routing issues"""
-    result = network_manager.auto_fix_routing()
+    data = request.get_json(silent=True) or {}
+    result = network_manager.apply_with_confirmation(
+        data.get('confirm_within'), 'routing auto-fix', network_manager.auto_fix_routing
+    )
     return jsonify(result)
 
 @app.route('/api/interfaces/refresh', methods=['POST'])
@@ -859,6 +1237,215 @@ def api_routing_health():
     health = network_manager.check_routing_health()
     return jsonify(health)
 
+@app.route('/api/routing/health/rules')
+def api_routing_health_rules():
+    """API endpoint to list routing health rules, their inputs and cache statistics"""
+    return jsonify(network_manager.health.get_status())
+
+@app.route('/api/checkpoints', methods=['GET', 'POST'])
+def api_checkpoints():
+    """API endpoint to list configuration checkpoints or save the current configuration"""
+    if request.method == 'GET':
+        return jsonify(network_manager.checkpoints.list())
+    data = request.get_json(silent=True) or {}
+    if not data.get('name'):
+        return jsonify({'error': 'Checkpoint name required'}), 400
+    from checkpoints import GUARD_CHECKPOINT
+    if data['name'] == GUARD_CHECKPOINT:
+        return jsonify({'error': f'{GUARD_CHECKPOINT} is reserved for confirm-or-revert'}), 400
+    result = network_manager.checkpoints.save(data['name'])
+    return jsonify(result), 200 if result['success'] else 400
+
+@app.route('/api/checkpoints/<name>', methods=['GET', 'DELETE'])
+def api_checkpoint(name):
+    """API endpoint to show or delete a configuration checkpoint"""
+    if request.method == 'DELETE':
+        from checkpoints import GUARD_CHECKPOINT
+        if name == GUARD_CHECKPOINT and network_manager.checkpoints.get_guard():
+            return jsonify({'error': f'{name} is needed by the pending change guard'}), 409
+        result = network_manager.checkpoints.delete(name)
+        return jsonify(result), 200 if result['success'] else 404
+    checkpoint = network_manager.checkpoints.load(name)
+    if checkpoint is None:
+        return jsonify({'error': f'Checkpoint {name} not found'}), 404
+    return jsonify(checkpoint)
+
+@app.route('/api/checkpoints/<name>/restore', methods=['POST'])
+def api_checkpoint_restore(name):
+    """API endpoint to restore a configuration checkpoint (only the difference is applied)"""
+    data = request.get_json(silent=True) or {}
+    dry_run = bool(data.get('dry_run'))
+    result = network_manager.apply_with_confirmation(
+        None if dry_run else data.get('confirm_within'), f"restore {name}",
+        lambda: network_manager.checkpoints.restore(name, dry_run=dry_run)
+    )
+    return jsonify(result)
+
+@app.route('/api/checkpoints/confirm', methods=['POST'])
+def api_checkpoint_confirm():
+    """API endpoint to keep a change made with confirm_within"""
+    return jsonify(network_manager.checkpoints.confirm())
+
+@app.route('/api/checkpoints/revert', methods=['POST'])
+def api_checkpoint_revert():
+    """API endpoint to revert a change made with confirm_within right away"""
+    return jsonify(network_manager.checkpoints.revert())
+
+@app.route('/api/steering', methods=['GET', 'POST', 'DELETE'])
+def api_steering():
+    """API endpoint to show, apply or remove traffic-class steering"""
+    if request.method == 'GET':
+        return jsonify(network_manager.steering.get_status())
+    if request.method == 'DELETE':
+        return jsonify(network_manager.steering.disable())
+    data = request.get_json(silent=True) or {}
+    if not data.get('classes'):
+        return jsonify({'error': 'Classes parameter required'}), 400
+    result = network_manager.configure_steering(data, dry_run=bool(data.get('dry_run')))
+    return jsonify(result), 200 if result['success'] else 400
+
+@app.route('/api/failover')
+def api_failover_status():
+    """API endpoint to get uplink failover status"""
+    return jsonify(network_manager.failover.get_status())
+
+@app.route('/api/failover/start', methods=['POST'])
+def api_failover_start():
+    """API endpoint to start uplink failover monitoring"""
+    data = request.get_json(silent=True) or {}
+    result = network_manager.start_failover(data)
+    return jsonify(result), 200 if result['success'] else 400
+
+@app.route('/api/failover/stop', methods=['POST'])
+def api_failover_stop():
+    """API endpoint to stop uplink failover monitoring"""
+    return jsonify(network_manager.failover.stop())
+
+@app.route('/api/failover/timeline')
+def api_failover_timeline():
+    """API endpoint to export the failover detection and reroute timeline"""
+    return jsonify(network_manager.failover.get_timeline())
+
+@app.route('/api/conntrack')
+def api_conntrack():
+    """API endpoint to get per-uplink connection and flow accounting"""
+    result = network_manager.get_conntrack_stats()
+    return jsonify(result)
+
+@app.route('/api/logs')
+def api_logs():
+    """API endpoint to tail the event journal, resumable with ?after=<seq>"""
+    severity = request.args.get('severity')
+    if severity and severity not in SEVERITIES:
+        return jsonify({'error': f'severity must be one of {", ".join(SEVERITIES)}'}), 400
+    
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    result = network_manager.journal.tail(
+        after=request.args.get('after', type=int),
+        limit=limit,
+        interface=request.args.get('interface'),
+        severity=severity,
+        category=request.args.get('category')
+    )
+    return jsonify(result)
+
+@app.route('/api/logs/<name>')
+def api_log_file(name):
+    """API endpoint to tail a free-form log file (usb-monitor, app)"""
+    if name not in LOG_FILES:
+        return jsonify({'error': f'Unknown log {name}. Available: {", ".join(LOG_FILES)}'}), 404
+    
+    lines = max(1, min(request.args.get('lines', 200, type=int), 5000))
+    return jsonify({'success': True, 'name': name, 'lines': tail_lines(LOG_FILES[name], lines)})
+
+@app.route('/api/throughput')
+def api_throughput_results():
+    """API endpoint to get stored throughput results"""
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    return jsonify(network_manager.get_throughput_results(request.args.get('interface'), limit))
+
+@app.route('/api/throughput/run', methods=['POST'])
+def api_throughput_run():
+    """API endpoint to measure uplinks against a throughput test server"""
+    data = request.get_json(silent=True) or {}
+    if not data.get('server'):
+        return jsonify({'error': 'server required'}), 400
+    result = network_manager.run_throughput_test(data)
+    return jsonify(result), 200 if result['success'] else 400
+
+@app.route('/api/throughput/server', methods=['GET', 'POST'])
+def api_throughput_server():
+    """API endpoint to start or stop the built-in throughput test server"""
+    if request.method == 'GET':
+        return jsonify(network_manager.throughput_server.get_status())
+    
+    action = (request.get_json(silent=True) or {}).get('action')
+    if action == 'start':
+        return jsonify(network_manager.throughput_server.start())
+    if action == 'stop':
+        return jsonify(network_manager.throughput_server.stop())
+    return jsonify({'error': 'action must be "start" or "stop"'}), 400
+
+@app.route('/api/fleet/push', methods=['POST'])
+def api_fleet_push():
+    """API endpoint for agents to upload batched snapshot frames"""
+    if fleet_aggregator is None:
+        return jsonify({'error': 'Fleet aggregator disabled. Start with NIM_FLEET_SERVE=1'}), 404
+    if not fleet_aggregator.authorized(request.headers.get('X-Fleet-Token')):
+        return jsonify({'error': 'Invalid fleet token'}), 403
+    
+    from fleet import MAX_PAYLOAD, decompress
+    if (request.content_length or 0) > MAX_PAYLOAD:
+        return jsonify({'error': f'Payload exceeds {MAX_PAYLOAD} bytes'}), 413
+    # Bounded read: chunked uploads carry no Content-Length
+    body = request.stream.read(MAX_PAYLOAD + 1)
+    if len(body) > MAX_PAYLOAD:
+        return jsonify({'error': f'Payload exceeds {MAX_PAYLOAD} bytes'}), 413
+    size = len(body)
+    try:
+        if request.headers.get('Content-Encoding') == 'gzip':
+            body = decompress(body)
+        payload = json.loads(body)
+    except (ValueError, zlib.error) as e:
+        return jsonify({'error': f'Invalid payload: {e}'}), 400
+    
+    result = fleet_aggregator.ingest(payload, address=request.remote_addr, size=size)
+    if result.get('resync'):
+        return jsonify(result), 409
+    if not result['success']:
+        return jsonify(result), 400
+    return jsonify(result)
+
+@app.route('/api/fleet')
+def api_fleet():
+    """API endpoint to list fleet nodes with their staleness"""
+    if fleet_aggregator is None:
+        return jsonify({'error': 'Fleet aggregator disabled. Start with NIM_FLEET_SERVE=1'}), 404
+    return jsonify(fleet_aggregator.summary())
+
+@app.route('/api/fleet/agent')
+def api_fleet_agent():
+    """API endpoint to get this node's fleet agent status"""
+    return jsonify(network_manager.get_fleet_agent_status())
+
+@app.route('/api/fleet/<node>', methods=['GET', 'DELETE'])
+def api_fleet_node(node):
+    """API endpoint to get (or forget) one fleet node's merged state"""
+    if fleet_aggregator is None:
+        return jsonify({'error': 'Fleet aggregator disabled. Start with NIM_FLEET_SERVE=1'}), 404
+    
+    if request.method == 'DELETE':
+        if not fleet_aggregator.authorized(request.headers.get('X-Fleet-Token')):
+            return jsonify({'error': 'Invalid fleet token'}), 403
+        if not fleet_aggregator.forget(node):
+            return jsonify({'error': f'Unknown node {node}'}), 404
+        return jsonify({'success': True, 'message': f'Node {node} removed'})
+    
+    result = fleet_aggregator.get_node(node)
+    if result is None:
+        return jsonify({'error': f'Unknown node {node}'}), 404
+    return jsonify(result)
+
 @app.route('/api/mihomo')
 def api_mihomo_info():
     """API endpoint to get Mihomo service information"""
@@ -873,6 +1460,33 @@ def api_system_info():
     info['mihomo'] = network_manager.get_mihomo_info()
     return jsonify(info)
 
+@app.route('/api/debug/traces')
+def api_debug_traces():
+    """API endpoint to get the span trees of recent API requests (disabled by NIM_TRACE=0)"""
+    if not TRACE_ENABLED:
+        return jsonify({'error': 'Tracing disabled. Start without NIM_TRACE=0'}), 404
+    
+    limit = request.args.get('limit', type=int)
+    return jsonify({'traces': trace_log.get(limit)})
+
+@app.route('/api/debug/profile', methods=['GET', 'POST'])
+def api_debug_profile():
+    """API endpoint to profile the next N requests (requires NIM_DEBUG_PROFILE=1)"""
+    if not PROFILE_ENABLED:
+        return jsonify({'error': 'Profiling disabled. Start with NIM_DEBUG_PROFILE=1'}), 404
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        sort = data.get('sort', 'cumulative')
+        if sort not in ('cumulative', 'tottime', 'calls', 'ncalls'):
+            return jsonify({'error': 'Invalid sort. Use cumulative, tottime, calls or ncalls'}), 400
+        requests_count = data.get('requests', 1)
+        if not isinstance(requests_count, int) or requests_count < 0:
+            return jsonify({'error': 'requests must be a non-negative integer'}), 400
+        return jsonify(request_profiler.arm(requests_count, sort))
+    
+    return jsonify(request_profiler.report(request.args.get('limit', 40, type=int)))
+
 @app.route('/static/<path:filename>')
 def static_files(filename):
     """Serve static files"""
@@ -885,6 +1499,9 @@ def configure_usb_tethering():
         result = subprocess.run(['/home/acer/network-interface-manager/configure-usb-tethering.sh'], 
                               capture_output=True, text=True, timeout=30)
         
+        network_manager.journal.record('tethering', 'USB tethering configuration ' +
+                                       ('succeeded' if result.returncode == 0 else 'failed'),
+                                       severity='info' if result.returncode == 0 else 'error')
         if result.returncode == 0:
             return jsonify({
                 'success': True,
@@ -915,6 +1532,9 @@ def setup_load_balancing():
         result = subprocess.run(['/home/acer/network-interface-manager/setup-load-balancing.sh'], 
                               capture_output=True, text=True, timeout=30)
         
+        network_manager.journal.record('route', 'Load balancing setup ' +
+                                       ('succeeded' if result.returncode == 0 else 'failed'),
+                                       severity='info' if result.returncode == 0 else 'error')
         if result.returncode == 0:
             return jsonify({
                 'success': True,
@@ -967,12 +1587,21 @@ def monitor_usb_tethering():
 if __name__ == '__main__':
     print("🌐 Network Interface Manager")
     print("=" * 50)
-    print("Starting web server on port 5020...")
-    print("Access the interface at: http://localhost:5020")
+    print(f"Starting web server on port {PORT}...")
+    print(f"Access the interface at: http://localhost:{PORT}")
     print("=" * 50)
     
     # Check if running as root for some operations
     if os.geteuid() != 0:
         print("⚠️  Warning: Not running as root. Some operations may require sudo.")
     
-    app.run(host='0.0.0.0', port=5020, debug=True)
\ No newline at end of file
+    debug = True
+    
+    # Under the debug reloader only the child process serves requests
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Persist the last snapshot on shutdown, including systemd's SIGTERM
+        atexit.register(network_manager.shutdown)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        network_manager.start_background_tasks()
+    
+    app.run(host='0.0.0.0', port=PORT, debug=debug)
\ No newline at end of file
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Scalability benchmarks for Network Interface Manager
+
+Runs the Flask endpoints against a simulated system (see fakes.py) at
+several interface counts and reports, per endpoint, latency percentiles,
+commands/processes spawned per request and peak Python memory.
+
+    python3 benchmarks/bench.py --sizes 10,100,1000,5000
+    python3 benchmarks/bench.py --save-baseline benchmarks/baseline.json
+    python3 benchmarks/bench.py --compare benchmarks/baseline.json
+
+A comparison run exits with status 1 when an endpoint spawns more
+commands than its baseline, or its median latency grows beyond the
+tolerance. Command counts are deterministic and portable; latencies are
+only comparable on the same machine.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import SyntheticNetwork, FakeBackend
+
+ENDPOINTS = [
+    '/api/interfaces',
+    '/api/interface/{first}',
+    '/api/routing/health',
+    '/api/routing/gateways',
+    '/api/system',
+]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def load_app(scratch):
+    # Keep the benchmark away from the real warm snapshot and event journal
+    os.environ['NIM_SNAPSHOT_FILE'] = os.path.join(scratch, 'snapshot.json')
+    os.environ['NIM_JOURNAL_FILE'] = os.path.join(scratch, 'events.jsonl')
+    import app
+    return app
+
+
+def reset_manager(manager, backend):
+    manager.run_command = backend.run_command
+    manager.interface_stats_cache = {}
+    manager.last_update = 0
+    manager.warming_up = False
+    manager.warm_snapshot = {}
+    manager._wireless = manager._mihomo = manager._prober = None
+    if manager._health:
+        manager._health.close()
+    # Health rules read through the fake backend, not host netlink events
+    from health import RoutingHealth
+    manager._health = RoutingHealth(backend.run_command, probe=manager.probe_gateway, watch=False)
+
+
+def run_scenario(app_module, count, args, scratch):
+    root = os.path.join(scratch, f'sys-{count}')
+    network = SyntheticNetwork(count, root, gateway_ratio=args.gateway_ratio, nexthops=args.nexthops,
+                               unreachable_ratio=args.unreachable_ratio)
+    backend = FakeBackend(network, probe_ms=args.probe_ms, probe_timeout_ms=args.probe_timeout_ms,
+                          spawn_ms=args.spawn_ms)
+    manager = app_module.network_manager
+    reset_manager(manager, backend)
+    client = app_module.app.test_client()
+    first = next(name for name in network.interfaces if name != 'lo')
+
+    results = {}
+    for template in ENDPOINTS:
+        path = template.format(first=first)
+        samples = []
+        commands = processes = 0
+        for _ in range(args.iterations):
+            # Every iteration measures a cold collection
+            manager.last_update = 0
+            manager._health.invalidate()
+            backend.reset_counts()
+            start = time.perf_counter()
+            response = client.get(path)
+            samples.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f'{path} returned {response.status_code}')
+            commands, processes = backend.commands, backend.processes
+
+        manager.last_update = 0
+        tracemalloc.start()
+        client.get(path)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[template] = {
+            'p50_ms': round(percentile(samples, 50), 2),
+            'p90_ms': round(percentile(samples, 90), 2),
+            'p99_ms': round(percentile(samples, 99), 2),
+            'max_ms': round(max(samples), 2),
+            'commands': commands,
+            'processes': processes,
+            'peak_kb': round(peak / 1024, 1),
+        }
+        if backend.unknown:
+            results[template]['unknown_commands'] = sorted(set(backend.unknown))[:5]
+
+    shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def compare(report, baseline, tolerance, slack_ms):
+    """Return a list of regressions of report against baseline"""
+    regressions = []
+    for size, endpoints in baseline.get('scenarios', {}).items():
+        for endpoint, base in endpoints.items():
+            current = report['scenarios'].get(size, {}).get(endpoint)
+            if current is None:
+                continue
+            label = f'{endpoint} @ {size} interfaces'
+            if current['commands'] > base['commands']:
+                regressions.append(f"{label}: commands {base['commands']} -> {current['commands']}")
+            limit = base['p50_ms'] * (1 + tolerance) + slack_ms
+            if current['p50_ms'] > limit:
+                regressions.append(f"{label}: p50 {base['p50_ms']}ms -> {current['p50_ms']}ms "
+                                   f"(limit {limit:.1f}ms)")
+    return regressions
+
+
+def print_table(report):
+    print(f"{'size':>6}  {'endpoint':<24} {'p50':>9} {'p90':>9} {'p99':>9} {'cmds':>7} {'procs':>7} {'peak KB':>9}")
+    for size, endpoints in report['scenarios'].items():
+        for endpoint, r in endpoints.items():
+            print(f"{size:>6}  {endpoint:<24} {r['p50_ms']:>9.2f} {r['p90_ms']:>9.2f} {r['p99_ms']:>9.2f} "
+                  f"{r['commands']:>7} {r['processes']:>7} {r['peak_kb']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Network Interface Manager scalability benchmarks')
+    parser.add_argument('--sizes', default='10,100,1000', help='Comma-separated interface counts (10 to 5000)')
+    parser.add_argument('--iterations', type=int, default=5, help='Requests per endpoint and size')
+    parser.add_argument('--nexthops', type=int, default=2, help='Nexthops in the multipath default route')
+    parser.add_argument('--gateway-ratio', type=float, default=0.05, help='Share of UP interfaces with a gateway')
+    parser.add_argument('--unreachable-ratio', type=float, default=0.0, help='Share of gateways not answering pings')
+    parser.add_argument('--probe-ms', type=float, default=1.0, help='Simulated ping round trip')
+    parser.add_argument('--probe-timeout-ms', type=float, default=2.0, help='Simulated cost of an unanswered ping')
+    parser.add_argument('--spawn-ms', type=float, default=0.0, help='Simulated cost per spawned process')
+    parser.add_argument('--json', action='store_true', help='Print the full report as JSON')
+    parser.add_argument('--save-baseline', metavar='FILE', help='Store this run as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='Fail if this run regresses against a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative p50 growth')
+    parser.add_argument('--slack-ms', type=float, default=2.0, help='Allowed absolute p50 growth')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if any(not 1 <= size <= 5000 for size in sizes):
+        parser.error('sizes must be between 1 and 5000')
+
+    scratch = tempfile.mkdtemp(prefix='nim-bench-')
+    try:
+        app_module = load_app(scratch)
+        report = {
+            'created': time.time(),
+            'python': sys.version.split()[0],
+            'settings': {key: value for key, value in vars(args).items()
+                         if key not in ('json', 'save_baseline', 'compare')},
+            'scenarios': {}
+        }
+        for size in sizes:
+            report['scenarios'][str(size)] = run_scenario(app_module, size, args, scratch)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_table(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.slack_ms)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Simulated system backends for the Network Interface Manager benchmarks
+
+SyntheticNetwork generates N interfaces with addresses, gateways and a
+multipath default route, and writes a matching /sys/class/net tree to a
+scratch directory. FakeBackend stands in for NetworkManager.run_command:
+it answers the `ip`, `cat /sys/...`, `ping` and other commands the app
+issues from that model, sleeps for the configured probe latencies, and
+counts every command and pipeline process it would have spawned.
+"""
+
+import os
+import re
+import time
+import random
+import shlex
+
+SYSFS_PREFIX = '/sys/class/net/'
+
+# Name patterns cycled through when generating interfaces
+INTERFACE_KINDS = [
+    ('eth', 'ethernet'),
+    ('enx', 'usb'),
+    ('wlan', 'wireless'),
+    ('usb', 'usb'),
+    ('tun', 'vpn'),
+    ('ppp', 'ppp'),
+]
+
+
+class SyntheticInterface:
+    def __init__(self, index, name, kind, up, address, gateway, mtu, speed):
+        self.index = index
+        self.name = name
+        self.kind = kind
+        self.up = up
+        self.address = address
+        self.gateway = gateway
+        self.mtu = mtu
+        self.speed = speed
+        self.mac = '02:00:%02x:%02x:%02x:%02x' % ((index >> 24) & 0xff, (index >> 16) & 0xff,
+                                                 (index >> 8) & 0xff, index & 0xff)
+        self.default_metric = None
+        self.reachable = True
+
+
+class SyntheticNetwork:
+    def __init__(self, count, root, gateway_ratio=0.5, nexthops=2, down_ratio=0.1,
+                 unreachable_ratio=0.0, seed=1):
+        self.root = root
+        self.interfaces = {}
+        self.multipath = []
+        rng = random.Random(seed)
+
+        self._add(SyntheticInterface(1, 'lo', 'loopback', True, '127.0.0.1/8', None, 65536, None))
+        for i in range(max(0, count - 1)):
+            prefix, kind = INTERFACE_KINDS[i % len(INTERFACE_KINDS)]
+            name = f"enx{i:012x}" if prefix == 'enx' else f"{prefix}{i}"
+            up = rng.random() >= down_ratio
+            subnet = f"10.{i // 250}.{i % 250}"
+            gateway = f"{subnet}.1" if up and rng.random() < gateway_ratio else None
+            speed = 1000 if kind == 'ethernet' else (100 if kind == 'usb' else None)
+            iface = SyntheticInterface(i + 2, name, kind, up, f"{subnet}.2/24", gateway, 1500, speed)
+            iface.reachable = rng.random() >= unreachable_ratio
+            self._add(iface)
+
+        with_gateway = [iface for iface in self.interfaces.values() if iface.gateway]
+        self.multipath = with_gateway[:nexthops] if nexthops > 1 else []
+        for metric, iface in enumerate(with_gateway[len(self.multipath):], start=100):
+            iface.default_metric = metric
+
+        self.gateways = {iface.gateway: iface for iface in with_gateway}
+        self.write_sysfs()
+        self._render()
+
+    def _add(self, iface):
+        self.interfaces[iface.name] = iface
+
+    def write_sysfs(self):
+        """Write a /sys/class/net-like tree for every interface"""
+        for iface in self.interfaces.values():
+            base = os.path.join(self.root, iface.name)
+            os.makedirs(os.path.join(base, 'statistics'), exist_ok=True)
+            files = {
+                'mtu': iface.mtu,
+                'carrier': 1 if iface.up else 0,
+                'operstate': 'up' if iface.up else 'down',
+                'address': iface.mac,
+                'ifindex': iface.index,
+            }
+            if iface.speed:
+                files['speed'] = iface.speed
+            for stat in ('rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets', 'rx_errors', 'tx_errors'):
+                files[f'statistics/{stat}'] = iface.index * 1000 + len(stat)
+            for path, value in files.items():
+                with open(os.path.join(base, path), 'w') as f:
+                    f.write(f"{value}\n")
+            if iface.kind == 'usb':
+                device = os.path.join(base, 'device')
+                if not os.path.islink(device):
+                    os.symlink(f'../../../devices/pci0000:00/usb1/1-{iface.index}/1-{iface.index}:1.0', device)
+
+    def _flags(self, iface):
+        if iface.name == 'lo':
+            return 'LOOPBACK,UP,LOWER_UP' if iface.up else 'LOOPBACK'
+        return 'BROADCAST,MULTICAST,UP,LOWER_UP' if iface.up else 'BROADCAST,MULTICAST'
+
+    def _render(self):
+        """Pre-render command output so lookups stay cheap at 5,000 interfaces"""
+        link, addr, link_oneline, addr_oneline = [], [], [], []
+        for iface in self.interfaces.values():
+            state = 'UP' if iface.up else 'DOWN'
+            header = (f"{iface.index}: {iface.name}: <{self._flags(iface)}> mtu {iface.mtu} "
+                      f"qdisc fq_codel state {state}")
+            link.append(f"{header} mode DEFAULT group default qlen 1000")
+            link.append(f"    link/ether {iface.mac} brd ff:ff:ff:ff:ff:ff")
+            addr.append(f"{header} group default qlen 1000")
+            addr.append(f"    link/ether {iface.mac} brd ff:ff:ff:ff:ff:ff")
+            addr.append(f"    inet {iface.address} scope global {iface.name}")
+            addr.append("       valid_lft forever preferred_lft forever")
+            link_oneline.append(f"{header} mode DEFAULT group default qlen 1000\\"
+                                f"    link/ether {iface.mac} brd ff:ff:ff:ff:ff:ff")
+            addr_oneline.append(f"{iface.index}: {iface.name}    inet {iface.address} scope global {iface.name}\\"
+                                f"       valid_lft forever preferred_lft forever")
+            if iface.name != 'lo':
+                addr.append(f"    inet6 fe80::{iface.index:x}/64 scope link")
+                addr.append("       valid_lft forever preferred_lft forever")
+        self.ip_link = '\n'.join(link)
+        self.ip_addr = '\n'.join(addr)
+        self.ip_link_oneline = '\n'.join(link_oneline)
+        self.ip_addr_oneline = '\n'.join(addr_oneline)
+        self.ip_rule = '0:\tfrom all lookup local\n32766:\tfrom all lookup main\n32767:\tfrom all lookup default'
+
+        defaults = []
+        if self.multipath:
+            defaults.append("default proto static scope global metric 50")
+            for iface in self.multipath:
+                defaults.append(f"\tnexthop via {iface.gateway} dev {iface.name} weight 1")
+        for iface in self.interfaces.values():
+            if iface.default_metric is not None:
+                defaults.append(f"default via {iface.gateway} dev {iface.name} proto dhcp metric {iface.default_metric}")
+        self.ip_route_default = '\n'.join(defaults)
+
+        connected = [f"{iface.address.replace('.2/24', '.0/24')} dev {iface.name} proto kernel scope link "
+                     f"src {iface.address.split('/')[0]}"
+                     for iface in self.interfaces.values() if iface.up and iface.name != 'lo']
+        self.ip_route = '\n'.join(defaults + connected)
+
+
+class FakeBackend:
+    """Drop-in replacement for NetworkManager.run_command"""
+
+    def __init__(self, network, probe_ms=1.0, probe_timeout_ms=50.0, spawn_ms=0.0):
+        self.network = network
+        self.probe_ms = probe_ms
+        self.probe_timeout_ms = probe_timeout_ms
+        self.spawn_ms = spawn_ms
+        self.handlers = [
+            (re.compile(r'^ip link show$'), self._ip_link),
+            (re.compile(r'^ip -o link show$'), lambda m: self._ok(self.network.ip_link_oneline)),
+            (re.compile(r'^ip -o -4 addr show$'), lambda m: self._ok(self.network.ip_addr_oneline)),
+            (re.compile(r'^ip -4 route show table all$'), self._ip_route),
+            (re.compile(r'^ip rule show$'), lambda m: self._ok(self.network.ip_rule)),
+            (re.compile(r'^ip link show \| grep (\S+)$'), self._ip_link_grep),
+            (re.compile(r'^ip addr show$'), self._ip_addr),
+            (re.compile(r'^ip route show$'), self._ip_route),
+            (re.compile(r'^ip route show default$'), self._ip_route_default),
+            (re.compile(r'^ip route show dev (\S+) \| grep default$'), self._ip_route_dev),
+            (re.compile(r'^cat (/sys/class/net/\S+)'), self._cat_sysfs),
+            (re.compile(r'^readlink (/sys/class/net/\S+)'), self._readlink),
+            (re.compile(r'^dmesg \|'), self._no_match),
+            (re.compile(r'^systemd-resolve --status (\S+)'), self._resolve),
+            (re.compile(r'^cat /etc/resolv.conf$'), lambda m: self._ok('nameserver 127.0.0.53')),
+            (re.compile(r'^(sudo )?ping '), self._ping),
+            (re.compile(r'^hostname$'), lambda m: self._ok('bench-host')),
+            (re.compile(r'^uname -r$'), lambda m: self._ok('6.1.0-bench')),
+            (re.compile(r'^uptime -p$'), lambda m: self._ok('up 1 hour')),
+            (re.compile(r'^systemctl is-active mihomo'), self._no_match),
+            (re.compile(r'^cat /etc/mihomo/'), self._no_match),
+        ]
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.commands = 0
+        self.processes = 0
+        self.by_program = {}
+        self.unknown = []
+
+    def run_command(self, cmd, timeout=10, input=None):
+        self.commands += 1
+        stages = [stage for stage in re.split(r'\|\||\||&&', cmd) if stage.strip()]
+        self.processes += len(stages)
+        program = cmd.split()[1] if cmd.startswith('sudo ') else cmd.split()[0]
+        self.by_program[program] = self.by_program.get(program, 0) + 1
+        if self.spawn_ms:
+            time.sleep(self.spawn_ms * len(stages) / 1000)
+
+        for pattern, handler in self.handlers:
+            match = pattern.match(cmd)
+            if match:
+                return handler(match)
+        self.unknown.append(cmd)
+        return {'success': False, 'output': '', 'error': 'Unknown command (benchmark backend)', 'returncode': 127}
+
+    @staticmethod
+    def _ok(output):
+        return {'success': True, 'output': output, 'error': '', 'returncode': 0}
+
+    @staticmethod
+    def _fail(error='', returncode=1):
+        return {'success': False, 'output': '', 'error': error, 'returncode': returncode}
+
+    def _no_match(self, match):
+        return self._fail()
+
+    def _ip_link(self, match):
+        return self._ok(self.network.ip_link)
+
+    def _ip_link_grep(self, match):
+        lines = [line for line in self.network.ip_link.split('\n') if match.group(1) in line]
+        return self._ok('\n'.join(lines)) if lines else self._fail()
+
+    def _ip_addr(self, match):
+        return self._ok(self.network.ip_addr)
+
+    def _ip_route(self, match):
+        return self._ok(self.network.ip_route)
+
+    def _ip_route_default(self, match):
+        return self._ok(self.network.ip_route_default)
+
+    def _ip_route_dev(self, match):
+        iface = self.network.interfaces.get(match.group(1))
+        if iface is None:
+            return self._fail(f'Cannot find device "{match.group(1)}"')
+        if iface.default_metric is None:
+            return self._fail()
+        return self._ok(f"default via {iface.gateway} proto dhcp metric {iface.default_metric}")
+
+    def _sysfs_path(self, path):
+        return os.path.join(self.network.root, path[len(SYSFS_PREFIX):])
+
+    def _cat_sysfs(self, match):
+        try:
+            with open(self._sysfs_path(match.group(1))) as f:
+                return self._ok(f.read().strip())
+        except OSError as e:
+            return self._fail(str(e))
+
+    def _readlink(self, match):
+        try:
+            return self._ok(os.readlink(self._sysfs_path(match.group(1))))
+        except OSError:
+            return self._fail()
+
+    def _resolve(self, match):
+        iface = self.network.interfaces.get(match.group(1))
+        if iface is None or not iface.gateway:
+            return self._fail()
+        return self._ok(f"Link {iface.index} ({iface.name})\n      Current Scopes: DNS\n"
+                        f"       DNS Servers: {iface.gateway}")
+
+    def _ping(self, match):
+        args = shlex.split(match.string)
+        host = args[-1]
+        count = int(args[args.index('-c') + 1]) if '-c' in args else 1
+        iface = self.network.gateways.get(host)
+        reachable = host == '8.8.8.8' or (iface is not None and iface.reachable)
+        if reachable:
+            time.sleep(self.probe_ms * count / 1000)
+            return self._ok(f"{count} packets transmitted, {count} received")
+        time.sleep(self.probe_timeout_ms / 1000)
+        return self._fail(f"{count} packets transmitted, 0 received", returncode=1)
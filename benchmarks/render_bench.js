@@ -0,0 +1,243 @@
+#!/usr/bin/env node
+/*
+ * Browser-free dashboard render benchmark for Network Interface Manager
+ *
+ * Loads static/js/cards.js and app.js under Node with a minimal counting DOM and
+ * renders N synthetic interfaces through the keyed card list, then
+ * replays typical refresh ticks. Each tick is compared with the old
+ * full re-render (grid.innerHTML = every card), which rebuilds every
+ * card on every refresh.
+ *
+ *     node benchmarks/render_bench.js [--count 500] [--ticks 20] [--json]
+ */
+
+const path = require('path');
+
+// Counting stand-ins for the few DOM calls the card list makes
+const ops = { created: 0, inserted: 0, replaced: 0, removed: 0, textWrites: 0 };
+
+class FakeNode {
+    constructor(html, fields) {
+        this.html = html;
+        this.parentNode = null;
+        this.fieldNodes = {};
+        for (const field of fields) {
+            const node = { _text: '' };
+            Object.defineProperty(node, 'textContent', {
+                get() { return this._text; },
+                set(value) { ops.textWrites++; this._text = value; }
+            });
+            this.fieldNodes[field] = node;
+        }
+        this.dataset = {};
+        const pattern = /data-(interface|type|status)="([^"]*)"/g;
+        let match;
+        while ((match = pattern.exec(html)) !== null) this.dataset[match[1]] = match[2];
+        this.style = {};
+    }
+
+    get nextElementSibling() {
+        const siblings = this.parentNode.children;
+        return siblings[siblings.indexOf(this) + 1] || null;
+    }
+
+    querySelector(selector) {
+        const match = /data-field="(\w+)"/.exec(selector);
+        return match ? this.fieldNodes[match[1]] || null : null;
+    }
+
+    remove() {
+        if (!this.parentNode) return;
+        ops.removed++;
+        const siblings = this.parentNode.children;
+        siblings.splice(siblings.indexOf(this), 1);
+        this.parentNode = null;
+    }
+}
+
+class FakeContainer {
+    constructor() {
+        this.children = [];
+    }
+
+    get firstElementChild() {
+        return this.children[0] || null;
+    }
+
+    set textContent(value) {
+        this.children.forEach(child => { child.parentNode = null; });
+        this.children = [];
+    }
+
+    insertBefore(node, reference) {
+        if (node.parentNode === this) this.children.splice(this.children.indexOf(node), 1);
+        const index = reference ? this.children.indexOf(reference) : this.children.length;
+        this.children.splice(index, 0, node);
+        node.parentNode = this;
+        ops.inserted++;
+    }
+
+    replaceChild(node, old) {
+        this.children[this.children.indexOf(old)] = node;
+        old.parentNode = null;
+        node.parentNode = this;
+        ops.replaced++;
+    }
+}
+
+function createElement(html) {
+    ops.created++;
+    const fields = [];
+    const pattern = /data-field="(\w+)"/g;
+    let match;
+    while ((match = pattern.exec(html)) !== null) fields.push(match[1]);
+    return new FakeNode(html, fields);
+}
+
+global.document = { addEventListener() {} };
+const { KeyedCardList } = require(path.join(__dirname, '..', 'static', 'js', 'cards.js'));
+const { NetworkInterfaceManager } = require(path.join(__dirname, '..', 'static', 'js', 'app.js'));
+
+function formatBytes(bytes) {
+    if (bytes === 0) return '0 B';
+    const sizes = ['B', 'KB', 'MB', 'GB', 'TB'];
+    const i = Math.floor(Math.log(bytes) / Math.log(1024));
+    return parseFloat((bytes / Math.pow(1024, i)).toFixed(2)) + ' ' + sizes[i];
+}
+
+function syntheticInterfaces(count) {
+    const types = ['ethernet', 'wireless', 'usb', 'vpn', 'ppp'];
+    const interfaces = {};
+    for (let i = 0; i < count; i++) {
+        const rx = (i + 1) * 1048576;
+        const tx = (i + 1) * 524288;
+        interfaces[`if${i}`] = {
+            type: types[i % types.length],
+            state: i % 10 === 0 ? 'DOWN' : 'UP',
+            mtu: 1500,
+            speed: i % 2 ? '1000' : null,
+            addresses: [{ address: `10.${i >> 8}.${i & 255}.2/24`, type: 'inet' }],
+            stats: { rx_bytes: rx, tx_bytes: tx, rx_formatted: formatBytes(rx), tx_formatted: formatBytes(tx) }
+        };
+    }
+    return interfaces;
+}
+
+// One refresh worth of changes: traffic on active links, a few state flips,
+// and occasionally an interface coming and going
+function tick(interfaces, round) {
+    const names = Object.keys(interfaces);
+    names.forEach((name, i) => {
+        const iface = interfaces[name];
+        if (iface.state === 'UP' && i % 5 === round % 5) {
+            iface.stats.rx_bytes += 65536 * (round + 1);
+            iface.stats.tx_bytes += 16384 * (round + 1);
+            iface.stats.rx_formatted = formatBytes(iface.stats.rx_bytes);
+            iface.stats.tx_formatted = formatBytes(iface.stats.tx_bytes);
+        }
+    });
+    const flip = names[(round * 37) % names.length];
+    interfaces[flip].state = interfaces[flip].state === 'UP' ? 'DOWN' : 'UP';
+    if (round % 4 === 3) {
+        const gone = names[(round * 53) % names.length];
+        const copy = interfaces[gone];
+        delete interfaces[gone];
+        interfaces[`${gone}.new`] = copy;
+    }
+}
+
+function renderer() {
+    const manager = Object.create(NetworkInterfaceManager.prototype);
+    manager.cardList = new KeyedCardList(new FakeContainer(), createElement);
+    const filter = { type: '', status: '', search: '' };
+    return interfaces => manager.cardList.update(
+        Object.entries(interfaces).map(([name, iface]) => ({
+            key: name,
+            signature: manager.cardSignature(name, iface),
+            fields: manager.cardFields(iface),
+            render: () => manager.createInterfaceCard(name, iface)
+        })),
+        card => manager.applyFilter(card, filter)
+    );
+}
+
+function fullRender(interfaces) {
+    // What grid.innerHTML = cards.join('') costs: every card parsed again
+    const manager = Object.create(NetworkInterfaceManager.prototype);
+    const html = Object.entries(interfaces).map(([name, iface]) => manager.createInterfaceCard(name, iface));
+    html.forEach(card => createElement(card));
+    return html.length;
+}
+
+function resetOps() {
+    Object.keys(ops).forEach(key => { ops[key] = 0; });
+}
+
+function domOps() {
+    return ops.created + ops.inserted + ops.replaced + ops.removed + ops.textWrites;
+}
+
+function main() {
+    const args = process.argv.slice(2);
+    const option = (name, fallback) => {
+        const index = args.indexOf(name);
+        return index >= 0 ? Number(args[index + 1]) : fallback;
+    };
+    const count = option('--count', 500);
+    const ticks = option('--ticks', 20);
+
+    const interfaces = syntheticInterfaces(count);
+    const render = renderer();
+
+    resetOps();
+    let start = process.hrtime.bigint();
+    render(interfaces);
+    const initial = { ms: Number(process.hrtime.bigint() - start) / 1e6, dom_ops: domOps() };
+
+    const keyed = { ms: 0, dom_ops: 0, rebuilt: 0, patched: 0, unchanged: 0 };
+    const full = { ms: 0, dom_ops: 0 };
+    for (let round = 0; round < ticks; round++) {
+        tick(interfaces, round);
+
+        resetOps();
+        start = process.hrtime.bigint();
+        const stats = render(interfaces);
+        keyed.ms += Number(process.hrtime.bigint() - start) / 1e6;
+        keyed.dom_ops += domOps();
+        keyed.rebuilt += stats.created + stats.rebuilt;
+        keyed.patched += stats.patched;
+        keyed.unchanged += stats.unchanged;
+
+        resetOps();
+        start = process.hrtime.bigint();
+        fullRender(interfaces);
+        full.ms += Number(process.hrtime.bigint() - start) / 1e6;
+        full.dom_ops += domOps();
+    }
+
+    const perTick = value => Math.round(value / ticks * 100) / 100;
+    const report = {
+        interfaces: count,
+        ticks,
+        initial_render: { ms: Math.round(initial.ms * 100) / 100, dom_ops: initial.dom_ops },
+        keyed_per_tick: {
+            ms: perTick(keyed.ms), dom_ops: perTick(keyed.dom_ops), cards_rebuilt: perTick(keyed.rebuilt),
+            cards_patched: perTick(keyed.patched), cards_unchanged: perTick(keyed.unchanged)
+        },
+        full_per_tick: { ms: perTick(full.ms), dom_ops: perTick(full.dom_ops), cards_rebuilt: count }
+    };
+
+    if (args.includes('--json')) {
+        console.log(JSON.stringify(report, null, 2));
+        return;
+    }
+    console.log(`${count} interfaces, ${ticks} refresh ticks`);
+    console.log(`initial render: ${report.initial_render.ms} ms, ${report.initial_render.dom_ops} DOM ops`);
+    console.log(`keyed per tick: ${report.keyed_per_tick.ms} ms, ${report.keyed_per_tick.dom_ops} DOM ops, ` +
+                `${report.keyed_per_tick.cards_rebuilt} rebuilt, ${report.keyed_per_tick.cards_patched} patched, ` +
+                `${report.keyed_per_tick.cards_unchanged} unchanged`);
+    console.log(`full per tick:  ${report.full_per_tick.ms} ms, ${report.full_per_tick.dom_ops} DOM ops, ` +
+                `${count} rebuilt`);
+}
+
+main();
@@ -0,0 +1,644 @@
+#!/usr/bin/env python3
+"""
+Known-good configuration checkpoints for Network Interface Manager
+
+A checkpoint records link state, MTU and addresses of every interface,
+the IPv4 routes of the main and policy tables, and the `ip rule` list.
+Routes and rules are stored as the `ip route` / `ip rule` arguments that
+recreate them, in gzip'd JSON, so a typical router fits in well under a
+kilobyte.
+
+Restoring compares the checkpoint with the live state and applies only
+the difference as one IpBatch: addresses are added first, then routes
+and rules, and old addresses are removed last. A failure anywhere rolls
+the whole batch back. Interfaces that appeared after the checkpoint was
+taken are left alone.
+
+Any change can be guarded with confirm-or-revert: the current state is
+saved as the `before-change` checkpoint and restored automatically unless
+the change is confirmed within N seconds. The deadline is kept in
+guard.json next to the checkpoints, so a restart re-arms the guard, or
+reverts at once when the deadline passed while the app was down.
+
+    python3 checkpoints.py save known-good
+    python3 checkpoints.py restore known-good --confirm-within 60
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import socket
+import select
+import argparse
+import threading
+import subprocess
+import logging
+
+from ipbatch import IpBatch, BulkInterfaceConfig
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CHECKPOINT_DIR = os.environ.get('NIM_CHECKPOINT_DIR', os.path.join(BASE_DIR, 'checkpoints'))
+
+FORMAT_VERSION = 1
+NAME_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+# Checkpoint holding the state from before a guarded change
+GUARD_CHECKPOINT = 'before-change'
+GUARD_FILE = 'guard.json'
+CONFIRM_MIN = 5
+CONFIRM_MAX = 3600
+
+# Rules every system has; never captured or removed
+BUILTIN_RULES = {(0, 'local'), (32766, 'main'), (32767, 'default')}
+# Route metrics that `ip route add` takes as plain integers
+ROUTE_METRICS = ('mtu', 'advmss', 'initcwnd', 'initrwnd')
+
+
+def valid_name(name):
+    return isinstance(name, str) and bool(NAME_RE.match(name)) and not name.startswith('.')
+
+
+def route_spec(route):
+    """`ip route` arguments recreating a route from `ip -j route` output"""
+    parts = []
+    if route.get('type', 'unicast') != 'unicast':
+        parts.append(route['type'])
+    parts.append(route['dst'])
+    if not route.get('nexthops'):
+        if route.get('gateway'):
+            parts += ['via', route['gateway']]
+        if route.get('dev'):
+            parts += ['dev', route['dev']]
+    if route.get('protocol'):
+        parts += ['proto', route['protocol']]
+    if route.get('scope'):
+        parts += ['scope', route['scope']]
+    if route.get('prefsrc'):
+        parts += ['src', route['prefsrc']]
+    if route.get('metric'):
+        parts += ['metric', str(route['metric'])]
+    if route.get('table', 'main') != 'main':
+        parts += ['table', route['table']]
+    for metrics in route.get('metrics', []):
+        for key in ROUTE_METRICS:
+            if isinstance(metrics.get(key), int):
+                parts += [key, str(metrics[key])]
+    if 'onlink' in route.get('flags', []):
+        parts.append('onlink')
+    for nexthop in route.get('nexthops', []):
+        parts.append('nexthop')
+        if nexthop.get('gateway'):
+            parts += ['via', nexthop['gateway']]
+        if nexthop.get('dev'):
+            parts += ['dev', nexthop['dev']]
+        parts += ['weight', str(nexthop.get('weight', 1))]
+        if 'onlink' in nexthop.get('flags', []):
+            parts.append('onlink')
+    return ' '.join(parts)
+
+
+def route_devices(route):
+    devices = {route['dev']} if route.get('dev') else set()
+    return devices | {nh['dev'] for nh in route.get('nexthops', []) if nh.get('dev')}
+
+
+def route_key(route):
+    """Kernel identity of an IPv4 route: a second add with it fails"""
+    return (route.get('table', 'main'), route['dst'], route.get('metric', 0))
+
+
+def rule_spec(rule):
+    """`ip rule` arguments recreating a rule from `ip -j rule` output"""
+    parts = ['pref', str(rule['priority'])]
+    if rule.get('not'):
+        parts.append('not')
+    for key, word in (('src', 'from'), ('dst', 'to')):
+        if rule.get(key, 'all') != 'all':
+            length = rule.get(f'{key}len')
+            parts += [word, f"{rule[key]}/{length}" if length is not None else rule[key]]
+    if rule.get('fwmark'):
+        parts += ['fwmark', f"{rule['fwmark']}/{rule['fwmask']}" if rule.get('fwmask') else rule['fwmark']]
+    for key in ('iif', 'oif', 'ipproto', 'sport', 'dport'):
+        if rule.get(key) is not None:
+            parts += [key, str(rule[key])]
+    if rule.get('table'):
+        parts += ['lookup', rule['table']]
+        if rule.get('suppress_prefixlen') is not None:
+            parts += ['suppress_prefixlength', str(rule['suppress_prefixlen'])]
+    elif rule.get('action') == 'goto':
+        parts += ['goto', str(rule.get('target'))]
+    elif rule.get('action'):
+        parts.append(rule['action'])
+    return ' '.join(parts)
+
+
+def rule_devices(rule):
+    return {rule[key] for key in ('iif', 'oif') if rule.get(key)}
+
+
+class ConfigCheckpoints:
+    def __init__(self, run_command, directory=CHECKPOINT_DIR, on_event=None):
+        self.run_command = run_command
+        self.directory = directory
+        # on_event(event, message, severity, **details)
+        self.on_event = on_event
+        self._lock = threading.RLock()
+        self._guard = None
+        self._guard_token = 0
+
+    def _event(self, event, message, severity='info', **details):
+        if self.on_event:
+            try:
+                self.on_event(event, message, severity, **details)
+            except Exception as e:
+                logger.error(f"Checkpoint event callback failed: {e}")
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.json.gz")
+
+    def _guard_path(self):
+        return os.path.join(self.directory, GUARD_FILE)
+
+    def _write_guard(self, guard):
+        """Persist a pending guard, or remove the file for None; raises OSError"""
+        path = self._guard_path()
+        if guard is None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        temp = path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump({key: guard[key] for key in ('checkpoint', 'reason', 'armed_at', 'deadline')}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+
+    def _read_json(self, command):
+        result = self.run_command(command)
+        if not result['success']:
+            return None
+        try:
+            return json.loads(result['output'] or '[]')
+        except ValueError:
+            return None
+
+    def read_routes(self):
+        """Configured IPv4 routes of every table but local, as raw `ip -j` dicts"""
+        routes = self._read_json("ip -j -4 route show table all")
+        if routes is None:
+            return None
+        return [r for r in routes
+                if r.get('table') != 'local' and r.get('protocol') != 'kernel'
+                and r.get('type', 'unicast') not in ('local', 'broadcast', 'multicast')]
+
+    def read_rules(self):
+        rules = self._read_json("ip -j -4 rule show")
+        if rules is None:
+            return None
+        return [r for r in rules
+                if not (r.get('src', 'all') == 'all' and (r.get('priority'), r.get('table')) in BUILTIN_RULES)]
+
+    def capture(self):
+        """Current configuration in checkpoint form, None if it cannot be read"""
+        links = BulkInterfaceConfig(self.run_command).read_current()
+        routes = self.read_routes()
+        rules = self.read_rules()
+        if links is None or routes is None or rules is None:
+            return None
+        return {
+            'version': FORMAT_VERSION,
+            'created': round(time.time(), 3),
+            'hostname': socket.gethostname(),
+            'links': {
+                name: {
+                    'up': link['up'],
+                    'mtu': link['mtu'],
+                    # SLAAC and privacy addresses belong to the kernel
+                    'addresses': [a for a, info in link['addresses'].items()
+                                  if not (info.get('dynamic') and info.get('family') == 'inet6')]
+                }
+                for name, link in links.items() if name != 'lo'
+            },
+            'routes': [route_spec(r) for r in routes],
+            'rules': [rule_spec(r) for r in rules],
+        }
+
+    def save(self, name):
+        """Capture the current configuration under a name"""
+        if not valid_name(name):
+            return {'success': False, 'error': 'Invalid checkpoint name (letters, digits, . _ -)'}
+        checkpoint = self.capture()
+        if checkpoint is None:
+            return {'success': False, 'error': 'Cannot read current network configuration'}
+        checkpoint['name'] = name
+
+        data = gzip.compress(json.dumps(checkpoint, separators=(',', ':')).encode(), mtime=0)
+        with self._lock:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                temp = self._path(name) + '.tmp'
+                with open(temp, 'wb') as f:
+                    f.write(data)
+                os.replace(temp, self._path(name))
+            except OSError as e:
+                return {'success': False, 'error': f'Cannot write checkpoint: {e}'}
+
+        return {'success': True, 'message': f'Checkpoint {name} saved', 'name': name, 'size': len(data),
+                'interfaces': len(checkpoint['links']), 'routes': len(checkpoint['routes']),
+                'rules': len(checkpoint['rules'])}
+
+    def load(self, name):
+        if not valid_name(name):
+            return None
+        try:
+            with gzip.open(self._path(name), 'rb') as f:
+                checkpoint = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        return checkpoint if checkpoint.get('version') == FORMAT_VERSION else None
+
+    def delete(self, name):
+        if not valid_name(name):
+            return {'success': False, 'error': 'Invalid checkpoint name'}
+        if name == GUARD_CHECKPOINT and self.get_guard():
+            return {'success': False, 'error': f'Checkpoint {name} is needed by a pending change guard'}
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            return {'success': False, 'error': f'Checkpoint {name} not found'}
+        return {'success': True, 'message': f'Checkpoint {name} deleted'}
+
+    def list(self):
+        checkpoints = []
+        try:
+            files = sorted(f for f in os.listdir(self.directory) if f.endswith('.json.gz'))
+        except FileNotFoundError:
+            files = []
+        for filename in files:
+            name = filename[:-len('.json.gz')]
+            checkpoint = self.load(name)
+            if checkpoint is None:
+                continue
+            checkpoints.append({
+                'name': name,
+                'created': checkpoint['created'],
+                'hostname': checkpoint.get('hostname'),
+                'size': os.path.getsize(self._path(name)),
+                'interfaces': sorted(checkpoint['links']),
+                'routes': len(checkpoint['routes']),
+                'rules': len(checkpoint['rules'])
+            })
+        return {'success': True, 'checkpoints': checkpoints, 'guard': self.get_guard()}
+
+    def plan(self, checkpoint):
+        """Batch turning the live configuration into a checkpoint, return (batch, warnings, error)"""
+        bulk = BulkInterfaceConfig(self.run_command)
+        links = bulk.read_current()
+        routes = self.read_routes()
+        rules = self.read_rules()
+        if links is None or routes is None or rules is None:
+            return None, [], 'Cannot read current network configuration'
+
+        warnings = []
+        desired = {}
+        for name, link in checkpoint['links'].items():
+            if name not in links:
+                warnings.append(f'{name}: interface no longer exists, skipped')
+                continue
+            kept = [a for a, info in links[name]['addresses'].items()
+                    if info.get('dynamic') and info.get('family') == 'inet6']
+            desired[name] = {'state': 'up' if link['up'] else 'down',
+                             'addresses': link['addresses'] + [a for a in kept if a not in link['addresses']]}
+            if link.get('mtu'):
+                desired[name]['mtu'] = link['mtu']
+        managed = set(desired)
+
+        batch = IpBatch(self.run_command)
+        removals = IpBatch(self.run_command)
+        if desired:
+            config, error = bulk.validate(desired)
+            if error:
+                return None, warnings, error
+            _, compile_warnings, error = bulk.compile(config, links, batch, removals)
+            if error:
+                return None, warnings, error
+            warnings += compile_warnings
+
+        # Routes: replace those whose attributes changed, add the missing
+        # ones, and delete the extra ones only after the rules moved away
+        live = {route_spec(r): r for r in routes if route_devices(r) <= managed}
+        live_keys = {route_key(r): spec for spec, r in live.items()}
+        wanted_keys = set()
+        deletions = []
+        for spec in checkpoint['routes']:
+            parsed = parse_route_spec(spec)
+            missing = parsed['devices'] - set(links)
+            if missing:
+                warnings.append(f"Route '{spec}' skipped: {', '.join(sorted(missing))} no longer exists")
+                continue
+            wanted_keys.add(parsed['key'])
+            if spec in live:
+                continue
+            previous = live_keys.get(parsed['key'])
+            if previous:
+                batch.add(f"route replace {spec}", f"route replace {previous}")
+            else:
+                batch.add(f"route add {spec}", f"route del {spec}")
+        for spec, route in live.items():
+            if spec not in checkpoint['routes'] and route_key(route) not in wanted_keys:
+                deletions.append((f"route del {spec}", f"route add {spec}"))
+
+        live_rules = [rule_spec(r) for r in rules if rule_devices(r) <= managed]
+        for spec in checkpoint['rules']:
+            if spec not in live_rules:
+                batch.add(f"rule add {spec}", f"rule del {spec}")
+        for spec in live_rules:
+            if spec not in checkpoint['rules']:
+                batch.add(f"rule del {spec}", f"rule add {spec}")
+
+        for command, inverse in deletions:
+            batch.add(command, inverse)
+        for command, inverse in removals.ops:
+            batch.add(command, inverse)
+        return batch, warnings, None
+
+    def verify(self, checkpoint):
+        """Checkpoint addresses and routes absent from the live state
+
+        Returns (descriptions, commands): the second set holds the inverses
+        that would fail because their target is already gone.
+        """
+        bulk = BulkInterfaceConfig(self.run_command)
+        links = bulk.read_current()
+        routes = self.read_routes()
+        if links is None or routes is None:
+            return ['current configuration (unreadable)'], set()
+        config = {name: {'addresses': link['addresses']} for name, link in checkpoint['links'].items()}
+        missing, gone = [], set()
+        for name, address in bulk.missing_addresses(config) or []:
+            missing.append(f'{address} on {name}')
+            gone.add(f"addr del {address} dev {name}")
+        live = {route_spec(r) for r in routes}
+        for spec in checkpoint['routes']:
+            if spec not in live and parse_route_spec(spec)['devices'] <= set(links):
+                missing.append(f"route '{spec}'")
+                gone.add(f"route del {spec}")
+        return missing, gone
+
+    def restore(self, name, dry_run=False):
+        """Apply the difference between the live state and a checkpoint as one batch"""
+        checkpoint = self.load(name)
+        if checkpoint is None:
+            return {'success': False, 'error': f'Checkpoint {name} not found'}
+
+        with self._lock:
+            batch, warnings, error = self.plan(checkpoint)
+            if error:
+                return {'success': False, 'error': error, 'warnings': warnings}
+            if dry_run:
+                return {'success': True, 'dry_run': True, 'commands': batch.commands(), 'warnings': warnings}
+
+            start = time.monotonic()
+            result = batch.execute()
+            result['apply_ms'] = round((time.monotonic() - start) * 1000, 1)
+            result['warnings'] = warnings
+            result['checkpoint'] = name
+            if result['success'] and result.get('applied'):
+                missing, gone = self.verify(checkpoint)
+                if missing:
+                    # The kernel dropped part of the restore (e.g. an address taken with a
+                    # removed primary); put the previous state back rather than claim success
+                    undo = batch.inverse(skip=gone).execute(rollback=False)
+                    result = dict(result, success=False, rolled_back=undo['success'],
+                                  error=f"Restore incomplete, missing: {', '.join(missing)}")
+        if result['success'] and result.get('applied'):
+            self._event('restored', f'Checkpoint {name} restored', commands=result['applied'])
+        elif not result['success']:
+            self._event('restore_failed', f"Checkpoint {name} restore failed: {result['error']}", 'error',
+                        failed_command=result.get('failed_command'), rolled_back=result.get('rolled_back'))
+        return result
+
+    def arm(self, timeout, reason='change'):
+        """Revert to the current state unless confirm() is called within `timeout` seconds
+
+        While a guard is pending, arming again extends the deadline but keeps
+        the original checkpoint: the state before the first change is the
+        known-good one.
+        """
+        try:
+            timeout = float(timeout)
+        except (TypeError, ValueError):
+            return {'success': False, 'error': 'confirm_within must be a number of seconds'}
+        if not CONFIRM_MIN <= timeout <= CONFIRM_MAX:
+            return {'success': False,
+                    'error': f'confirm_within must be between {CONFIRM_MIN} and {CONFIRM_MAX} seconds'}
+
+        with self._lock:
+            new = self._guard is None
+            if new:
+                if os.path.exists(self._guard_path()):
+                    # Left by another process (the CLI) or not resumed yet
+                    return {'success': False, 'error': 'Another change is waiting for confirmation'}
+                saved = self.save(GUARD_CHECKPOINT)
+                if not saved['success']:
+                    return saved
+
+            guard = {
+                'token': self._guard_token + 1,
+                'checkpoint': GUARD_CHECKPOINT,
+                'reason': reason if new else f"{self._guard['reason']}; {reason}",
+                'armed_at': self._guard['armed_at'] if not new else time.time(),
+                'deadline': time.time() + timeout,
+            }
+            try:
+                self._write_guard(guard)
+            except OSError as e:
+                # In memory only, the guard would not survive a restart
+                return {'success': False, 'error': f'Cannot persist guard: {e}'}
+            if not new:
+                self._guard['timer'].cancel()
+            self._start_guard(guard, timeout)
+            guard = self.get_guard()
+
+        self._event('armed', f'Change guarded: reverts in {timeout:g}s unless confirmed ({reason})',
+                    timeout=timeout)
+        return {'success': True, 'new': new, 'guard': guard}
+
+    def _start_guard(self, guard, timeout):
+        self._guard_token = guard['token']
+        guard['timer'] = threading.Timer(timeout, self._expire, args=(guard['token'],))
+        guard['timer'].daemon = True
+        self._guard = guard
+        guard['timer'].start()
+
+    def resume(self):
+        """Re-arm a guard persisted before a restart, reverting at once if it expired meanwhile"""
+        try:
+            with open(self._guard_path()) as f:
+                stored = json.load(f)
+            deadline = float(stored['deadline'])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            # Unreadable: the change was never confirmed, so treat it as expired
+            logger.error(f"Cannot read checkpoint guard: {e}")
+            stored, deadline = {}, 0
+
+        with self._lock:
+            if self._guard is not None:
+                return self.get_guard()
+            guard = {
+                'token': self._guard_token + 1,
+                'checkpoint': GUARD_CHECKPOINT,
+                'reason': str(stored.get('reason', 'change')),
+                'armed_at': stored.get('armed_at', deadline),
+                'deadline': deadline,
+            }
+            remaining = max(0.0, deadline - time.time())
+            self._start_guard(guard, remaining)
+            guard = self.get_guard()
+
+        if remaining:
+            self._event('armed', f"Change guard resumed: reverts in {remaining:.0f}s unless confirmed "
+                                 f"({guard['reason']})", timeout=remaining)
+        else:
+            self._event('expired', f"Change guard expired while stopped, reverting ({guard['reason']})",
+                        'warning')
+        return guard
+
+    def get_guard(self):
+        with self._lock:
+            if not self._guard:
+                return None
+            return {
+                'checkpoint': self._guard['checkpoint'],
+                'reason': self._guard['reason'],
+                'armed_at': self._guard['armed_at'],
+                'deadline': self._guard['deadline'],
+                'remaining_s': max(0.0, round(self._guard['deadline'] - time.time(), 1))
+            }
+
+    def _take_guard(self, token=None):
+        with self._lock:
+            guard = self._guard
+            if guard is None or (token is not None and guard['token'] != token):
+                return None
+            guard['timer'].cancel()
+            self._guard = None
+            try:
+                self._write_guard(None)
+            except OSError as e:
+                logger.error(f"Cannot remove checkpoint guard file: {e}")
+            return guard
+
+    def confirm(self):
+        """Keep the guarded change"""
+        guard = self._take_guard()
+        if guard is None:
+            return {'success': False, 'error': 'No change is waiting for confirmation'}
+        self._event('confirmed', f"Guarded change confirmed ({guard['reason']})")
+        return {'success': True, 'message': 'Change confirmed'}
+
+    def disarm(self):
+        """Drop a guard whose change was never applied"""
+        self._take_guard()
+
+    def revert(self, token=None):
+        """Restore the state from before the guarded change now"""
+        guard = self._take_guard(token)
+        if guard is None:
+            return {'success': False, 'error': 'No change is waiting for confirmation'}
+        result = self.restore(guard['checkpoint'])
+        severity = 'warning' if result['success'] else 'error'
+        self._event('reverted', f"Guarded change reverted ({guard['reason']})", severity,
+                    success=result['success'], error=result.get('error'))
+        return result
+
+    def _expire(self, token):
+        logger.warning("Change not confirmed in time, reverting")
+        self.revert(token)
+
+
+def parse_route_spec(spec):
+    """Identity and devices of a stored route spec"""
+    tokens = spec.split()
+    if tokens[0] in ('blackhole', 'unreachable', 'prohibit', 'throw'):
+        tokens = tokens[1:]
+    table, metric, devices = 'main', 0, set()
+    for key, value in zip(tokens, tokens[1:]):
+        if key == 'dev':
+            devices.add(value)
+        elif key == 'table':
+            table = value
+        elif key == 'metric':
+            metric = int(value)
+    return {'key': (table, tokens[0], metric), 'devices': devices}
+
+
+def run_command(cmd, timeout=10, input=None):
+    try:
+        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout, input=input)
+        return {'success': result.returncode == 0, 'output': result.stdout.strip(),
+                'error': result.stderr.strip()}
+    except subprocess.TimeoutExpired:
+        return {'success': False, 'output': '', 'error': 'Command timeout'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Network Interface Manager configuration checkpoints')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help='List saved checkpoints')
+    save = sub.add_parser('save', help='Save the current configuration')
+    save.add_argument('name')
+    show = sub.add_parser('show', help='Print a checkpoint')
+    show.add_argument('name')
+    restore = sub.add_parser('restore', help='Apply the difference to a checkpoint')
+    restore.add_argument('name')
+    restore.add_argument('--dry-run', action='store_true')
+    restore.add_argument('--confirm-within', type=float,
+                         help='revert unless "yes" is typed within this many seconds')
+
+    args = parser.parse_args()
+    checkpoints = ConfigCheckpoints(run_command)
+    if args.command == 'list':
+        for entry in checkpoints.list()['checkpoints']:
+            created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['created']))
+            print(f"{entry['name']:24} {created}  {entry['size']:6d} B  {len(entry['interfaces'])} interfaces, "
+                  f"{entry['routes']} routes, {entry['rules']} rules")
+        return
+    if args.command == 'save':
+        result = checkpoints.save(args.name)
+    elif args.command == 'show':
+        result = checkpoints.load(args.name) or {'success': False, 'error': f'Checkpoint {args.name} not found'}
+    else:
+        if args.confirm_within and not args.dry_run:
+            armed = checkpoints.arm(args.confirm_within, reason=f'restore {args.name}')
+            if not armed['success']:
+                print(json.dumps(armed, indent=2))
+                sys.exit(1)
+        result = checkpoints.restore(args.name, dry_run=args.dry_run)
+        if args.confirm_within and not args.dry_run:
+            if not result['success']:
+                checkpoints.disarm()
+            else:
+                print(json.dumps(result, indent=2))
+                sys.stdout.write(f"Keep this configuration? Type yes within {args.confirm_within:g}s: ")
+                sys.stdout.flush()
+                ready, _, _ = select.select([sys.stdin], [], [], args.confirm_within)
+                answer = sys.stdin.readline().strip().lower() if ready else ''
+                result = checkpoints.confirm() if answer == 'yes' else checkpoints.revert()
+    print(json.dumps(result, indent=2))
+    if result.get('success') is False:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Streaming conntrack accounting for Network Interface Manager
+
+Reads /proc/net/nf_conntrack (or `conntrack -L -o extended`, which has
+the same line format) one entry at a time and aggregates connection,
+packet and byte counts per outgoing interface and per firewall mark.
+Memory use is bounded by the number of interfaces and marks, not by the
+size of the table.
+
+An entry is attributed to the interface owning the reply tuple's
+destination (the masqueraded source for NATed LAN traffic, the local
+address for traffic originated here), falling back to the original
+destination for inbound connections.
+
+Byte and packet counts need nf_conntrack_acct enabled:
+    sudo sysctl -w net.netfilter.nf_conntrack_acct=1
+
+Run `python3 conntrack.py <captured-file>` to aggregate a captured table.
+"""
+
+import os
+import sys
+import re
+import json
+import time
+import ipaddress
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROC_CONNTRACK = '/proc/net/nf_conntrack'
+CONNTRACK_CMD = ['sudo', '-n', 'conntrack', '-L', '-o', 'extended']
+
+UNKNOWN_INTERFACE = 'other'
+
+
+# One conntrack entry. Every group is greedy and unambiguous (the
+# proto-specific key=value run stops at "packets"), so matching never
+# backtracks; the accounting and [UNREPLIED] parts are optional.
+ENTRY_RE = re.compile(
+    r'^\S+ +\d+ +(\S+) +\d+ +\d+ +(?:([A-Z_]+) +)?'
+    r'src=\S+ dst=(\S+)(?: (?!packets)[a-z]+=\d+)*(?: packets=(\d+) bytes=(\d+))?'
+    r'(?: \[UNREPLIED\])? '
+    r'src=\S+ dst=(\S+)(?: (?!packets)[a-z]+=\d+)*(?: packets=(\d+) bytes=(\d+))?'
+    r'.*? mark=(\d+)',
+    re.M
+)
+
+CHUNK_SIZE = 1 << 20
+
+
+def parse_entry(line):
+    """Parse one conntrack line into (proto, state, orig_dst, packets_out, bytes_out,
+    reply_dst, packets_in, bytes_in, mark), all strings
+
+    Returns None for lines that are not conntrack entries.
+    """
+    match = ENTRY_RE.match(line)
+    return match.groups('') if match else None
+
+
+def read_chunks(stream, size=CHUNK_SIZE):
+    """Yield blocks of whole lines from a text stream"""
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        if not chunk.endswith('\n'):
+            chunk += stream.readline()
+        yield chunk
+
+
+class AddressResolver:
+    """Maps an IP address to the local interface that owns it or its subnet"""
+
+    def __init__(self, interfaces):
+        self.exact = {}
+        self.networks = []
+        for name, iface in interfaces.items():
+            for addr in iface.get('addresses', []):
+                try:
+                    network = ipaddress.ip_interface(addr['address'])
+                except ValueError:
+                    continue
+                self.exact[str(network.ip)] = name
+                if network.network.prefixlen < network.max_prefixlen:
+                    self.networks.append((network.network, name))
+        # Most specific subnet first
+        self.networks.sort(key=lambda item: item[0].prefixlen, reverse=True)
+        self.cache = {}
+
+    def resolve(self, address):
+        name = self.exact.get(address)
+        if name:
+            return name
+        if address in self.cache:
+            return self.cache[address]
+
+        name = None
+        try:
+            ip = ipaddress.ip_address(address)
+            for network, iface in self.networks:
+                if ip.version == network.version and ip in network:
+                    name = iface
+                    break
+        except ValueError:
+            pass
+
+        # Remote peers vastly outnumber local subnets; keep the cache bounded
+        if len(self.cache) > 65536:
+            self.cache.clear()
+        self.cache[address] = name
+        return name
+
+
+class ConntrackAggregator:
+    """Incremental per-interface and per-mark connection accounting"""
+
+    def __init__(self, resolver):
+        self.resolver = resolver
+        self.total = 0
+        self.skipped = 0
+        # (interface, mark, proto, state) -> [connections, bytes_out, bytes_in, packets_out, packets_in]
+        self.counters = {}
+
+    def feed(self, chunk):
+        """Account every entry in a block of whole lines"""
+        resolve = self.resolver.resolve
+        counters = self.counters
+        matched = 0
+        for proto, state, orig_dst, packets_out, bytes_out, reply_dst, packets_in, bytes_in, mark \
+                in ENTRY_RE.findall(chunk):
+            matched += 1
+            iface = resolve(reply_dst) or resolve(orig_dst) or UNKNOWN_INTERFACE
+            key = (iface, mark, proto, state)
+            counter = counters.get(key)
+            if counter is None:
+                counter = counters[key] = [0, 0, 0, 0, 0]
+            counter[0] += 1
+            if bytes_out:
+                counter[1] += int(bytes_out)
+                counter[2] += int(bytes_in)
+                counter[3] += int(packets_out)
+                counter[4] += int(packets_in)
+
+        self.total += matched
+        self.skipped += chunk.count('\n') + (not chunk.endswith('\n')) - matched
+
+    def feed_stream(self, stream):
+        for chunk in read_chunks(stream):
+            self.feed(chunk)
+
+    def summary(self):
+        by_interface = {}
+        by_mark = {}
+        acct_seen = False
+        for (iface, mark, proto, state), counter in self.counters.items():
+            if counter[1] or counter[2]:
+                acct_seen = True
+            for table, key in ((by_interface, iface), (by_mark, mark)):
+                bucket = table.get(key)
+                if bucket is None:
+                    bucket = table[key] = {
+                        'connections': 0, 'bytes_out': 0, 'bytes_in': 0,
+                        'packets_out': 0, 'packets_in': 0, 'protocols': {}, 'states': {}
+                    }
+                bucket['connections'] += counter[0]
+                bucket['bytes_out'] += counter[1]
+                bucket['bytes_in'] += counter[2]
+                bucket['packets_out'] += counter[3]
+                bucket['packets_in'] += counter[4]
+                bucket['protocols'][proto] = bucket['protocols'].get(proto, 0) + counter[0]
+                if state:
+                    bucket['states'][state] = bucket['states'].get(state, 0) + counter[0]
+
+        for bucket in by_interface.values():
+            bucket['share'] = round(bucket['connections'] / self.total * 100, 1)
+
+        return {
+            'total': self.total,
+            'skipped': self.skipped,
+            'acct_enabled': acct_seen,
+            'by_interface': by_interface,
+            'by_mark': by_mark
+        }
+
+
+class ConntrackReader:
+    def __init__(self, path=PROC_CONNTRACK, command=CONNTRACK_CMD):
+        self.path = path
+        self.command = command
+
+    def aggregate(self, interfaces):
+        """Stream the conntrack table and return per-interface/per-mark totals"""
+        start = time.monotonic()
+        aggregator = ConntrackAggregator(AddressResolver(interfaces))
+
+        try:
+            if os.path.exists(self.path):
+                source = self.path
+                with open(self.path, buffering=1 << 16) as stream:
+                    aggregator.feed_stream(stream)
+            else:
+                source = ' '.join(self.command)
+                self._aggregate_command(aggregator)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.error(f"Error reading conntrack table: {e}")
+            return {'success': False, 'error': f'Cannot read conntrack table: {e}'}
+        except RuntimeError as e:
+            return {'success': False, 'error': str(e)}
+
+        result = aggregator.summary()
+        result.update({
+            'success': True,
+            'source': source,
+            'elapsed_ms': round((time.monotonic() - start) * 1000, 1)
+        })
+        return result
+
+    def _aggregate_command(self, aggregator):
+        process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   text=True, bufsize=1 << 16)
+        try:
+            aggregator.feed_stream(process.stdout)
+        finally:
+            process.stdout.close()
+            _, stderr = process.communicate(timeout=10)
+        # conntrack prints its summary line on stderr and exits 0 on success
+        if process.returncode != 0:
+            raise RuntimeError(f'conntrack failed: {stderr.strip()}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <conntrack-file> [interfaces.json]")
+        sys.exit(1)
+
+    interfaces = {}
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as f:
+            data = json.load(f)
+        # Accepts either a snapshot.json or a bare /api/interfaces dump
+        interfaces = data.get('interfaces', data) if 'saved_at' in data else data
+    print(json.dumps(ConntrackReader(sys.argv[1]).aggregate(interfaces), indent=2))
@@ -0,0 +1,1115 @@
+#!/usr/bin/env python3
+"""
+Asynchronous DHCP client for Network Interface Manager
+
+Every managed interface gets its own client thread, so several uplinks
+acquire leases at the same time and the API never waits on a DHCP
+exchange. Leases are cached per interface and MAC address: when a link
+comes back (carrier up, or a tethered phone re-plugged) the client first
+tries INIT-REBOOT, a single REQUEST for the previous address, and only
+falls back to a full DISCOVER/OFFER/REQUEST/ACK when the server NAKs or
+stays silent. Bound leases are renewed at T1 (unicast) and rebound at T2
+(broadcast) as in RFC 2131.
+
+Packets are sent and received on a packet socket bound to the interface
+with a BPF filter for UDP port 68, like dhclient: replies reach us before
+the interface has an address and regardless of rp_filter, and requests
+leave with source 0.0.0.0 instead of another interface's address. A lease
+is applied with one IpBatch (new address first, then the default route,
+then the removal of stale addresses, with promote_secondaries held on
+while it runs), so a renewal or reconnect never leaves the interface
+without an address.
+
+A minimal DHCP server is included for testing against a veth pair or a
+network namespace:
+
+    ip netns exec lab python3 dhcp.py server --interface veth1 --pool 10.78.0.100-10.78.0.150
+    python3 dhcp.py acquire veth0 veth2 --timeout 10
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import ctypes
+import random
+import select
+import shutil
+import socket
+import struct
+import argparse
+import ipaddress
+import threading
+import logging
+from collections import deque
+
+from ipbatch import IpBatch, BulkInterfaceConfig, valid_interface_name
+from failover import LinkMonitor, read_carrier, icmp_checksum, SYSFS_NET
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LEASE_FILE = os.environ.get('NIM_DHCP_LEASES', os.path.join(BASE_DIR, 'dhcp-leases.json'))
+DISCOVER_TIMEOUT = float(os.environ.get('NIM_DHCP_TIMEOUT', '30'))  # seconds per acquisition attempt
+REBOOT_TIMEOUT = float(os.environ.get('NIM_DHCP_REBOOT_TIMEOUT', '2'))  # INIT-REBOOT before falling back
+RENEW_RETRY = float(os.environ.get('NIM_DHCP_RENEW_RETRY', '10'))  # floor between renew attempts
+ROUTE_METRIC_BASE = int(os.environ.get('NIM_DHCP_METRIC_BASE', '200'))  # + ifindex, like dhcpcd
+
+CLIENT_PORT = 68
+SERVER_PORT = 67
+ETH_P_IP = 0x0800
+SO_ATTACH_FILTER = 26
+BROADCAST = '255.255.255.255'
+ANY = '0.0.0.0'
+
+BOOTREQUEST = 1
+BOOTREPLY = 2
+MAGIC_COOKIE = b'\x63\x82\x53\x63'
+FLAG_BROADCAST = 0x8000
+
+DHCPDISCOVER = 1
+DHCPOFFER = 2
+DHCPREQUEST = 3
+DHCPDECLINE = 4
+DHCPACK = 5
+DHCPNAK = 6
+DHCPRELEASE = 7
+MESSAGE_NAMES = {DHCPDISCOVER: 'DISCOVER', DHCPOFFER: 'OFFER', DHCPREQUEST: 'REQUEST', DHCPDECLINE: 'DECLINE',
+                 DHCPACK: 'ACK', DHCPNAK: 'NAK', DHCPRELEASE: 'RELEASE'}
+
+OPT_PAD = 0
+OPT_SUBNET_MASK = 1
+OPT_ROUTER = 3
+OPT_DNS = 6
+OPT_HOSTNAME = 12
+OPT_REQUESTED_IP = 50
+OPT_LEASE_TIME = 51
+OPT_MESSAGE_TYPE = 53
+OPT_SERVER_ID = 54
+OPT_PARAMETERS = 55
+OPT_RENEWAL_TIME = 58
+OPT_REBINDING_TIME = 59
+OPT_CLIENT_ID = 61
+OPT_END = 255
+REQUESTED_OPTIONS = bytes([OPT_SUBNET_MASK, OPT_ROUTER, OPT_DNS, 15, 26, OPT_LEASE_TIME,
+                           OPT_SERVER_ID, OPT_RENEWAL_TIME, OPT_REBINDING_TIME])
+
+BOOTP_FORMAT = '!BBBBIHH4s4s4s4s16s64s128s'
+BOOTP_SIZE = struct.calcsize(BOOTP_FORMAT)
+BOOTP_MIN_SIZE = 300
+
+RETRANSMIT_MIN = 1.0  # seconds, doubled per retransmission (RFC 2131 starts at 4)
+RETRANSMIT_MAX = 8.0
+RETRY_MIN = 2.0  # back-off between failed acquisitions
+RETRY_MAX = 60.0
+LINK_POLL = 5.0
+HISTORY = 20
+EXTERNAL_CLIENTS = ('dhclient', 'dhcpcd', 'udhcpc')  # would fight the manager over the interface
+
+# IPv4, UDP, not a fragment, destination port 68; offsets start at the IP header (SOCK_DGRAM)
+BPF_DHCP_CLIENT = [
+    (0x30, 0, 0, 9),       # ldb [9]            protocol
+    (0x15, 0, 6, 17),      # jeq #17            UDP, else drop
+    (0x28, 0, 0, 6),       # ldh [6]            flags + fragment offset
+    (0x45, 4, 0, 0x1fff),  # jset #0x1fff       fragment, drop
+    (0xb1, 0, 0, 0),       # ldxb 4*([0]&0xf)   IP header length
+    (0x48, 0, 0, 2),       # ldh [x+2]          UDP destination port
+    (0x15, 0, 1, CLIENT_PORT),
+    (0x06, 0, 0, 0xffff),  # accept
+    (0x06, 0, 0, 0),       # drop
+]
+
+# States reported in get_status()
+STATES = ('starting', 'waiting-link', 'init-reboot', 'selecting', 'requesting', 'bound',
+          'renewing', 'rebinding', 'failed', 'released', 'stopped')
+
+
+def build_packet(op, message_type, xid, mac, ciaddr=ANY, yiaddr=ANY, siaddr=ANY,
+                 secs=0, broadcast=False, options=()):
+    """Encode a BOOTP/DHCP message; `options` is a list of (code, bytes)"""
+    header = struct.pack(BOOTP_FORMAT, op, 1, 6, 0, xid, min(secs, 0xffff),
+                         FLAG_BROADCAST if broadcast else 0,
+                         socket.inet_aton(ciaddr), socket.inet_aton(yiaddr),
+                         socket.inet_aton(siaddr), socket.inet_aton(ANY),
+                         mac.ljust(16, b'\x00'), b'', b'')
+    body = bytearray(MAGIC_COOKIE)
+    body += bytes([OPT_MESSAGE_TYPE, 1, message_type])
+    for code, value in options:
+        body += bytes([code, len(value)]) + value
+    body.append(OPT_END)
+    packet = header + bytes(body)
+    return packet.ljust(BOOTP_MIN_SIZE, b'\x00')
+
+
+def parse_packet(data):
+    """Decode a DHCP message, None if it is not one"""
+    if len(data) < BOOTP_SIZE + 4 or data[BOOTP_SIZE:BOOTP_SIZE + 4] != MAGIC_COOKIE:
+        return None
+    op, _, hlen, _, xid, secs, flags, ciaddr, yiaddr, siaddr, _, chaddr, _, _ = \
+        struct.unpack_from(BOOTP_FORMAT, data)
+    options = {}
+    offset = BOOTP_SIZE + 4
+    while offset < len(data):
+        code = data[offset]
+        if code == OPT_END:
+            break
+        if code == OPT_PAD:
+            offset += 1
+            continue
+        if offset + 1 >= len(data):
+            break
+        length = data[offset + 1]
+        # Options split across several instances are concatenated (RFC 3396)
+        options[code] = options.get(code, b'') + data[offset + 2:offset + 2 + length]
+        offset += 2 + length
+    message_type = options.get(OPT_MESSAGE_TYPE)
+    if not message_type:
+        return None
+    return {
+        'op': op,
+        'type': message_type[0],
+        'xid': xid,
+        'secs': secs,
+        'broadcast': bool(flags & FLAG_BROADCAST),
+        'ciaddr': socket.inet_ntoa(ciaddr),
+        'yiaddr': socket.inet_ntoa(yiaddr),
+        'siaddr': socket.inet_ntoa(siaddr),
+        'mac': chaddr[:min(hlen, 16)],
+        'options': options,
+    }
+
+
+def option_address(packet, code):
+    value = packet['options'].get(code)
+    return socket.inet_ntoa(value[:4]) if value and len(value) >= 4 else None
+
+
+def option_addresses(packet, code):
+    value = packet['options'].get(code) or b''
+    return [socket.inet_ntoa(value[i:i + 4]) for i in range(0, len(value) - 3, 4)]
+
+
+def option_seconds(packet, code):
+    value = packet['options'].get(code)
+    return struct.unpack('!I', value[:4])[0] if value and len(value) >= 4 else None
+
+
+def lease_from_ack(packet):
+    """The lease carried by a DHCPACK"""
+    lease_time = option_seconds(packet, OPT_LEASE_TIME) or 3600
+    mask = option_address(packet, OPT_SUBNET_MASK)
+    try:
+        prefixlen = ipaddress.IPv4Network(f'0.0.0.0/{mask}').prefixlen if mask else None
+    except ValueError:
+        prefixlen = None
+    if prefixlen is None:
+        prefixlen = 24
+    routers = option_addresses(packet, OPT_ROUTER)
+    renew = option_seconds(packet, OPT_RENEWAL_TIME) or lease_time // 2
+    rebind = option_seconds(packet, OPT_REBINDING_TIME) or lease_time * 7 // 8
+    return {
+        'address': packet['yiaddr'],
+        'prefixlen': prefixlen,
+        'router': routers[0] if routers else None,
+        'dns': option_addresses(packet, OPT_DNS),
+        'server': option_address(packet, OPT_SERVER_ID) or packet['siaddr'],
+        'lease_time': lease_time,
+        'renew': min(renew, lease_time),
+        'rebind': min(max(rebind, renew), lease_time),
+    }
+
+
+def udp_frame(payload, source, destination, sport=CLIENT_PORT, dport=SERVER_PORT):
+    """Wrap a payload in IPv4 and UDP headers (UDP checksum 0 is allowed over IPv4)"""
+    udp = struct.pack('!HHHH', sport, dport, 8 + len(payload), 0) + payload
+    header = struct.pack('!BBHHHBBH4s4s', 0x45, 0x10, 20 + len(udp), random.getrandbits(16), 0,
+                         64, socket.IPPROTO_UDP, 0, socket.inet_aton(source), socket.inet_aton(destination))
+    header = header[:10] + struct.pack('!H', icmp_checksum(header)) + header[12:]
+    return header + udp
+
+
+def parse_frame(data):
+    """The UDP payload of an IPv4 datagram for port 68, None otherwise"""
+    if len(data) < 28 or data[0] >> 4 != 4 or data[9] != socket.IPPROTO_UDP:
+        return None
+    ihl = (data[0] & 0x0f) * 4
+    if len(data) < ihl + 8:
+        return None
+    _, dport, length, _ = struct.unpack_from('!HHHH', data, ihl)
+    if dport != CLIENT_PORT or length < 8:
+        return None
+    return data[ihl + 8:ihl + length]
+
+
+def read_mac(interface):
+    try:
+        with open(f"{SYSFS_NET}/{interface}/address") as f:
+            mac = f.read().strip()
+    except OSError:
+        return None
+    try:
+        raw = bytes.fromhex(mac.replace(':', ''))
+    except ValueError:
+        return None
+    return raw if len(raw) == 6 and any(raw) else None
+
+
+def read_ifindex(interface):
+    try:
+        with open(f"{SYSFS_NET}/{interface}/ifindex") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def external_clients(interface):
+    """PIDs of other DHCP clients (dhclient, dhcpcd, udhcpc) running for the interface"""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", 'rb') as f:
+                argv = f.read().decode(errors='replace').split('\0')
+        except OSError:
+            continue
+        if os.path.basename(argv[0]) in EXTERNAL_CLIENTS and interface in argv[1:]:
+            pids.append(int(entry))
+    return pids
+
+
+class DhcpSocket:
+    """Packet socket for one interface, receiving only UDP datagrams to port 68"""
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(ETH_P_IP))
+        try:
+            program = b''.join(struct.pack('HBBI', *insn) for insn in BPF_DHCP_CLIENT)
+            self._filter = ctypes.create_string_buffer(program)
+            fprog = struct.pack('HL', len(BPF_DHCP_CLIENT), ctypes.addressof(self._filter))
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+            self.sock.bind((interface, ETH_P_IP))
+        except OSError:
+            self.sock.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def broadcast(self, payload, source=ANY):
+        frame = udp_frame(payload, source, BROADCAST)
+        self.sock.sendto(frame, (self.interface, ETH_P_IP, 0, 0, b'\xff' * 6))
+
+    def unicast(self, payload, source, server):
+        """Send from the leased address through the routing table (RENEWING, RELEASE)"""
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, self.interface.encode())
+            sock.bind((source, CLIENT_PORT))
+            sock.sendto(payload, (server, SERVER_PORT))
+
+    def receive(self, timeout):
+        """The next DHCP message, None on timeout"""
+        ready, _, _ = select.select([self.sock], [], [], max(timeout, 0))
+        if not ready:
+            return None
+        data, address = self.sock.recvfrom(4096)
+        if address[2] == socket.PACKET_OUTGOING:
+            return None
+        payload = parse_frame(data)
+        return parse_packet(payload) if payload else None
+
+
+class LeaseCache:
+    """Leases persisted per interface and MAC, plus the set of managed interfaces"""
+
+    def __init__(self, path=LEASE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.leases = {}
+        self.managed = []
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            self.leases = data.get('leases', {})
+            self.managed = data.get('interfaces', [])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Cannot read DHCP lease cache {path}: {e}")
+
+    @staticmethod
+    def key(interface, mac):
+        return f"{interface}/{mac.hex(':')}"
+
+    def get(self, interface, mac):
+        """The cached lease if it is still valid and was not released"""
+        with self._lock:
+            lease = self.leases.get(self.key(interface, mac))
+        if not lease or lease.get('released') or lease_remaining(lease) <= 0:
+            return None
+        return dict(lease)
+
+    def hint(self, interface, mac):
+        """The last address held on this interface and MAC, for DISCOVER option 50"""
+        with self._lock:
+            lease = self.leases.get(self.key(interface, mac))
+        return lease['address'] if lease else None
+
+    def put(self, interface, mac, lease):
+        with self._lock:
+            self.leases[self.key(interface, mac)] = dict(lease)
+            self._save()
+
+    def mark_released(self, interface, mac):
+        with self._lock:
+            lease = self.leases.get(self.key(interface, mac))
+            if lease:
+                lease['released'] = True
+                self._save()
+
+    def forget(self, interface, mac):
+        with self._lock:
+            if self.leases.pop(self.key(interface, mac), None):
+                self._save()
+
+    def set_managed(self, interface, managed):
+        with self._lock:
+            if managed and interface not in self.managed:
+                self.managed.append(interface)
+            elif not managed and interface in self.managed:
+                self.managed.remove(interface)
+            else:
+                return
+            self._save()
+
+    def _save(self):
+        try:
+            temp = self.path + '.tmp'
+            with open(temp, 'w') as f:
+                json.dump({'interfaces': self.managed, 'leases': self.leases}, f, indent=2)
+            os.replace(temp, self.path)
+        except OSError as e:
+            logger.warning(f"Cannot save DHCP lease cache: {e}")
+
+
+def lease_remaining(lease, now=None):
+    return lease['acquired'] + lease['lease_time'] - (now or time.time())
+
+
+class DhcpClient(threading.Thread):
+    """RFC 2131 client state machine for one interface"""
+
+    def __init__(self, manager, interface):
+        super().__init__(name=f'dhcp-{interface}', daemon=True)
+        self.manager = manager
+        self.interface = interface
+        self.state = 'starting'
+        self.mac = None
+        self.lease = None
+        self.error = None
+        self.history = deque(maxlen=HISTORY)
+        self.bound = threading.Event()
+        self._stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._link_changed = False
+        self._release = False
+        self._keep_address = False
+        self._hostname = socket.gethostname().encode()[:63]
+
+    # Control, called from other threads
+
+    def stop(self, release=True, keep_address=False):
+        self._release = release
+        self._keep_address = keep_address
+        self._stop_event.set()
+        self._wake.set()
+
+    def notify_link(self, carrier):
+        """Carrier changed: re-check the link and confirm the lease with INIT-REBOOT"""
+        self._link_changed = True
+        if not carrier:
+            self.bound.clear()
+        self._wake.set()
+
+    def retry(self):
+        """Skip the current back-off"""
+        self._wake.set()
+
+    # Thread
+
+    def run(self):
+        backoff = RETRY_MIN
+        self.manager.link_up(self.interface)
+        try:
+            while not self._stop_event.is_set():
+                self._link_changed = False
+                if not self._link_ready():
+                    self._set_state('waiting-link')
+                    self._sleep(LINK_POLL)
+                    continue
+                try:
+                    lease = self._acquire()
+                except OSError as e:
+                    self.error = f'Socket error: {e}'
+                    logger.error(f"DHCP on {self.interface}: {e}")
+                    lease = None
+                if self._stop_event.is_set():
+                    break
+                if lease is None:
+                    self._set_state('failed')
+                    self._sleep(backoff * random.uniform(0.8, 1.2))
+                    backoff = min(backoff * 2, RETRY_MAX)
+                    continue
+                backoff = RETRY_MIN
+                self._hold()
+        finally:
+            self._finish()
+
+    def _link_ready(self):
+        mac = read_mac(self.interface)
+        if not mac or read_carrier(self.interface) is False:
+            return False
+        if mac != self.mac:
+            if self.mac:
+                # Same name, different device (e.g. another phone): the old lease does not apply
+                self.lease = None
+                self.bound.clear()
+            self.mac = mac
+        return True
+
+    def _sleep(self, seconds):
+        self._wake.wait(max(seconds, 0))
+        self._wake.clear()
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.debug(f"DHCP {self.interface}: {self.state} -> {state}")
+            self.state = state
+
+    def _timing(self, path):
+        return {'path': path, 'time': round(time.time(), 3), 'attempts': 0, 'naks': 0,
+                '_start': time.monotonic()}
+
+    def _record(self, timing, result, address=None):
+        timing['result'] = result
+        timing['total_ms'] = round((time.monotonic() - timing.pop('_start')) * 1000, 1)
+        if address:
+            timing['address'] = address
+        self.history.append(timing)
+        if result not in ('bound', 'renewed'):
+            self.error = f"{timing['path']}: {result}"
+        return timing
+
+    def _message(self, message_type, xid, started, requested=None, server=None, ciaddr=ANY):
+        options = [(OPT_CLIENT_ID, b'\x01' + self.mac)]
+        if message_type != DHCPRELEASE:
+            options.append((OPT_HOSTNAME, self._hostname))
+            options.append((OPT_PARAMETERS, REQUESTED_OPTIONS))
+        if requested:
+            options.append((OPT_REQUESTED_IP, socket.inet_aton(requested)))
+        if server:
+            options.append((OPT_SERVER_ID, socket.inet_aton(server)))
+        secs = int(time.monotonic() - started) if started else 0
+        return build_packet(BOOTREQUEST, message_type, xid, self.mac, ciaddr=ciaddr, secs=secs, options=options)
+
+    def _transact(self, sock, build, expect, deadline, timing, xid=None):
+        """Send and retransmit with back-off until a reply of an expected type arrives"""
+        xid = xid if xid is not None else random.getrandbits(32)
+        delay = RETRANSMIT_MIN
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            if now >= deadline:
+                return None
+            sock.broadcast(build(xid))
+            timing['attempts'] += 1
+            wait_until = min(deadline, now + delay * random.uniform(0.9, 1.1))
+            reply = self._receive(sock, xid, expect, wait_until)
+            if reply:
+                return reply
+            delay = min(delay * 2, RETRANSMIT_MAX)
+        return None
+
+    def _receive(self, sock, xid, expect, until):
+        while not self._stop_event.is_set():
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                return None
+            packet = sock.receive(min(remaining, 0.25))
+            if (packet and packet['op'] == BOOTREPLY and packet['xid'] == xid
+                    and packet['mac'][:6] == self.mac and packet['type'] in expect):
+                return packet
+        return None
+
+    def _acquire(self):
+        """INIT-REBOOT with the cached lease, else DISCOVER; returns the bound lease or None"""
+        cached = self.lease if self.lease and lease_remaining(self.lease) > 0 else None
+        cached = cached or self.manager.cache.get(self.interface, self.mac)
+        with DhcpSocket(self.interface) as sock:
+            if cached:
+                self._set_state('init-reboot')
+                timing = self._timing('init-reboot')
+                started = timing['_start']
+                reply = self._transact(
+                    sock, lambda xid: self._message(DHCPREQUEST, xid, started, requested=cached['address']),
+                    (DHCPACK, DHCPNAK), started + REBOOT_TIMEOUT, timing)
+                if reply and reply['type'] == DHCPACK:
+                    timing['ack_ms'] = round((time.monotonic() - started) * 1000, 1)
+                    return self._bind(lease_from_ack(reply), timing)
+                if reply:
+                    timing['naks'] += 1
+                    self._record(timing, 'nak', cached['address'])
+                    self.manager.cache.forget(self.interface, self.mac)
+                    self.manager.event('nak', f"Lease {cached['address']} on {self.interface} refused, rediscovering",
+                                       'warning', interface=self.interface, address=cached['address'])
+                    self.lease = None
+                    cached = None
+                else:
+                    self._record(timing, 'timeout', cached['address'])
+                if self._stop_event.is_set():
+                    return None
+            hint = cached['address'] if cached else self.manager.cache.hint(self.interface, self.mac)
+            return self._discover(sock, hint)
+
+    def _discover(self, sock, hint):
+        timing = self._timing('discover')
+        started = timing['_start']
+        deadline = started + DISCOVER_TIMEOUT
+        while not self._stop_event.is_set() and time.monotonic() < deadline:
+            self._set_state('selecting')
+            offer = self._transact(
+                sock, lambda xid: self._message(DHCPDISCOVER, xid, started, requested=hint),
+                (DHCPOFFER,), deadline, timing)
+            if not offer:
+                break
+            timing.setdefault('offer_ms', round((time.monotonic() - started) * 1000, 1))
+            self._set_state('requesting')
+            server = option_address(offer, OPT_SERVER_ID)
+            # The REQUEST reuses the OFFER's xid so every server sees which offer was taken
+            reply = self._transact(
+                sock, lambda xid: self._message(DHCPREQUEST, xid, started, requested=offer['yiaddr'], server=server),
+                (DHCPACK, DHCPNAK), min(deadline, time.monotonic() + RETRANSMIT_MAX * 2), timing, xid=offer['xid'])
+            if reply and reply['type'] == DHCPACK:
+                timing['ack_ms'] = round((time.monotonic() - started) * 1000, 1)
+                return self._bind(lease_from_ack(reply), timing)
+            if reply:
+                timing['naks'] += 1
+                hint = None
+        self._record(timing, 'timeout', hint)
+        return None
+
+    def _bind(self, lease, timing):
+        lease['acquired'] = round(time.time(), 3)
+        result = self.manager.configure(self.interface, lease, self.lease)
+        if not result['success']:
+            self._record(timing, 'apply-failed', lease['address'])
+            self.error = result['error']
+            self.manager.event('failed', f"Cannot apply DHCP lease {lease['address']} on {self.interface}: "
+                               f"{result['error']}", 'error', interface=self.interface)
+            return None
+        renewed = self.lease is not None and self.lease['address'] == lease['address']
+        path = timing['path']
+        self._record(timing, 'renewed' if path in ('renew', 'rebind') else 'bound', lease['address'])
+        self.lease = lease
+        self.error = None
+        self.manager.cache.put(self.interface, self.mac, lease)
+        self._set_state('bound')
+        self.bound.set()
+        if path in ('renew', 'rebind') and renewed:
+            self.manager.event('renewed', f"Renewed {lease['address']} on {self.interface}", 'info',
+                               interface=self.interface, address=lease['address'], path=path,
+                               total_ms=timing['total_ms'])
+        else:
+            self.manager.event('bound', f"{self.interface} bound to {lease['address']}/{lease['prefixlen']} "
+                               f"via {path} in {timing['total_ms']} ms", 'info',
+                               interface=self.interface, address=lease['address'], router=lease['router'],
+                               path=path, total_ms=timing['total_ms'], attempts=timing['attempts'])
+        return lease
+
+    def _hold(self):
+        """Keep the lease: renew at T1, rebind at T2, drop it at expiry"""
+        timing = None
+        while not self._stop_event.is_set() and not self._link_changed:
+            lease = self.lease
+            now = time.time()
+            t1 = lease['acquired'] + lease['renew']
+            t2 = lease['acquired'] + lease['rebind']
+            expiry = lease['acquired'] + lease['lease_time']
+            if now >= expiry:
+                if timing:
+                    self._record(timing, 'expired', lease['address'])
+                self._expire()
+                return
+            if now < t1:
+                self._sleep(t1 - now)
+                continue
+
+            renewing = now < t2
+            path = 'renew' if renewing else 'rebind'
+            if not timing or timing['path'] != path:
+                if timing:
+                    self._record(timing, 'timeout', lease['address'])
+                timing = self._timing(path)
+            self._set_state('renewing' if renewing else 'rebinding')
+            deadline = t2 if renewing else expiry
+            reply = self._renew(lease, renewing, timing, time.monotonic() + min(RETRANSMIT_MAX, deadline - now))
+            if reply and reply['type'] == DHCPACK:
+                timing['ack_ms'] = round((time.monotonic() - timing['_start']) * 1000, 1)
+                if self._bind(lease_from_ack(reply), timing) is None:
+                    self._expire()
+                    return
+                timing = None
+                continue
+            if reply:
+                timing['naks'] += 1
+                self._record(timing, 'nak', lease['address'])
+                self.manager.event('nak', f"Renewal of {lease['address']} on {self.interface} refused",
+                                   'warning', interface=self.interface, address=lease['address'])
+                self._expire()
+                return
+            # No answer: wait half the remaining time (RFC 2131 4.4.5), at least RENEW_RETRY
+            remaining = deadline - time.time()
+            self._sleep(min(remaining, max(remaining / 2, RENEW_RETRY)))
+        if timing and self._link_changed:
+            self._record(timing, 'link-change', self.lease['address'] if self.lease else None)
+
+    def _renew(self, lease, unicast, timing, until):
+        xid = random.getrandbits(32)
+        payload = self._message(DHCPREQUEST, xid, None, ciaddr=lease['address'])
+        timing['attempts'] += 1
+        try:
+            with DhcpSocket(self.interface) as sock:
+                if unicast and lease.get('server'):
+                    sock.unicast(payload, lease['address'], lease['server'])
+                else:
+                    sock.broadcast(payload, lease['address'])
+                return self._receive(sock, xid, (DHCPACK, DHCPNAK), until)
+        except OSError as e:
+            self.error = f'Socket error: {e}'
+            return None
+
+    def _expire(self):
+        lease = self.lease
+        self.bound.clear()
+        self.lease = None
+        self.manager.cache.forget(self.interface, self.mac)
+        if lease:
+            self.manager.deconfigure(self.interface, lease)
+            self.manager.event('expired', f"Lease {lease['address']} on {self.interface} lost", 'warning',
+                               interface=self.interface, address=lease['address'])
+
+    def _finish(self):
+        lease = self.lease
+        self.bound.clear()
+        if lease and self._release:
+            try:
+                with DhcpSocket(self.interface) as sock:
+                    payload = self._message(DHCPRELEASE, random.getrandbits(32), None,
+                                            server=lease.get('server'), ciaddr=lease['address'])
+                    if lease.get('server'):
+                        sock.unicast(payload, lease['address'], lease['server'])
+                    else:
+                        sock.broadcast(payload, lease['address'])
+            except OSError as e:
+                logger.warning(f"Cannot send DHCPRELEASE on {self.interface}: {e}")
+            self.manager.cache.mark_released(self.interface, self.mac)
+        if lease and not self._keep_address:
+            self.manager.deconfigure(self.interface, lease)
+        if self._release:
+            self.lease = None
+        self._set_state('released' if self._release else 'stopped')
+
+    def get_status(self):
+        lease = self.lease
+        status = {
+            'interface': self.interface,
+            'mac': self.mac.hex(':') if self.mac else None,
+            'state': self.state,
+            'running': self.is_alive(),
+            'bound': self.bound.is_set(),
+            'lease': None,
+            'last': self.history[-1] if self.history else None,
+            'history': list(self.history),
+            'error': self.error,
+        }
+        if lease:
+            now = time.time()
+            status['lease'] = dict(
+                lease,
+                expires_in=round(lease_remaining(lease, now), 1),
+                renew_in=round(lease['acquired'] + lease['renew'] - now, 1),
+                rebind_in=round(lease['acquired'] + lease['rebind'] - now, 1))
+        return status
+
+
+class DhcpManager:
+    """Runs one DhcpClient per interface and applies their leases"""
+
+    def __init__(self, run_command, path=LEASE_FILE, on_event=None, watch_links=True):
+        self.run_command = run_command
+        self.cache = LeaseCache(path)
+        self.on_event = on_event
+        self.watch_links = watch_links
+        self.clients = {}
+        self._lock = threading.Lock()
+        self._monitor = None
+
+    def event(self, event, message, severity='info', **details):
+        if self.on_event:
+            try:
+                self.on_event(event, message, severity, **details)
+            except Exception as e:
+                logger.error(f"DHCP event callback failed: {e}")
+
+    def start(self, interfaces, wait=False, timeout=DISCOVER_TIMEOUT):
+        """Start (or nudge) clients; returns at once unless `wait`"""
+        if isinstance(interfaces, str):
+            interfaces = [interfaces]
+        for name in interfaces:
+            if not valid_interface_name(name):
+                return {'success': False, 'error': f'Invalid interface name: {name!r}'}
+        for name in interfaces:
+            client = self.clients.get(name)
+            if not (client and client.is_alive()):
+                error = self.take_over(name)
+                if error:
+                    return {'success': False, 'error': error}
+
+        with self._lock:
+            for name in interfaces:
+                client = self.clients.get(name)
+                if client and client.is_alive():
+                    client.retry()
+                    continue
+                client = DhcpClient(self, name)
+                self.clients[name] = client
+                client.start()
+                self.cache.set_managed(name, True)
+            if self.watch_links and not (self._monitor and self._monitor.is_alive()):
+                self._monitor = LinkMonitor(self._on_link)
+                self._monitor.name = 'dhcp-link-monitor'
+                self._monitor.start()
+
+        if wait:
+            self.wait(interfaces, timeout)
+        statuses = {name: self.clients[name].get_status() for name in interfaces}
+        response = {'success': True, 'interfaces': statuses}
+        if wait:
+            pending = [name for name, status in statuses.items() if not status['bound']]
+            if pending:
+                response = dict(response, success=False, error=f"No lease yet on {', '.join(pending)}")
+        else:
+            response['message'] = f"DHCP started on {', '.join(interfaces)}"
+        return response
+
+    def take_over(self, interface, timeout=2):
+        """Stop a DHCP client started outside the manager (e.g. by configure-usb-tethering.sh)"""
+        pids = external_clients(interface)
+        if not pids:
+            return None
+        # SIGTERM, not a release: the address stays until our lease replaces it
+        self.run_command(f"sudo kill {' '.join(map(str, pids))}")
+        deadline = time.monotonic() + timeout
+        while external_clients(interface):
+            if time.monotonic() > deadline:
+                return f"External DHCP client on {interface} (pid {', '.join(map(str, pids))}) did not exit"
+            time.sleep(0.1)
+        self.event('takeover', f"Stopped external DHCP client on {interface}", 'warning',
+                   interface=interface, pids=pids)
+        return None
+
+    def wait(self, interfaces, timeout=DISCOVER_TIMEOUT):
+        """Wait until every interface is bound or the timeout passes; True if all are bound"""
+        deadline = time.monotonic() + timeout
+        for name in interfaces:
+            client = self.clients.get(name)
+            if not client or not client.bound.wait(max(deadline - time.monotonic(), 0)):
+                return False
+        return True
+
+    def stop(self, interface, release=True, keep_address=False, timeout=3):
+        """Stop a client, by default releasing the lease and removing the address"""
+        with self._lock:
+            client = self.clients.get(interface)
+            self.cache.set_managed(interface, False)
+        if not client or not client.is_alive():
+            return {'success': True, 'message': f'DHCP not running on {interface}'}
+        client.stop(release=release, keep_address=keep_address)
+        client.join(timeout)
+        if client.is_alive():
+            return {'success': False, 'error': f'DHCP client on {interface} did not stop in time'}
+        self.event('released' if release else 'stopped',
+                   f"DHCP {'released' if release else 'stopped'} on {interface}", 'info', interface=interface)
+        return {'success': True, 'message': f"DHCP {'released' if release else 'stopped'} on {interface}"}
+
+    def resume(self):
+        """Restart the clients that were running at the last shutdown"""
+        managed = [name for name in self.cache.managed if valid_interface_name(name)]
+        return self.start(managed) if managed else None
+
+    def shutdown(self):
+        """Stop every client, keeping addresses and leases for the next start"""
+        with self._lock:
+            clients = list(self.clients.values())
+            monitor, self._monitor = self._monitor, None
+        for client in clients:
+            client.stop(release=False, keep_address=True)
+        for client in clients:
+            client.join(2)
+        if monitor:
+            monitor.stop_event.set()
+
+    def _on_link(self, interface, carrier):
+        client = self.clients.get(interface)
+        if client and client.is_alive():
+            client.notify_link(carrier)
+
+    def link_up(self, interface):
+        if read_carrier(interface) is False:
+            self.run_command(f"sudo ip link set dev {interface} up")
+
+    def addresses(self, interface):
+        result = self.run_command(f"ip -j -4 addr show dev {interface}")
+        if not result['success']:
+            return []
+        try:
+            info = json.loads(result['output'] or '[]')
+        except ValueError:
+            return []
+        return [f"{a['local']}/{a['prefixlen']}" for link in info for a in link.get('addr_info', [])
+                if a.get('scope') == 'global']
+
+    def configure(self, interface, lease, previous=None):
+        """Apply a lease in one batch: address, then default route, then stale removals"""
+        address = f"{lease['address']}/{lease['prefixlen']}"
+        lifetime = max(int(lease_remaining(lease)), 1)
+        existing = self.addresses(interface)
+        metric = ROUTE_METRIC_BASE + read_ifindex(interface)
+
+        stale = [a for a in existing if a != address]
+        network = ipaddress.ip_interface(address).network
+        batch = IpBatch(self.run_command)
+        # Without promote_secondaries, removing an old primary in the same subnet takes the new address with it
+        if any(ipaddress.ip_interface(a).network == network for a in stale) and \
+                not BulkInterfaceConfig(self.run_command).promote_secondaries(interface):
+            batch.hold_sysctl(f"net/ipv4/conf/{interface}/promote_secondaries", 1, 0)
+        batch.add(f"addr replace {address} brd + dev {interface} valid_lft {lifetime} preferred_lft {lifetime}",
+                  None if address in existing else f"addr del {address} dev {interface}")
+        if lease.get('router'):
+            batch.add(f"route replace default via {lease['router']} dev {interface} proto dhcp metric {metric}")
+        if previous and previous.get('router') and previous['router'] != lease.get('router'):
+            batch.add(f"route del default via {previous['router']} dev {interface} proto dhcp metric {metric}")
+        for old in stale:
+            batch.add(f"addr del {old} dev {interface}", f"addr add {old} dev {interface}")
+        result = batch.execute()
+        if not result['success']:
+            return result
+
+        if lease.get('dns') and (previous is None or previous.get('dns') != lease['dns']) and shutil.which('resolvectl'):
+            self.run_command(f"sudo resolvectl dns {interface} {' '.join(lease['dns'])}")
+        return result
+
+    def deconfigure(self, interface, lease):
+        batch = IpBatch(self.run_command)
+        if lease.get('router'):
+            metric = ROUTE_METRIC_BASE + read_ifindex(interface)
+            batch.add(f"route del default via {lease['router']} dev {interface} proto dhcp metric {metric}")
+        batch.add(f"addr del {lease['address']}/{lease['prefixlen']} dev {interface}")
+        # -force: the route may already be gone with the link
+        result = self.run_command("sudo ip -force -batch -", input=batch.script())
+        return {'success': result['success'], 'error': result.get('error')}
+
+    def get_status(self, interface=None):
+        if interface:
+            client = self.clients.get(interface)
+            if not client:
+                return {'success': False, 'error': f'DHCP not running on {interface}'}
+            return dict(client.get_status(), success=True)
+        return {
+            'success': True,
+            'interfaces': {name: client.get_status() for name, client in list(self.clients.items())},
+            'managed': list(self.cache.managed),
+        }
+
+
+class DhcpTestServer:
+    """Minimal DHCP server for one interface, enough to exercise the client"""
+
+    def __init__(self, interface, pool, router=None, lease_time=600, dns=None, delay=0.0, address=None):
+        self.interface = interface
+        self.address, self.prefixlen = address or interface_address(interface)
+        start, end = pool
+        self.pool = [str(ipaddress.IPv4Address(i)) for i in
+                     range(int(ipaddress.IPv4Address(start)), int(ipaddress.IPv4Address(end)) + 1)]
+        self.network = ipaddress.IPv4Network(f'{self.address}/{self.prefixlen}', strict=False)
+        self.router = router or self.address
+        self.lease_time = lease_time
+        self.dns = dns or []
+        self.delay = delay
+        self.bindings = {}  # mac -> address
+        self.stats = {name: 0 for name in MESSAGE_NAMES.values()}
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.sock = None
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, self.interface.encode())
+        self.sock.bind(('', SERVER_PORT))
+        self.sock.settimeout(0.5)
+        self._thread = threading.Thread(target=self.serve, name='dhcp-test-server', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(2)
+        if self.sock:
+            self.sock.close()
+
+    def serve(self):
+        while not self._stop_event.is_set():
+            try:
+                data, _ = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            packet = parse_packet(data)
+            if packet and packet['op'] == BOOTREQUEST:
+                self.handle(packet)
+
+    def allocate(self, mac, requested):
+        owners = {address: owner for owner, address in self.bindings.items()}
+        if requested in self.pool and owners.get(requested, mac) == mac:
+            return requested
+        if mac in self.bindings:
+            return self.bindings[mac]
+        for address in self.pool:
+            if address not in owners:
+                return address
+        return None
+
+    def handle(self, packet):
+        name = MESSAGE_NAMES.get(packet['type'])
+        if not name:
+            return
+        self.stats[name] += 1
+        mac = packet['mac'][:6]
+        requested = option_address(packet, OPT_REQUESTED_IP)
+
+        if packet['type'] == DHCPRELEASE:
+            if self.bindings.get(mac) == packet['ciaddr']:
+                del self.bindings[mac]
+            return
+        if packet['type'] == DHCPDISCOVER:
+            address = self.allocate(mac, requested)
+            if address:
+                self.reply(packet, DHCPOFFER, address)
+            return
+        if packet['type'] != DHCPREQUEST:
+            return
+
+        server = option_address(packet, OPT_SERVER_ID)
+        if server and server != self.address:
+            return  # the client took another server's offer
+        wanted = requested or packet['ciaddr']
+        owners = {address: owner for owner, address in self.bindings.items()}
+        if (wanted in self.pool and owners.get(wanted, mac) == mac
+                and (requested or owners.get(wanted) == mac)):
+            self.bindings[mac] = wanted
+            self.reply(packet, DHCPACK, wanted)
+        elif ipaddress.IPv4Address(wanted) in self.network or server:
+            self.reply(packet, DHCPNAK, ANY)
+        # Addresses from another network stay unanswered (not authoritative), as RFC 2131 allows
+
+    def reply(self, request, message_type, address):
+        if self.delay:
+            time.sleep(self.delay)
+        options = [(OPT_SERVER_ID, socket.inet_aton(self.address))]
+        if message_type != DHCPNAK:
+            mask = str(self.network.netmask)
+            options += [(OPT_LEASE_TIME, struct.pack('!I', self.lease_time)),
+                        (OPT_RENEWAL_TIME, struct.pack('!I', self.lease_time // 2)),
+                        (OPT_REBINDING_TIME, struct.pack('!I', self.lease_time * 7 // 8)),
+                        (OPT_SUBNET_MASK, socket.inet_aton(mask)),
+                        (OPT_ROUTER, socket.inet_aton(self.router))]
+            if self.dns:
+                options.append((OPT_DNS, b''.join(socket.inet_aton(d) for d in self.dns)))
+        packet = build_packet(BOOTREPLY, message_type, request['xid'], request['mac'][:6],
+                              ciaddr=request['ciaddr'], yiaddr=address, siaddr=self.address,
+                              broadcast=request['broadcast'], options=options)
+        renewing = request['ciaddr'] != ANY and message_type == DHCPACK
+        self.sock.sendto(packet, (request['ciaddr'] if renewing else BROADCAST, CLIENT_PORT))
+
+
+def interface_address(interface):
+    """(address, prefixlen) of an interface through SIOCGIFADDR/SIOCGIFNETMASK"""
+    request = struct.pack('256s', interface.encode()[:15])
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        address = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), 0x8915, request)[20:24])
+        mask = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), 0x891b, request)[20:24])
+    return address, ipaddress.IPv4Network(f'0.0.0.0/{mask}').prefixlen
+
+
+def main():
+    from checkpoints import run_command
+
+    parser = argparse.ArgumentParser(description='Network Interface Manager DHCP client')
+    sub = parser.add_subparsers(dest='command', required=True)
+    acquire = sub.add_parser('acquire', help='Acquire leases on interfaces concurrently')
+    acquire.add_argument('interfaces', nargs='+')
+    acquire.add_argument('--timeout', type=float, default=DISCOVER_TIMEOUT)
+    acquire.add_argument('--release', action='store_true', help='Release the leases again afterwards')
+    sub.add_parser('leases', help='Print the lease cache')
+    server = sub.add_parser('server', help='Run the built-in test server')
+    server.add_argument('--interface', required=True)
+    server.add_argument('--pool', required=True, help='FIRST-LAST address range')
+    server.add_argument('--router')
+    server.add_argument('--dns', action='append')
+    server.add_argument('--lease', type=int, default=600, help='Lease time in seconds')
+    server.add_argument('--delay', type=float, default=0.0, help='Delay every reply (seconds)')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.command == 'leases':
+        cache = LeaseCache()
+        print(json.dumps({'interfaces': cache.managed, 'leases': cache.leases}, indent=2))
+    elif args.command == 'acquire':
+        manager = DhcpManager(run_command, watch_links=False)
+        result = manager.start(args.interfaces, wait=True, timeout=args.timeout)
+        print(json.dumps(result, indent=2))
+        if args.release:
+            for name in args.interfaces:
+                manager.stop(name)
+        else:
+            manager.shutdown()
+        sys.exit(0 if result['success'] else 1)
+    else:
+        first, _, last = args.pool.partition('-')
+        test_server = DhcpTestServer(args.interface, (first, last), router=args.router,
+                                     lease_time=args.lease, dns=args.dns, delay=args.delay)
+        test_server.start()
+        print(f"Serving {args.pool} on {args.interface} as {test_server.address}", file=sys.stderr)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            test_server.stop()
+            print(json.dumps({'stats': test_server.stats,
+                              'bindings': {mac.hex(':'): a for mac, a in test_server.bindings.items()}}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
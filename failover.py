@@ -0,0 +1,609 @@
+#!/usr/bin/env python3
+"""
+Sub-second uplink failover for Network Interface Manager
+
+Each uplink gateway is probed with lightweight ICMP echoes at a fixed
+interval (BFD style: an uplink is declared down after `multiplier`
+consecutive misses). Carrier/operstate changes arrive through a netlink
+link monitor and take an uplink down immediately. When the set of live
+uplinks changes the multipath default route is replaced in one command.
+Restores are damped: an uplink must answer `multiplier` probes in a row
+and sit out a hold-down that doubles with every recent flap.
+
+Run `python3 failover.py --simulate` to replay a link failure against a
+simulated network and print the detection/reroute timeline.
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import queue
+import select
+import socket
+import struct
+import threading
+import ipaddress
+import logging
+from collections import deque
+
+from ipbatch import valid_interface_name
+
+logger = logging.getLogger(__name__)
+
+SYSFS_NET = '/sys/class/net'
+
+# Netlink constants (linux/rtnetlink.h, linux/if.h)
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+IFLA_IFNAME = 3
+IFF_LOWER_UP = 0x10000
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+# Time allowed for `ip route replace` when validating the budget
+REROUTE_ALLOWANCE_MS = 100
+
+# State changes passed to the on_event callback (probe misses are too chatty)
+JOURNALED_EVENTS = ('started', 'stopped', 'declared_down', 'restored',
+                    'route_applied', 'reroute_failed', 'reroute_skipped')
+
+
+def icmp_checksum(data):
+    """Internet checksum (RFC 1071)"""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class IcmpProber:
+    """Sends one echo per uplink per tick and collects the replies"""
+
+    def __init__(self, ident=None):
+        self.ident = (ident or os.getpid()) & 0xffff
+        self.sockets = {}
+
+    def _open(self, uplink):
+        try:
+            # Unprivileged ICMP, allowed by net.ipv4.ping_group_range
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            raw = False
+        except PermissionError:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            raw = True
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, uplink.interface.encode())
+        except OSError as e:
+            logger.warning(f"Cannot bind probe socket to {uplink.interface}: {e}")
+        sock.setblocking(False)
+        return sock, raw
+
+    def _packet(self, seq):
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, self.ident, seq)
+        payload = struct.pack('!d', time.monotonic())
+        checksum = icmp_checksum(header + payload)
+        return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, self.ident, seq) + payload
+
+    def _is_reply(self, data, raw, seq):
+        if raw:
+            data = data[(data[0] & 0x0f) * 4:]
+        if len(data) < 8:
+            return False
+        icmp_type, _, _, ident, reply_seq = struct.unpack('!BBHHH', data[:8])
+        # Datagram ICMP sockets rewrite the identifier, so only raw sockets check it
+        return icmp_type == ICMP_ECHO_REPLY and reply_seq == seq and (not raw or ident == self.ident)
+
+    def probe(self, uplinks, seq, timeout):
+        """Probe all uplinks concurrently, return the names that replied"""
+        seq &= 0xffff
+        pending = {}
+        for uplink in uplinks:
+            try:
+                if uplink.interface not in self.sockets:
+                    self.sockets[uplink.interface] = self._open(uplink)
+                sock, raw = self.sockets[uplink.interface]
+                sock.sendto(self._packet(seq), (uplink.gateway, 0))
+                pending[sock] = (uplink, raw)
+            except OSError as e:
+                # ENETUNREACH and friends count as a missed probe
+                if e.errno not in (errno.ENETUNREACH, errno.EHOSTUNREACH, errno.ENODEV):
+                    logger.debug(f"Probe send failed on {uplink.interface}: {e}")
+                self.close(uplink.interface)
+
+        alive = set()
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select(list(pending), [], [], remaining)
+            for sock in readable:
+                uplink, raw = pending[sock]
+                try:
+                    while True:
+                        data, _ = sock.recvfrom(1024)
+                        if self._is_reply(data, raw, seq):
+                            alive.add(uplink.interface)
+                            pending.pop(sock)
+                            break
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    pending.pop(sock, None)
+        return alive
+
+    def close(self, interface=None):
+        names = [interface] if interface else list(self.sockets)
+        for name in names:
+            entry = self.sockets.pop(name, None)
+            if entry:
+                entry[0].close()
+
+
+class LinkMonitor(threading.Thread):
+    """Delivers carrier changes from rtnetlink as (interface, carrier) callbacks"""
+
+    def __init__(self, callback):
+        super().__init__(name='failover-link-monitor', daemon=True)
+        self.callback = callback
+        self.stop_event = threading.Event()
+
+    def run(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK))
+        except OSError as e:
+            logger.warning(f"Netlink link monitor unavailable, relying on sysfs polling: {e}")
+            return
+
+        sock.settimeout(0.5)
+        with sock:
+            while not self.stop_event.is_set():
+                try:
+                    data = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                except OSError as e:
+                    logger.error(f"Netlink link monitor stopped: {e}")
+                    return
+                for interface, carrier in self.parse(data):
+                    self.callback(interface, carrier)
+
+    @staticmethod
+    def parse(data):
+        """Yield (interface, carrier) for each link message in a netlink datagram"""
+        offset = 0
+        while offset + 16 <= len(data):
+            msg_len, msg_type = struct.unpack_from('=IH', data, offset)
+            if msg_len < 16:
+                break
+            if msg_type in (RTM_NEWLINK, RTM_DELLINK):
+                _, _, _, flags, _ = struct.unpack_from('=BxHiII', data, offset + 16)
+                attr = offset + 32
+                end = offset + msg_len
+                while attr + 4 <= end:
+                    attr_len, attr_type = struct.unpack_from('=HH', data, attr)
+                    if attr_len < 4:
+                        break
+                    if attr_type == IFLA_IFNAME:
+                        name = data[attr + 4:attr + attr_len].split(b'\x00')[0].decode()
+                        yield name, msg_type == RTM_NEWLINK and bool(flags & IFF_LOWER_UP)
+                        break
+                    attr += (attr_len + 3) & ~3
+            offset += (msg_len + 3) & ~3
+
+
+def read_carrier(interface):
+    """Read carrier/operstate from sysfs, None if unknown"""
+    try:
+        with open(f"{SYSFS_NET}/{interface}/operstate") as f:
+            operstate = f.read().strip()
+        if operstate == 'down':
+            return False
+        with open(f"{SYSFS_NET}/{interface}/carrier") as f:
+            return f.read().strip() == '1'
+    except OSError:
+        return False if not os.path.exists(f"{SYSFS_NET}/{interface}") else None
+
+
+class Uplink:
+    def __init__(self, interface, gateway, weight=1):
+        self.interface = interface
+        self.gateway = gateway
+        self.weight = int(weight)
+        self.state = 'up'
+        self.carrier = True
+        self.missed = 0
+        self.good = 0
+        self.last_reply = None
+        self.down_since = None
+        self.hold_until = 0
+        self.flaps = deque()
+
+    def to_dict(self):
+        return {
+            'interface': self.interface,
+            'gateway': self.gateway,
+            'weight': self.weight,
+            'state': self.state,
+            'carrier': self.carrier,
+            'missed': self.missed,
+            'good': self.good,
+            'flaps': len(self.flaps),
+            'hold_down_remaining_ms': max(0, round((self.hold_until - time.monotonic()) * 1000))
+        }
+
+
+class FailoverController:
+    def __init__(self, run_command, prober=None, carrier_reader=read_carrier,
+                 route_applier=None, link_monitor=True, on_event=None):
+        self.run_command = run_command
+        self.on_event = on_event
+        self.prober = prober
+        self.carrier_reader = carrier_reader
+        self.route_applier = route_applier or self.apply_default_route
+        self.use_link_monitor = link_monitor
+
+        self.uplinks = []
+        self.interval_ms = 100
+        self.multiplier = 3
+        self.budget_ms = 1000
+        self.hold_down_ms = 2000
+        self.flap_window_ms = 60000
+
+        self.running = False
+        self.started_at = None
+        self.active_nexthops = []
+        self.events = deque(maxlen=2000)
+        self.episodes = deque(maxlen=100)
+        self._open_episodes = {}
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._link_monitor = None
+        # on_event runs on its own thread: journal writes take a file lock
+        # shared with usb-monitor.sh and must not delay detect -> reroute
+        self._notifications = queue.SimpleQueue()
+        if on_event:
+            threading.Thread(target=self._notify, name='failover-events', daemon=True).start()
+
+    def configure(self, uplinks, interval_ms=None, multiplier=None, budget_ms=None, hold_down_ms=None):
+        """Validate and apply configuration, return an error dict on failure"""
+        try:
+            interval_ms = int(interval_ms or self.interval_ms)
+            multiplier = int(multiplier or self.multiplier)
+            budget_ms = int(budget_ms or self.budget_ms)
+            hold_down_ms = int(hold_down_ms if hold_down_ms is not None else self.hold_down_ms)
+        except (TypeError, ValueError):
+            return {'success': False, 'error': 'interval_ms, multiplier, budget_ms and hold_down_ms must be integers'}
+
+        if interval_ms < 10 or multiplier < 1:
+            return {'success': False, 'error': 'interval_ms must be >= 10 and multiplier >= 1'}
+        detection_ms = interval_ms * multiplier
+        if detection_ms + REROUTE_ALLOWANCE_MS > budget_ms:
+            return {'success': False,
+                    'error': f'Detection time {detection_ms}ms plus reroute allowance '
+                             f'{REROUTE_ALLOWANCE_MS}ms exceeds budget {budget_ms}ms'}
+        if not uplinks:
+            return {'success': False, 'error': 'No uplinks to monitor'}
+        if not isinstance(uplinks, list):
+            return {'success': False, 'error': 'uplinks must be a list'}
+
+        parsed = []
+        for uplink in uplinks:
+            # Both end up in `ip route` commands run through the shell
+            if not isinstance(uplink, dict) or not valid_interface_name(uplink.get('interface')):
+                return {'success': False, 'error': f'Invalid uplink {uplink!r}'}
+            try:
+                gateway = str(ipaddress.IPv4Address(uplink.get('gateway')))
+                parsed.append(Uplink(uplink['interface'], gateway, uplink.get('weight', 1)))
+            except (TypeError, ValueError) as e:
+                return {'success': False, 'error': f"{uplink['interface']}: invalid uplink definition: {e}"}
+            if parsed[-1].weight < 1:
+                return {'success': False, 'error': f"{uplink['interface']}: weight must be >= 1"}
+
+        with self._lock:
+            self.uplinks = parsed
+            self.interval_ms = interval_ms
+            self.multiplier = multiplier
+            self.budget_ms = budget_ms
+            self.hold_down_ms = hold_down_ms
+        return {'success': True}
+
+    def start(self, uplinks, **options):
+        """Start monitoring the given uplinks"""
+        if self.running:
+            self.stop()
+
+        result = self.configure(uplinks, **options)
+        if not result['success']:
+            return result
+
+        if self.prober is None:
+            self.prober = IcmpProber()
+        self.events.clear()
+        self.episodes.clear()
+        self._open_episodes = {}
+        self.active_nexthops = [u.interface for u in self.uplinks]
+        self.started_at = time.monotonic()
+        self._stop_event.clear()
+        self.running = True
+        self._record('started', uplinks=[u.interface for u in self.uplinks])
+
+        if self.use_link_monitor:
+            self._link_monitor = LinkMonitor(self.on_carrier_change)
+            self._link_monitor.start()
+        self._thread = threading.Thread(target=self._run, name='failover', daemon=True)
+        self._thread.start()
+        return {'success': True, 'message': f'Failover monitoring {len(self.uplinks)} uplinks',
+                'status': self.get_status()}
+
+    def stop(self):
+        """Stop monitoring, leaving the current route in place"""
+        if not self.running:
+            return {'success': True, 'message': 'Failover not running'}
+        self._stop_event.set()
+        if self._link_monitor:
+            self._link_monitor.stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        if hasattr(self.prober, 'close'):
+            self.prober.close()
+        self.running = False
+        self._record('stopped')
+        return {'success': True, 'message': 'Failover stopped'}
+
+    def _now_ms(self):
+        return round((time.monotonic() - self.started_at) * 1000, 1) if self.started_at else 0
+
+    def _record(self, event, interface=None, **details):
+        entry = {'t_ms': self._now_ms(), 'time': time.time(), 'event': event}
+        if interface:
+            entry['interface'] = interface
+        entry.update(details)
+        self.events.append(entry)
+        if self.on_event and event in JOURNALED_EVENTS:
+            self._notifications.put(entry)
+        return entry
+
+    def _notify(self):
+        while True:
+            entry = self._notifications.get()
+            try:
+                self.on_event(entry)
+            except Exception as e:
+                logger.error(f"Failover event callback failed: {e}")
+
+    def _run(self):
+        interval = self.interval_ms / 1000
+        seq = 0
+        next_tick = time.monotonic()
+        while not self._stop_event.is_set():
+            seq += 1
+            alive = self.prober.probe(self.uplinks, seq, interval * 0.9)
+            self._process_tick(alive)
+
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                # Fell behind (slow reroute), resynchronise instead of bursting
+                next_tick = time.monotonic()
+                delay = 0
+            self._stop_event.wait(delay)
+
+    def _process_tick(self, alive):
+        now = time.monotonic()
+        changed = False
+        with self._lock:
+            for uplink in self.uplinks:
+                carrier = self.carrier_reader(uplink.interface) if self.carrier_reader else None
+                if carrier is not None and carrier != uplink.carrier:
+                    changed |= self._set_carrier(uplink, carrier)
+
+                if uplink.interface in alive:
+                    uplink.missed = 0
+                    uplink.good += 1
+                    uplink.last_reply = now
+                else:
+                    uplink.good = 0
+                    uplink.missed += 1
+                    if uplink.state == 'up' and uplink.missed == 1:
+                        self._record('probe_miss', uplink.interface)
+
+                if uplink.state == 'up' and uplink.missed >= self.multiplier:
+                    self._mark_down(uplink, 'probe_timeout')
+                    changed = True
+                elif (uplink.state == 'down' and uplink.carrier and uplink.good >= self.multiplier
+                      and now >= uplink.hold_until):
+                    self._mark_up(uplink)
+                    changed = True
+
+            if changed:
+                self._reroute()
+
+    def on_carrier_change(self, interface, carrier):
+        """Link monitor callback; carrier loss reroutes without waiting for probes"""
+        with self._lock:
+            for uplink in self.uplinks:
+                if uplink.interface == interface and uplink.carrier != carrier:
+                    if self._set_carrier(uplink, carrier):
+                        self._reroute()
+
+    def _set_carrier(self, uplink, carrier):
+        uplink.carrier = carrier
+        self._record('carrier_up' if carrier else 'carrier_down', uplink.interface)
+        if not carrier and uplink.state == 'up':
+            self._mark_down(uplink, 'carrier_down')
+            return True
+        return False
+
+    def _mark_down(self, uplink, reason):
+        now = time.monotonic()
+        uplink.state = 'down'
+        uplink.down_since = now
+
+        window = self.flap_window_ms / 1000
+        uplink.flaps.append(now)
+        while uplink.flaps and now - uplink.flaps[0] > window:
+            uplink.flaps.popleft()
+        hold_down = self.hold_down_ms * 2 ** min(len(uplink.flaps) - 1, 5)
+        uplink.hold_until = now + hold_down / 1000
+
+        last_ok = uplink.last_reply or self.started_at
+        detect_ms = round((now - last_ok) * 1000, 1)
+        self._record('declared_down', uplink.interface, reason=reason,
+                     detect_ms=detect_ms, hold_down_ms=hold_down)
+        self._open_episodes[uplink.interface] = {
+            'interface': uplink.interface,
+            'reason': reason,
+            'last_reply_t_ms': round((last_ok - self.started_at) * 1000, 1),
+            'declared_t_ms': self._now_ms(),
+            'detect_ms': detect_ms
+        }
+
+    def _mark_up(self, uplink):
+        down_ms = round((time.monotonic() - uplink.down_since) * 1000, 1) if uplink.down_since else None
+        uplink.state = 'up'
+        uplink.down_since = None
+        self._record('restored', uplink.interface, down_ms=down_ms)
+
+    def _reroute(self):
+        live = [u for u in self.uplinks if u.state == 'up']
+        names = [u.interface for u in live]
+        if not live:
+            # Removing the last nexthop would blackhole everything; keep the route
+            self._record('reroute_skipped', reason='no live uplinks')
+            return
+        if names == self.active_nexthops:
+            return
+
+        start = time.monotonic()
+        result = self.route_applier(live)
+        reroute_ms = round((time.monotonic() - start) * 1000, 1)
+        if not result['success']:
+            self._record('reroute_failed', error=result.get('error'), reroute_ms=reroute_ms)
+            return
+
+        self.active_nexthops = names
+        self._record('route_applied', nexthops=names, reroute_ms=reroute_ms)
+
+        applied_t_ms = self._now_ms()
+        for name, episode in list(self._open_episodes.items()):
+            if name in names:
+                continue
+            episode['reroute_ms'] = reroute_ms
+            episode['applied_t_ms'] = applied_t_ms
+            episode['total_ms'] = round(applied_t_ms - episode['last_reply_t_ms'], 1)
+            episode['within_budget'] = episode['total_ms'] <= self.budget_ms
+            self.episodes.append(episode)
+            del self._open_episodes[name]
+
+    def apply_default_route(self, live):
+        """Replace the default route with the live nexthops in one command"""
+        if len(live) == 1:
+            cmd = f"sudo ip route replace default via {live[0].gateway} dev {live[0].interface}"
+        else:
+            nexthops = ' '.join(f"nexthop via {u.gateway} dev {u.interface} weight {u.weight}" for u in live)
+            cmd = f"sudo ip route replace default scope global {nexthops}"
+        return self.run_command(cmd, timeout=2)
+
+    def get_status(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'interval_ms': self.interval_ms,
+                'multiplier': self.multiplier,
+                'detection_ms': self.interval_ms * self.multiplier,
+                'budget_ms': self.budget_ms,
+                'hold_down_ms': self.hold_down_ms,
+                'active_nexthops': list(self.active_nexthops),
+                'uplinks': [u.to_dict() for u in self.uplinks]
+            }
+
+    def get_timeline(self):
+        """Detection and reroute timeline for verification"""
+        return {
+            'budget_ms': self.budget_ms,
+            'events': list(self.events),
+            'episodes': list(self.episodes)
+        }
+
+
+class SimulatedNetwork:
+    """Probe, carrier and route backends for a simulated set of links"""
+
+    def __init__(self, rtt_ms=2, route_delay_ms=5):
+        self.rtt = rtt_ms / 1000
+        self.route_delay = route_delay_ms / 1000
+        self.reachable = {}
+        self.carrier = {}
+        self.routes = []
+
+    def add_link(self, interface):
+        self.reachable[interface] = True
+        self.carrier[interface] = True
+
+    def fail(self, interface, carrier=True):
+        """Silently stop answering probes; optionally drop carrier too"""
+        self.reachable[interface] = False
+        self.carrier[interface] = carrier
+
+    def restore(self, interface):
+        self.reachable[interface] = True
+        self.carrier[interface] = True
+
+    def probe(self, uplinks, seq, timeout):
+        alive = {u.interface for u in uplinks if self.reachable.get(u.interface)}
+        # A real prober waits out the timeout while any reply is missing
+        time.sleep(min(self.rtt, timeout) if len(alive) == len(uplinks) else timeout)
+        return alive
+
+    def read_carrier(self, interface):
+        return self.carrier.get(interface)
+
+    def apply_route(self, live):
+        time.sleep(self.route_delay)
+        self.routes.append([u.interface for u in live])
+        return {'success': True}
+
+
+def simulate(interval_ms=50, multiplier=3, budget_ms=1000, hold_down_ms=500, fail_after=1.0, down_for=2.0):
+    """Fail one of two simulated uplinks, restore it, and return the timeline"""
+    net = SimulatedNetwork()
+    uplinks = [{'interface': 'lan0', 'gateway': '192.0.2.1'}, {'interface': 'usb0', 'gateway': '198.51.100.1'}]
+    for uplink in uplinks:
+        net.add_link(uplink['interface'])
+
+    controller = FailoverController(None, prober=net, carrier_reader=net.read_carrier,
+                                    route_applier=net.apply_route, link_monitor=False)
+    result = controller.start(uplinks, interval_ms=interval_ms, multiplier=multiplier,
+                              budget_ms=budget_ms, hold_down_ms=hold_down_ms)
+    if not result['success']:
+        return result
+
+    time.sleep(fail_after)
+    controller._record('link_failed', 'usb0', simulated=True)
+    net.fail('usb0')
+    time.sleep(down_for)
+    controller._record('link_repaired', 'usb0', simulated=True)
+    net.restore('usb0')
+    time.sleep(hold_down_ms / 1000 + interval_ms * multiplier * 2 / 1000)
+    controller.stop()
+
+    timeline = controller.get_timeline()
+    timeline['routes'] = net.routes
+    return timeline
+
+
+if __name__ == '__main__':
+    if '--simulate' in sys.argv:
+        print(json.dumps(simulate(), indent=2))
+    else:
+        print(f"Usage: {sys.argv[0]} --simulate")
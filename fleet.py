@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Fleet mode for Network Interface Manager
+
+Agents collect a snapshot (interfaces, routes, probe results) every
+interval and publish it to a central aggregator instance. Snapshots are
+flattened into path -> value pairs so that each frame only carries the
+values that changed since the previous one. Frames are chained by
+sequence number (`base` is the frame a delta applies to) and several are
+batched into one gzip-compressed POST; an aggregator that has lost the
+chain answers with `resync` and the agent sends a full snapshot next.
+
+Agent:       NIM_FLEET_AGGREGATOR=http://hub:5020 python3 app.py
+Aggregator:  NIM_FLEET_SERVE=1 python3 app.py        (dashboard at /fleet)
+
+Several local agents with synthetic interfaces, for testing:
+
+    NIM_PORT=5021 NIM_FLEET_SERVE=1 python3 app.py
+    python3 fleet.py agent --aggregator http://127.0.0.1:5021 --node sim1 --synthetic 20
+    python3 fleet.py simulate --aggregator http://127.0.0.1:5021 --nodes 200
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import zlib
+import gzip
+import random
+import socket
+import logging
+import argparse
+import threading
+import urllib.error
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+FLEET_AGGREGATOR = os.environ.get('NIM_FLEET_AGGREGATOR', '').rstrip('/')
+FLEET_SERVE = os.environ.get('NIM_FLEET_SERVE', '0') == '1'
+FLEET_NODE = os.environ.get('NIM_FLEET_NODE') or socket.gethostname()
+FLEET_TOKEN = os.environ.get('NIM_FLEET_TOKEN', '')
+FLEET_INTERVAL = float(os.environ.get('NIM_FLEET_INTERVAL', '5'))  # seconds between snapshots
+FLEET_BATCH = int(os.environ.get('NIM_FLEET_BATCH', '3'))  # snapshots per upload
+
+PUSH_PATH = '/api/fleet/push'
+MAX_FRAMES = 60  # buffered while the aggregator is unreachable, then collapsed
+MAX_PAYLOAD = 16 << 20  # bytes accepted per upload, on the wire and decompressed
+FORGET_AFTER = 24 * 3600  # drop nodes silent for this long
+RESERVED_NODES = ('push', 'agent')  # clash with /api/fleet/<node>
+
+
+def flatten(value, prefix='', out=None):
+    """Nested dicts to {'a/b/c': leaf}; lists and empty dicts are leaves"""
+    if out is None:
+        out = {}
+    for key, item in value.items():
+        path = f"{prefix}{key}"
+        if isinstance(item, dict) and item:
+            flatten(item, f"{path}/", out)
+        else:
+            out[path] = item
+    return out
+
+
+def unflatten(flat):
+    nested = {}
+    for path, value in flat.items():
+        node = nested
+        *parents, leaf = path.split('/')
+        for key in parents:
+            node = node.setdefault(key, {})
+        node[leaf] = value
+    return nested
+
+
+_MISSING = object()
+
+
+def diff(old, new):
+    """Delta turning flat state `old` into `new`: (changed, removed paths)"""
+    changed = {path: value for path, value in new.items() if old.get(path, _MISSING) != value}
+    removed = [path for path in old if path not in new]
+    return changed, removed
+
+
+def decompress(data, limit=MAX_PAYLOAD):
+    """gunzip with an upper bound on the output size"""
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    output = decoder.decompress(data, limit)
+    if decoder.unconsumed_tail:
+        raise ValueError(f'Payload exceeds {limit} bytes')
+    return output
+
+
+class FleetAgent:
+    """Collects snapshots and pushes delta frames to the aggregator"""
+
+    def __init__(self, collect, aggregator=FLEET_AGGREGATOR, node=FLEET_NODE, token=FLEET_TOKEN,
+                 interval=FLEET_INTERVAL, batch=FLEET_BATCH, timeout=10):
+        self.collect = collect
+        self.url = f"{aggregator}{PUSH_PATH}"
+        self.node = node
+        self.token = token
+        self.interval = interval
+        self.batch = max(1, batch)
+        self.timeout = timeout
+
+        self.seq = 0
+        self.state = {}  # flat state after the last frame built
+        self.frames = []  # built but not yet acknowledged
+        self.full_next = True
+        self.stats = {'pushes': 0, 'failures': 0, 'resyncs': 0, 'frames': 0,
+                      'bytes_raw': 0, 'bytes_sent': 0, 'last_push': None, 'last_error': None}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def build_frame(self):
+        """Collect a snapshot and append the frame describing it"""
+        flat = flatten(self.collect())
+        self.seq += 1
+        frame = {'seq': self.seq, 'time': round(time.time(), 3)}
+        if self.full_next:
+            frame.update(full=True, set=flat)
+            self.full_next = False
+        else:
+            changed, removed = diff(self.state, flat)
+            frame.update(base=self.seq - 1, set=changed)
+            if removed:
+                frame['del'] = removed
+        self.state = flat
+        self.frames.append(frame)
+
+        if len(self.frames) > MAX_FRAMES:
+            # Aggregator unreachable for a while: keep only the current state
+            self.frames = [{'seq': self.seq, 'time': frame['time'], 'full': True, 'set': flat}]
+        return frame
+
+    def payload(self):
+        return {'node': self.node, 'interval': self.interval * self.batch, 'frames': self.frames}
+
+    def push(self):
+        """Upload the buffered frames in one compressed request"""
+        if not self.frames:
+            return {'success': True, 'message': 'Nothing to push'}
+
+        raw = json.dumps(self.payload(), separators=(',', ':')).encode()
+        body = gzip.compress(raw, compresslevel=6)
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        if self.token:
+            headers['X-Fleet-Token'] = self.token
+        req = urllib.request.Request(self.url, data=body, headers=headers, method='POST')
+
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                result = json.loads(response.read() or b'{}')
+        except urllib.error.HTTPError as e:
+            try:
+                result = json.loads(e.read() or b'{}')
+            except ValueError:
+                result = {}
+            if not result.get('resync'):
+                return self._failed(f'HTTP {e.code}: {result.get("error", e.reason)}')
+        except (OSError, ValueError) as e:
+            return self._failed(str(e))
+
+        self.stats['pushes'] += 1
+        self.stats['frames'] += len(self.frames)
+        self.stats['bytes_raw'] += len(raw)
+        self.stats['bytes_sent'] += len(body)
+        self.stats['last_push'] = time.time()
+        self.stats['last_error'] = None
+        self.frames = []
+        if result.get('resync'):
+            # The aggregator lost our chain; start over from a full snapshot
+            self.stats['resyncs'] += 1
+            self.full_next = True
+        return {'success': True, 'resync': bool(result.get('resync')), 'bytes': len(body)}
+
+    def _failed(self, error):
+        self.stats['failures'] += 1
+        self.stats['last_error'] = error
+        logger.warning(f"Fleet push to {self.url} failed: {error}")
+        return {'success': False, 'error': error}
+
+    def run(self):
+        # Spread hundreds of agents over the interval
+        self._stop_event.wait(random.uniform(0, self.interval))
+        while not self._stop_event.is_set():
+            try:
+                frame = self.build_frame()
+                # Full snapshots go out at once so the node shows up without waiting a batch
+                if len(self.frames) >= self.batch or frame.get('full'):
+                    self.push()
+            except Exception as e:
+                logger.error(f"Fleet snapshot failed: {e}")
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name='fleet-agent', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def get_status(self):
+        return dict(self.stats, node=self.node, aggregator=self.url, seq=self.seq,
+                    buffered=len(self.frames), interval=self.interval, batch=self.batch)
+
+
+class NodeState:
+    __slots__ = ('node', 'flat', 'seq', 'interval', 'first_seen', 'last_seen', 'last_frame_time',
+                 'address', 'pushes', 'bytes', 'resyncs', '_nested')
+
+    def __init__(self, node):
+        self.node = node
+        self.flat = {}
+        self.seq = None
+        self.interval = FLEET_INTERVAL * FLEET_BATCH
+        self.first_seen = time.time()
+        self.last_seen = None
+        self.last_frame_time = None
+        self.address = None
+        self.pushes = 0
+        self.bytes = 0
+        self.resyncs = 0
+        self._nested = None
+
+    def nested(self):
+        if self._nested is None:
+            self._nested = unflatten(self.flat)
+        return self._nested
+
+
+class FleetAggregator:
+    """Merges agent frames into per-node state"""
+
+    def __init__(self, token=FLEET_TOKEN, forget_after=FORGET_AFTER):
+        self.token = token
+        self.forget_after = forget_after
+        self.nodes = {}
+        self._lock = threading.Lock()
+
+    def authorized(self, token):
+        return not self.token or hmac.compare_digest(self.token, token or '')
+
+    def ingest(self, payload, address=None, size=0):
+        """Apply a batch of frames; returns {'success', 'seq', 'resync'}"""
+        node_id = payload.get('node') if isinstance(payload, dict) else None
+        frames = payload.get('frames') if isinstance(payload, dict) else None
+        if (not isinstance(node_id, str) or not node_id or len(node_id) > 64 or '/' in node_id
+                or node_id in RESERVED_NODES):
+            return {'success': False, 'error': 'Invalid node name'}
+        if not isinstance(frames, list):
+            return {'success': False, 'error': 'frames must be a list'}
+
+        with self._lock:
+            node = self.nodes.get(node_id)
+            if node is None:
+                node = self.nodes[node_id] = NodeState(node_id)
+            node.last_seen = time.time()
+            node.address = address
+            node.pushes += 1
+            node.bytes += size
+            if isinstance(payload.get('interval'), (int, float)) and payload['interval'] > 0:
+                node.interval = payload['interval']
+
+            for frame in frames:
+                if not isinstance(frame, dict) or not isinstance(frame.get('set'), dict):
+                    return {'success': False, 'error': 'Malformed frame'}
+                if frame.get('full'):
+                    node.flat = dict(frame['set'])
+                elif node.seq is not None and frame.get('base') == node.seq:
+                    node.flat.update(frame['set'])
+                    for path in frame.get('del', []):
+                        node.flat.pop(path, None)
+                elif node.seq is not None and frame.get('seq', 0) <= node.seq:
+                    # Retransmission of a frame already applied
+                    continue
+                else:
+                    node.resyncs += 1
+                    node.seq = None
+                    node._nested = None
+                    return {'success': False, 'resync': True,
+                            'error': f'Frame {frame.get("seq")} does not follow the stored state'}
+                node.seq = frame.get('seq')
+                node.last_frame_time = frame.get('time')
+                node._nested = None
+
+            return {'success': True, 'seq': node.seq}
+
+    def _prune(self, now):
+        for node_id in [n for n, node in self.nodes.items()
+                        if node.last_seen and now - node.last_seen > self.forget_after]:
+            del self.nodes[node_id]
+
+    def _summary(self, node, now):
+        state = node.nested()
+        interfaces = state.get('interfaces', {})
+        age = now - node.last_seen if node.last_seen else None
+        # Missing three uploads in a row marks a node stale
+        stale = age is None or age > max(3 * node.interval, 15)
+        return {
+            'node': node.node,
+            'address': node.address,
+            'seq': node.seq,
+            'synced': node.seq is not None,
+            'last_seen': node.last_seen,
+            'age_s': round(age, 1) if age is not None else None,
+            'stale': stale,
+            'interval_s': node.interval,
+            'interfaces_total': len(interfaces),
+            'interfaces_up': sum(1 for iface in interfaces.values()
+                                 if isinstance(iface, dict) and iface.get('state') == 'UP'),
+            'default_routes': [route for route in state.get('routes', []) if route.startswith('default')],
+            'probes': state.get('probes', {}),
+            'pushes': node.pushes,
+            'bytes_received': node.bytes,
+            'resyncs': node.resyncs,
+        }
+
+    def summary(self):
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            nodes = [self._summary(node, now) for node in self.nodes.values()]
+        nodes.sort(key=lambda n: n['node'])
+        return {
+            'success': True,
+            'count': len(nodes),
+            'stale': sum(1 for n in nodes if n['stale']),
+            'nodes': nodes
+        }
+
+    def get_node(self, node_id):
+        now = time.time()
+        with self._lock:
+            node = self.nodes.get(node_id)
+            if node is None:
+                return None
+            result = self._summary(node, now)
+            result['state'] = node.nested()
+        return result
+
+    def forget(self, node_id):
+        with self._lock:
+            return self.nodes.pop(node_id, None) is not None
+
+
+class SyntheticCollector:
+    """Snapshot source with moving counters, for local fleet tests"""
+
+    def __init__(self, interfaces=10, seed=None):
+        self.rng = random.Random(seed)
+        self.interfaces = {}
+        for i in range(interfaces):
+            name = f"usb{i}" if i % 3 else f"eth{i}"
+            self.interfaces[name] = {
+                'name': name,
+                'type': 'usb' if i % 3 else 'ethernet',
+                'state': 'UP',
+                'mtu': 1500,
+                'addresses': [{'address': f"10.{i}.0.2/24", 'type': 'IPv4'}],
+                'stats': {'rx_bytes': 0, 'tx_bytes': 0, 'rx_packets': 0, 'tx_packets': 0}
+            }
+
+    def __call__(self):
+        for iface in self.interfaces.values():
+            if iface['state'] == 'UP':
+                rx = self.rng.randint(0, 5 << 20)
+                tx = self.rng.randint(0, 1 << 20)
+                iface['stats']['rx_bytes'] += rx
+                iface['stats']['tx_bytes'] += tx
+                iface['stats']['rx_packets'] += rx // 1400
+                iface['stats']['tx_packets'] += tx // 1400
+            if self.rng.random() < 0.01:
+                iface['state'] = 'DOWN' if iface['state'] == 'UP' else 'UP'
+        up = [name for name, iface in self.interfaces.items() if iface['state'] == 'UP']
+        return {
+            'interfaces': json.loads(json.dumps(self.interfaces)),
+            'routes': [f"default via 10.{i}.0.1 dev {name}" for i, name in enumerate(up[:2])],
+            'probes': {name: {'state': 'up', 'rtt_ms': round(self.rng.uniform(5, 60), 1)} for name in up[:2]}
+        }
+
+
+def simulate(aggregator, nodes, interfaces, rounds, batch, token):
+    """Push `rounds` batches from many in-process agents and report traffic"""
+    agents = [FleetAgent(SyntheticCollector(interfaces, seed=i), aggregator=aggregator,
+                         node=f"sim{i:03d}", token=token, batch=batch) for i in range(nodes)]
+    start = time.monotonic()
+    for _ in range(rounds):
+        for agent in agents:
+            for _ in range(batch):
+                agent.build_frame()
+            agent.push()
+    elapsed = time.monotonic() - start
+
+    full = sum(len(json.dumps(agent.collect(), separators=(',', ':'))) for agent in agents[:10]) / min(nodes, 10)
+    totals = {key: sum(agent.stats[key] for agent in agents)
+              for key in ('pushes', 'failures', 'resyncs', 'frames', 'bytes_raw', 'bytes_sent')}
+    return dict(totals, nodes=nodes, interfaces_per_node=interfaces, rounds=rounds, batch=batch,
+                elapsed_s=round(elapsed, 2),
+                pushes_per_s=round(totals['pushes'] / elapsed, 1) if elapsed else None,
+                avg_upload_bytes=round(totals['bytes_sent'] / max(totals['pushes'], 1)),
+                full_snapshot_bytes=round(full))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Network Interface Manager fleet agent tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    agent = sub.add_parser('agent', help='Run one standalone agent with synthetic interfaces')
+    agent.add_argument('--aggregator', required=True)
+    agent.add_argument('--node', default=FLEET_NODE)
+    agent.add_argument('--synthetic', type=int, default=10, help='Number of synthetic interfaces')
+    agent.add_argument('--interval', type=float, default=FLEET_INTERVAL)
+    agent.add_argument('--batch', type=int, default=FLEET_BATCH)
+    agent.add_argument('--token', default=FLEET_TOKEN)
+
+    sim = sub.add_parser('simulate', help='Push from many in-process agents and report traffic')
+    sim.add_argument('--aggregator', required=True)
+    sim.add_argument('--nodes', type=int, default=100)
+    sim.add_argument('--interfaces', type=int, default=10)
+    sim.add_argument('--rounds', type=int, default=5)
+    sim.add_argument('--batch', type=int, default=FLEET_BATCH)
+    sim.add_argument('--token', default=FLEET_TOKEN)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'agent':
+        runner = FleetAgent(SyntheticCollector(args.synthetic), aggregator=args.aggregator.rstrip('/'),
+                            node=args.node, token=args.token, interval=args.interval, batch=args.batch)
+        print(f"Agent {args.node} pushing to {runner.url} every {args.interval * args.batch:g}s")
+        try:
+            runner.run()
+        except KeyboardInterrupt:
+            print(json.dumps(runner.get_status(), indent=2))
+    else:
+        print(json.dumps(simulate(args.aggregator.rstrip('/'), args.nodes, args.interfaces,
+                                  args.rounds, args.batch, args.token), indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,673 @@
+#!/usr/bin/env python3
+"""
+Routing health rules for Network Interface Manager
+
+Every check is a registered rule that declares the inputs it reads:
+the route tables, the policy rules (`ip rule`), link state, interface
+addresses and gateway probe results. Inputs are only re-read after the
+kernel reports a change on a non-blocking rtnetlink socket, which is
+drained at the start of each check, and a rule only runs again when the
+content of one of its inputs changed. Polling an unchanged system costs
+one failed recv(); gateway probes are reused for NIM_HEALTH_PROBE_TTL
+seconds unless the gateways themselves change.
+
+Without rtnetlink (containers without NETLINK_ROUTE) the inputs are read
+on every check, but rules still only run when their inputs differ.
+
+    python3 health.py check
+    python3 health.py check --repeat 5 --json
+"""
+
+import os
+import json
+import time
+import zlib
+import errno
+import socket
+import struct
+import argparse
+import ipaddress
+import threading
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROBE_TTL = float(os.environ.get('NIM_HEALTH_PROBE_TTL', '30'))  # seconds
+
+# Netlink constants (linux/rtnetlink.h)
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV4_RULE = 0x80
+
+# Message type -> input it invalidates
+NETLINK_INPUTS = {
+    16: 'links', 17: 'links',          # RTM_NEWLINK, RTM_DELLINK
+    20: 'addresses', 21: 'addresses',  # RTM_NEWADDR, RTM_DELADDR
+    24: 'routes', 25: 'routes',        # RTM_NEWROUTE, RTM_DELROUTE
+    32: 'rules', 33: 'rules',          # RTM_NEWRULE, RTM_DELRULE
+}
+
+# The kernel flushes routes of a downed link or removed address without
+# sending RTM_DELROUTE, so those changes invalidate the routes as well
+IMPLIED_CHANGES = {
+    'links': ('routes',),
+    'addresses': ('routes',),
+}
+
+COMMANDS = {
+    'routes': "ip -4 route show table all",
+    'rules': "ip rule show",
+    'links': "ip -o link show",
+    'addresses': "ip -o -4 addr show",
+}
+
+INPUT_LABELS = {
+    'routes': 'routing table',
+    'rules': 'policy rules',
+    'links': 'link state',
+    'addresses': 'interface addresses',
+}
+
+# Tables every system has; anything else is policy routing
+BUILTIN_TABLES = ('local', 'main', 'default')
+
+ROUTE_TYPES = ('unicast', 'local', 'broadcast', 'multicast', 'anycast',
+               'blackhole', 'unreachable', 'prohibit', 'throw', 'nat')
+ROUTE_KEYS = ('via', 'dev', 'src', 'table', 'proto', 'metric', 'scope', 'mtu', 'weight')
+
+
+def parse_routes(output):
+    """Parse `ip -4 route show table all` into dicts, multipath nexthops included"""
+    lines = []
+    for line in output.split('\n'):
+        if not line.strip():
+            continue
+        if line[0].isspace() and lines:
+            # Continuation line of a multipath route
+            lines[-1] += ' ' + line.strip()
+        else:
+            lines.append(line.strip())
+
+    routes = []
+    for line in lines:
+        tokens = line.split()
+        route = {'type': 'unicast', 'table': 'main', 'via': None, 'dev': None, 'src': None,
+                 'mtu': None, 'nexthops': [], 'raw': line}
+        if tokens[0] in ROUTE_TYPES:
+            route['type'] = tokens.pop(0)
+        route['dest'] = tokens[0] if tokens else ''
+
+        target = route
+        i = 1
+        while i < len(tokens):
+            key = tokens[i]
+            if key == 'nexthop':
+                target = {'via': None, 'dev': None, 'weight': 1}
+                route['nexthops'].append(target)
+            elif key in ROUTE_KEYS and i + 1 < len(tokens):
+                value = tokens[i + 1]
+                i += 1
+                if key == 'via' and value in ('inet', 'inet6') and i + 1 < len(tokens):
+                    value = tokens[i + 1]
+                    i += 1
+                if key == 'mtu' and value == 'lock' and i + 1 < len(tokens):
+                    value = tokens[i + 1]
+                    i += 1
+                if key in ('mtu', 'weight', 'metric'):
+                    value = int(value) if value.isdigit() else None
+                if key in ('via', 'dev', 'weight') and target is not route:
+                    target[key] = value
+                else:
+                    route[key] = value
+            i += 1
+        routes.append(route)
+    return routes
+
+
+def parse_rules(output):
+    """Parse `ip rule show` into dicts with priority, selectors and table"""
+    rules = []
+    for line in output.split('\n'):
+        priority, _, rest = line.partition(':')
+        if not priority.strip().isdigit():
+            continue
+        tokens = rest.split()
+        rule = {'priority': int(priority), 'from': 'all', 'to': 'all', 'fwmark': None,
+                'iif': None, 'oif': None, 'table': None, 'raw': line.strip()}
+        for key, value in zip(tokens, tokens[1:]):
+            if key in ('from', 'to', 'fwmark', 'iif', 'oif'):
+                rule[key] = value
+            elif key in ('lookup', 'table'):
+                rule['table'] = value
+        rules.append(rule)
+    return rules
+
+
+def parse_links(output):
+    """Parse `ip -o link show` into {name: {'flags', 'mtu', 'state'}}"""
+    links = {}
+    for line in output.split('\n'):
+        parts = line.split(': ', 2)
+        if len(parts) < 3:
+            continue
+        name = parts[1].split('@')[0]
+        rest = parts[2]
+        flags = rest[rest.find('<') + 1:rest.find('>')].split(',') if '<' in rest else []
+        tokens = rest.split()
+        info = {'flags': flags, 'mtu': None, 'state': 'UNKNOWN'}
+        for key, value in zip(tokens, tokens[1:]):
+            if key == 'mtu' and value.isdigit():
+                info['mtu'] = int(value)
+            elif key == 'state':
+                info['state'] = value
+        links[name] = info
+    return links
+
+
+def parse_addresses(output):
+    """Parse `ip -o -4 addr show` into [{'interface', 'address', 'network'}]"""
+    addresses = []
+    for line in output.split('\n'):
+        tokens = line.split()
+        if len(tokens) < 4 or tokens[2] != 'inet':
+            continue
+        try:
+            iface = ipaddress.ip_interface(tokens[3])
+        except ValueError:
+            continue
+        addresses.append({'interface': tokens[1], 'address': str(iface.ip),
+                          'network': str(iface.network)})
+    return addresses
+
+
+PARSERS = {
+    'routes': parse_routes,
+    'rules': parse_rules,
+    'links': parse_links,
+    'addresses': parse_addresses,
+}
+
+
+class NetlinkWatcher:
+    """Non-blocking rtnetlink subscription reporting which inputs changed"""
+
+    def __init__(self):
+        self.sock = None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV4_RULE))
+            sock.setblocking(False)
+            self.sock = sock
+        except (OSError, AttributeError) as e:
+            logger.warning(f"Netlink change monitor unavailable, re-reading routing state on every check: {e}")
+
+    @property
+    def available(self):
+        return self.sock is not None
+
+    def poll(self):
+        """Inputs changed since the last poll; every input if events were lost"""
+        changed = set()
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # Socket buffer overran: we no longer know what changed
+                    changed.update(COMMANDS)
+                    continue
+                logger.error(f"Netlink change monitor stopped: {e}")
+                self.close()
+                changed.update(COMMANDS)
+                break
+            changed.update(self.parse(data))
+
+        for name in list(changed):
+            changed.update(IMPLIED_CHANGES.get(name, ()))
+        return changed
+
+    @staticmethod
+    def parse(data):
+        """Inputs touched by the messages in a netlink datagram"""
+        offset = 0
+        while offset + 16 <= len(data):
+            msg_len, msg_type = struct.unpack_from('=IH', data, offset)
+            if msg_len < 16:
+                break
+            if msg_type in NETLINK_INPUTS:
+                yield NETLINK_INPUTS[msg_type]
+            offset += (msg_len + 3) & ~3
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+
+RULES = []
+
+
+def register_rule(cls):
+    """Class decorator adding a rule to the default rule set"""
+    RULES.append(cls)
+    return cls
+
+
+class HealthRule:
+    """A routing check; `inputs` lists the state it reads"""
+
+    name = None
+    inputs = ()
+
+    def check(self, state):
+        """Return a list of findings from finding()"""
+        raise NotImplementedError
+
+    def finding(self, issue, suggestion, severity='warning'):
+        return {'rule': self.name, 'severity': severity, 'issue': issue, 'suggestion': suggestion}
+
+
+def default_routes(state, table='main'):
+    return [r for r in state.routes
+            if r['dest'] == 'default' and r['type'] == 'unicast' and (table is None or r['table'] == table)]
+
+
+def route_gateways(route):
+    """(gateway, interface) pairs of a route and its nexthops"""
+    pairs = [(route['via'], route['dev'])] if route['via'] else []
+    pairs += [(nh['via'], nh['dev']) for nh in route['nexthops'] if nh['via']]
+    return pairs
+
+
+def source_matches(selector, address):
+    """Whether an `ip rule` from/to selector covers an address"""
+    if selector == 'all':
+        return True
+    try:
+        return ipaddress.ip_address(address) in ipaddress.ip_network(selector, strict=False)
+    except ValueError:
+        return False
+
+
+@register_rule
+class IncompleteDefaultRoute(HealthRule):
+    name = 'incomplete_default_route'
+    inputs = ('routes', 'links')
+
+    def check(self, state):
+        incomplete = []
+        for route in default_routes(state):
+            if route['via'] or route['nexthops']:
+                continue
+            # A bare `default dev wwan0` is valid on point-to-point links
+            flags = state.links.get(route['dev'], {}).get('flags', [])
+            if route['dev'] and ('POINTOPOINT' in flags or 'NOARP' in flags):
+                continue
+            incomplete.append(route)
+        if not incomplete:
+            return []
+        return [self.finding(f"Found {len(incomplete)} incomplete default route(s)",
+                             "Remove incomplete routes with: sudo ip route del default", 'error')]
+
+
+@register_rule
+class TooManyDefaultRoutes(HealthRule):
+    name = 'too_many_default_routes'
+    inputs = ('routes',)
+
+    def check(self, state):
+        defaults = default_routes(state)
+        if len(defaults) > 3 and not any(r['nexthops'] for r in defaults):
+            return [self.finding(f"Too many default routes ({len(defaults)})",
+                                 "Consider cleaning up redundant routes")]
+        return []
+
+
+@register_rule
+class UnbalancedDefaultRoutes(HealthRule):
+    name = 'unbalanced_default_routes'
+    inputs = ('routes',)
+
+    def check(self, state):
+        defaults = default_routes(state)
+        if len(defaults) > 1 and not any(r['nexthops'] for r in defaults):
+            return [self.finding("Multiple default routes without load balancing",
+                                 "Configure proper load balancing with nexthop", 'info')]
+        return []
+
+
+@register_rule
+class UnreachableGateway(HealthRule):
+    name = 'unreachable_gateway'
+    inputs = ('routes', 'probes')
+
+    def check(self, state):
+        findings = []
+        reported = set()
+        for route in default_routes(state, table=None):
+            for gateway, _ in route_gateways(route):
+                if gateway in reported or state.probes.get(gateway, True):
+                    continue
+                reported.add(gateway)
+                findings.append(self.finding(f"Gateway {gateway} is not reachable",
+                                             f"Check connection to gateway {gateway}", 'error'))
+        return findings
+
+
+@register_rule
+class AsymmetricPolicyRouting(HealthRule):
+    """Source rules and per-uplink tables (setup-load-balancing.sh) out of step"""
+
+    name = 'asymmetric_policy_routing'
+    inputs = ('routes', 'rules', 'addresses')
+
+    def check(self, state):
+        findings = []
+        owners = {a['address']: a['interface'] for a in state.addresses}
+        tables = {}
+        for route in state.routes:
+            if route['table'] not in BUILTIN_TABLES:
+                tables.setdefault(route['table'], []).append(route)
+
+        policy_rules = [r for r in state.rules if r['table'] and r['table'] not in BUILTIN_TABLES]
+        seen = set()
+        for rule in policy_rules:
+            table = rule['table']
+            # Duplicate rules (a setup script run twice) report once
+            if (rule['from'], table) in seen:
+                continue
+            seen.add((rule['from'], table))
+            routes = tables.get(table, [])
+            if rule['from'] == 'all':
+                # fwmark/iif rules (traffic steering) are not source routing
+                if not routes:
+                    findings.append(self.finding(
+                        f"Rule {rule['priority']} ({rule['raw']}) points at empty table {table}",
+                        f"Populate table {table} or remove the rule: sudo ip rule del pref {rule['priority']}"))
+                continue
+
+            local = [address for address in owners if source_matches(rule['from'], address)]
+            if not local:
+                findings.append(self.finding(
+                    f"Policy rule 'from {rule['from']} lookup {table}' matches no local address",
+                    f"Remove the stale rule: sudo ip rule del from {rule['from']} table {table}"))
+                continue
+            defaults = [r for r in routes if r['dest'] == 'default']
+            if not defaults:
+                findings.append(self.finding(
+                    f"Table {table} has no default route; replies from {rule['from']} fall through to the main table",
+                    f"Add one: sudo ip route add default via <gateway> dev {owners[local[0]]} table {table}"))
+                continue
+            for address in local:
+                devices = {d['dev'] for d in defaults if d['dev']} | {
+                    nh['dev'] for d in defaults for nh in d['nexthops'] if nh['dev']}
+                if devices and owners[address] not in devices:
+                    findings.append(self.finding(
+                        f"Replies from {address} ({owners[address]}) leave through "
+                        f"{', '.join(sorted(devices))} via table {table}",
+                        f"Point table {table} at {owners[address]}: "
+                        f"sudo ip route replace default via <gateway> dev {owners[address]} table {table}",
+                        'error'))
+
+        used = {r['table'] for r in policy_rules}
+        for table in sorted(set(tables) - used):
+            findings.append(self.finding(
+                f"Table {table} has routes but no ip rule uses it",
+                f"Add a source rule (sudo ip rule add from <address> table {table}) or flush it: "
+                f"sudo ip route flush table {table}", 'info'))
+
+        # Load-balanced uplinks need a source rule each, or replies to
+        # inbound connections may hash onto another uplink
+        for route in default_routes(state):
+            if len(route['nexthops']) < 2:
+                continue
+            for nexthop in route['nexthops']:
+                sources = [a['address'] for a in state.addresses if a['interface'] == nexthop['dev']]
+                if sources and not any(source_matches(rule['from'], address)
+                                       for rule in policy_rules if rule['from'] != 'all'
+                                       for address in sources):
+                    findings.append(self.finding(
+                        f"Uplink {nexthop['dev']} ({sources[0]}) is load balanced without a source rule",
+                        f"Route its replies back out of {nexthop['dev']}: run setup-load-balancing.sh "
+                        f"or sudo ip rule add from {sources[0]} table <table>"))
+        return findings
+
+
+@register_rule
+class MtuMismatch(HealthRule):
+    name = 'mtu_mismatch'
+    inputs = ('routes', 'links')
+
+    def check(self, state):
+        findings = []
+        for route in state.routes:
+            if route['type'] != 'unicast' or not route['mtu']:
+                continue
+            link_mtu = state.links.get(route['dev'], {}).get('mtu')
+            if link_mtu and route['mtu'] > link_mtu:
+                findings.append(self.finding(
+                    f"Route {route['dest']} ({route['table']}) sets mtu {route['mtu']} above "
+                    f"{route['dev']} mtu {link_mtu}",
+                    f"Lower the route mtu to {link_mtu} or raise the link mtu"))
+
+        for route in default_routes(state, table=None):
+            mtus = {nh['dev']: state.links.get(nh['dev'], {}).get('mtu') for nh in route['nexthops']}
+            mtus = {dev: mtu for dev, mtu in mtus.items() if mtu}
+            if len(set(mtus.values())) > 1:
+                listed = ', '.join(f"{dev} {mtu}" for dev, mtu in sorted(mtus.items()))
+                findings.append(self.finding(
+                    f"Load-balanced uplinks have different MTUs ({listed})",
+                    f"Set a common mtu of {min(mtus.values())} or clamp TCP MSS to PMTU on the uplinks"))
+        return findings
+
+
+@register_rule
+class DuplicateSubnet(HealthRule):
+    name = 'duplicate_subnet'
+    inputs = ('addresses', 'links')
+
+    def check(self, state):
+        findings = []
+        active = []
+        for address in state.addresses:
+            link = state.links.get(address['interface'], {})
+            if 'LOOPBACK' in link.get('flags', []) or 'UP' not in link.get('flags', ['UP']):
+                continue
+            active.append((ipaddress.ip_network(address['network']), address['interface']))
+
+        reported = set()
+        for i, (network, iface) in enumerate(active):
+            for other_network, other_iface in active[i + 1:]:
+                if iface == other_iface or not network.overlaps(other_network):
+                    continue
+                key = tuple(sorted((iface, other_iface)))
+                if key in reported:
+                    continue
+                reported.add(key)
+                findings.append(self.finding(
+                    f"Subnet {network} on {iface} overlaps {other_network} on {other_iface}",
+                    f"Change the subnet on one side (two phones tethering the same range) "
+                    f"or give each interface its own routing table", 'error'))
+        return findings
+
+
+class HealthState:
+    """Parsed inputs as seen by the rules"""
+
+    def __init__(self):
+        self.routes = []
+        self.rules = []
+        self.links = {}
+        self.addresses = []
+        self.probes = {}
+
+
+class RoutingHealth:
+    def __init__(self, run_command, probe=None, rules=None, watch=True, probe_ttl=PROBE_TTL):
+        self.run_command = run_command
+        # probe(gateway, interface) -> reachable
+        self.probe = probe or self._ping
+        self.rules = [cls() for cls in (RULES if rules is None else rules)]
+        self.probe_ttl = probe_ttl
+        self.watcher = NetlinkWatcher() if watch else None
+        self.state = HealthState()
+        self.versions = {}
+        self._probed = {}  # (gateway, interface) -> (reachable, monotonic time)
+        self._results = {}  # rule name -> (input versions, findings)
+        self._lock = threading.Lock()
+        self.stats = {'checks': 0, 'reads': 0, 'evaluations': 0, 'probes': 0}
+
+    def _ping(self, gateway, interface=None):
+        return self.run_command(f"ping -c 1 -W 2 {gateway}")['success']
+
+    def invalidate(self):
+        """Forget all inputs and results"""
+        with self._lock:
+            self.versions = {}
+            self._probed = {}
+            self._results = {}
+
+    def _read(self, name):
+        result = self.run_command(COMMANDS[name])
+        if not result['success']:
+            return False
+        self.stats['reads'] += 1
+        setattr(self.state, name, PARSERS[name](result['output']))
+        self.versions[name] = zlib.crc32(result['output'].encode())
+        return True
+
+    def _refresh_probes(self):
+        now = time.monotonic()
+        targets = set()
+        for route in default_routes(self.state, table=None):
+            targets.update(route_gateways(route))
+        for target in list(self._probed):
+            if target not in targets:
+                del self._probed[target]
+        for target in targets:
+            cached = self._probed.get(target)
+            if cached is None or now - cached[1] >= self.probe_ttl:
+                self.stats['probes'] += 1
+                self._probed[target] = (bool(self.probe(*target)), now)
+
+        reachable = {}
+        for (gateway, _), (ok, _) in self._probed.items():
+            reachable[gateway] = reachable.get(gateway, False) or ok
+        self.state.probes = reachable
+        self.versions['probes'] = hash(tuple(sorted(reachable.items())))
+
+    def check(self):
+        """Evaluate the rules whose inputs changed and return every finding"""
+        with self._lock:
+            self.stats['checks'] += 1
+            watching = bool(self.watcher and self.watcher.available)
+            changed = self.watcher.poll() if watching else set(COMMANDS)
+
+            needed = {name for rule in self.rules for name in rule.inputs} | {'routes'}
+            for name in COMMANDS:
+                if name in needed and (name in changed or name not in self.versions):
+                    if not self._read(name):
+                        # poll() consumed the change set: drop every changed input so
+                        # the ones not read yet are re-read on the next check
+                        for pending in changed | {name}:
+                            self.versions.pop(pending, None)
+                        label = INPUT_LABELS[name]
+                        return {'issues': [f'Cannot read {label}'], 'suggestions': [], 'findings': []}
+            if 'probes' in needed:
+                self._refresh_probes()
+
+            findings = []
+            evaluated = []
+            for rule in self.rules:
+                key = tuple(self.versions.get(name) for name in rule.inputs)
+                cached = self._results.get(rule.name)
+                if cached is None or cached[0] != key:
+                    self.stats['evaluations'] += 1
+                    evaluated.append(rule.name)
+                    try:
+                        result = rule.check(self.state)
+                    except Exception as e:
+                        logger.error(f"Health rule {rule.name} failed: {e}")
+                        result = [rule.finding(f"Health rule {rule.name} failed: {e}",
+                                               "Report this as a bug", 'error')]
+                    cached = (key, result)
+                    self._results[rule.name] = cached
+                findings.extend(cached[1])
+
+            defaults = default_routes(self.state)
+            return {
+                'issues': [f['issue'] for f in findings],
+                'suggestions': [f['suggestion'] for f in findings],
+                'findings': findings,
+                'default_routes_count': len(defaults),
+                'load_balancing_active': any(r['nexthops'] for r in defaults),
+                'evaluated': evaluated,
+                'watching': watching,
+            }
+
+    def get_status(self):
+        with self._lock:
+            return {
+                'watching': bool(self.watcher and self.watcher.available),
+                'probe_ttl': self.probe_ttl,
+                'rules': [{'name': rule.name, 'inputs': list(rule.inputs)} for rule in self.rules],
+                'versions': dict(self.versions),
+                'stats': dict(self.stats),
+            }
+
+    def close(self):
+        if self.watcher:
+            self.watcher.close()
+
+
+def run_command(cmd, timeout=10):
+    try:
+        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout)
+        return {'success': result.returncode == 0, 'output': result.stdout.strip(),
+                'error': result.stderr.strip()}
+    except subprocess.TimeoutExpired:
+        return {'success': False, 'output': '', 'error': 'Command timeout'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Network Interface Manager routing health')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    check = sub.add_parser('check', help='Run the health rules')
+    check.add_argument('--repeat', type=int, default=1, help='check N times to show caching')
+    check.add_argument('--interval', type=float, default=1.0)
+    check.add_argument('--json', action='store_true')
+
+    sub.add_parser('rules', help='List the registered rules and their inputs')
+
+    args = parser.parse_args()
+    health = RoutingHealth(run_command)
+    if args.command == 'rules':
+        for rule in health.rules:
+            print(f"{rule.name:28} {', '.join(rule.inputs)}")
+        return
+
+    for i in range(args.repeat):
+        if i:
+            time.sleep(args.interval)
+        start = time.perf_counter()
+        result = health.check()
+        elapsed = (time.perf_counter() - start) * 1000
+        if args.json:
+            print(json.dumps(dict(result, elapsed_ms=round(elapsed, 3))))
+            continue
+        print(f"check {i + 1}: {elapsed:.2f} ms, re-evaluated: {', '.join(result.get('evaluated', [])) or 'none'}")
+        for finding in result['findings']:
+            print(f"  [{finding['severity']}] {finding['issue']}\n      -> {finding['suggestion']}")
+    health.close()
+    if not args.json:
+        print(json.dumps(health.get_status()['stats']))
+
+
+if __name__ == '__main__':
+    main()
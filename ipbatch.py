@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Batched iproute2 transactions for Network Interface Manager
+
+An IpBatch collects `ip` commands together with their inverses and runs
+them through a single `ip -batch -` process. iproute2 stops at the first
+failing line and reports its number, so on failure the inverses of the
+lines that did apply are replayed in reverse order, again as one batch.
+
+BulkInterfaceConfig compiles a desired state for many interfaces into
+such a batch. New addresses are added before old ones are removed so an
+interface is never left without an address mid-change. When an old IPv4
+primary shares a subnet with a new address and promote_secondaries is
+off, the kernel would delete the new address together with the old
+primary, so the batch holds promote_secondaries at 1 while it (and any
+rollback) runs.
+"""
+
+import re
+import json
+import ipaddress
+import logging
+
+logger = logging.getLogger(__name__)
+
+IFACE_RE = re.compile(r'^[A-Za-z0-9_.:@-]{1,15}$')
+FAILED_LINE_RE = re.compile(r'Command failed \S*:(\d+)')
+PROC_IPV4_CONF = '/proc/sys/net/ipv4/conf'
+
+
+def valid_interface_name(name):
+    return isinstance(name, str) and bool(IFACE_RE.match(name))
+
+
+class IpBatch:
+    def __init__(self, run_command):
+        self.run_command = run_command
+        self.ops = []
+        self.sysctls = {}  # key -> (value while running, value to restore)
+
+    def add(self, command, inverse=None):
+        """Queue an `ip` command (without the leading `ip`) and its inverse"""
+        self.ops.append((command, inverse))
+
+    def hold_sysctl(self, key, value, restore):
+        """Set a sysctl (slash-separated key) for as long as the batch runs"""
+        self.sysctls[key] = (value, restore)
+
+    def __len__(self):
+        return len(self.ops)
+
+    def commands(self):
+        return [command for command, _ in self.ops]
+
+    def inverse(self, skip=()):
+        """A batch undoing this one after it was applied in full, leaving out the `skip` inverses"""
+        undo = IpBatch(self.run_command)
+        undo.sysctls = dict(self.sysctls)
+        for command, inverse in reversed(self.ops):
+            if inverse and inverse not in skip:
+                undo.add(inverse, command)
+        return undo
+
+    def script(self, commands=None):
+        return '\n'.join(commands if commands is not None else self.commands()) + '\n'
+
+    def execute(self, rollback=True):
+        """Run every queued command in one process, rolling back on failure"""
+        if not self.ops:
+            return {'success': True, 'applied': [], 'message': 'Nothing to change'}
+
+        held = []
+        try:
+            for key, (value, restore) in self.sysctls.items():
+                result = self.run_command(f"sudo sysctl -qw {key}={value}")
+                if not result['success']:
+                    return {'success': False, 'error': f"Cannot set {key}: {result['error']}",
+                            'failed_command': None, 'applied': [], 'rolled_back': True}
+                held.append((key, restore))
+            return self._execute(rollback)
+        finally:
+            for key, restore in reversed(held):
+                result = self.run_command(f"sudo sysctl -qw {key}={restore}")
+                if not result['success']:
+                    logger.error(f"Cannot restore {key}={restore}: {result['error']}")
+
+    def _execute(self, rollback):
+        result = self.run_command("sudo ip -batch -", input=self.script())
+        if result['success']:
+            return {'success': True, 'applied': self.commands()}
+
+        match = FAILED_LINE_RE.search(result['error'])
+        failed = int(match.group(1)) - 1 if match else None
+        applied = self.ops[:failed] if failed is not None else self.ops
+        response = {
+            'success': False,
+            'error': result['error'],
+            'failed_command': self.ops[failed][0] if failed is not None and failed < len(self.ops) else None,
+            'applied': [command for command, _ in applied],
+            'rolled_back': False
+        }
+
+        if rollback and applied:
+            inverses = [inverse for _, inverse in reversed(applied) if inverse]
+            # -force keeps undoing the rest even if one inverse fails
+            undo = self.run_command("sudo ip -force -batch -", input=self.script(inverses))
+            response['rolled_back'] = undo['success']
+            response['rollback'] = inverses
+            if not undo['success']:
+                response['rollback_error'] = undo['error']
+                logger.error(f"Rollback incomplete: {undo['error']}")
+
+        return response
+
+
+class BulkInterfaceConfig:
+    """Compile desired interface state into one rollback-capable IpBatch"""
+
+    def __init__(self, run_command):
+        self.run_command = run_command
+
+    def read_current(self):
+        """Current admin state, MTU and global addresses of every interface"""
+        result = self.run_command("ip -j addr show")
+        if not result['success']:
+            return None
+        try:
+            links = json.loads(result['output'] or '[]')
+        except ValueError:
+            return None
+
+        current = {}
+        for link in links:
+            addresses = {}
+            for info in link.get('addr_info', []):
+                if info.get('scope') == 'link' or info.get('family') not in ('inet', 'inet6'):
+                    continue
+                address = f"{info['local']}/{info['prefixlen']}"
+                addresses[address] = info
+            current[link['ifname']] = {
+                'up': 'UP' in link.get('flags', []),
+                'mtu': link.get('mtu'),
+                'addresses': addresses
+            }
+        return current
+
+    def validate(self, desired):
+        """Normalise a desired-state mapping, return (config, error)"""
+        if not isinstance(desired, dict) or not desired:
+            return None, 'interfaces must be a non-empty object'
+
+        config = {}
+        for name, spec in desired.items():
+            if not valid_interface_name(name):
+                return None, f'Invalid interface name: {name!r}'
+            if not isinstance(spec, dict):
+                return None, f'{name}: desired state must be an object'
+
+            entry = {}
+            if 'state' in spec:
+                if spec['state'] not in ('up', 'down'):
+                    return None, f'{name}: invalid state. Use "up" or "down"'
+                entry['state'] = spec['state']
+
+            if 'mtu' in spec:
+                try:
+                    mtu = int(spec['mtu'])
+                except (TypeError, ValueError):
+                    return None, f'{name}: invalid MTU {spec["mtu"]!r}'
+                if not 68 <= mtu <= 65535:
+                    return None, f'{name}: MTU must be between 68 and 65535'
+                entry['mtu'] = mtu
+
+            addresses = spec.get('addresses')
+            if addresses is None and spec.get('ip'):
+                # Same shorthand as /api/interface/<iface>/ip
+                addresses = [f"{spec['ip']}/{spec['netmask']}" if spec.get('netmask') else spec['ip']]
+            if addresses is not None:
+                if not isinstance(addresses, list):
+                    return None, f'{name}: addresses must be a list'
+                normalised = []
+                for address in addresses:
+                    try:
+                        normalised.append(str(ipaddress.ip_interface(address)))
+                    except (TypeError, ValueError):
+                        return None, f'{name}: invalid address {address!r}'
+                entry['addresses'] = normalised
+
+            config[name] = entry
+        return config, None
+
+    def promote_secondaries(self, iface):
+        """Whether removing an IPv4 primary keeps same-subnet secondaries"""
+        try:
+            with open(f"{PROC_IPV4_CONF}/{iface}/promote_secondaries") as f:
+                return f.read().strip() == '1'
+        except OSError:
+            return True
+
+    @staticmethod
+    def _restore_address(name, address, now):
+        info = now['addresses'][address]
+        restore = f"addr add {address} dev {name}"
+        if info.get('broadcast'):
+            restore += f" broadcast {info['broadcast']}"
+        return restore
+
+    def missing_addresses(self, config):
+        """(interface, address) pairs configured but not on their interface, None if unreadable"""
+        current = self.read_current()
+        if current is None:
+            return None
+        return [(name, address) for name, entry in config.items() if name in current
+                for address in entry.get('addresses', []) if address not in current[name]['addresses']]
+
+    def compile(self, config, current, batch=None, removals=None):
+        """Build the batch for a validated config, return (batch, warnings, error)
+
+        Address removals and links going down are queued on `removals` when
+        given, so a caller can run its own commands between the additions
+        and the removals before joining the two batches.
+        """
+        batch = batch if batch is not None else IpBatch(self.run_command)
+        removals = removals if removals is not None else batch
+        warnings = []
+
+        for name, entry in config.items():
+            if name not in current:
+                return None, warnings, f'Interface {name} not found'
+            now = current[name]
+
+            if entry.get('state') == 'up' and not now['up']:
+                batch.add(f"link set dev {name} up", f"link set dev {name} down")
+
+            if 'mtu' in entry and entry['mtu'] != now['mtu']:
+                batch.add(f"link set dev {name} mtu {entry['mtu']}",
+                          f"link set dev {name} mtu {now['mtu']}" if now['mtu'] else None)
+
+            if 'addresses' in entry:
+                wanted = entry['addresses']
+                removed = [a for a in now['addresses'] if a not in wanted]
+                # Without promote_secondaries, deleting an IPv4 primary also deletes
+                # the secondaries of its subnet, the just added ones included
+                wanted_nets = {ipaddress.ip_interface(a).network for a in wanted if ':' not in a}
+                if any(':' not in a and ipaddress.ip_interface(a).network in wanted_nets for a in removed) \
+                        and not self.promote_secondaries(name):
+                    batch.hold_sysctl(f"net/ipv4/conf/{name}/promote_secondaries", 1, 0)
+                # Make before break: add the new addresses first
+                for address in wanted:
+                    if address not in now['addresses']:
+                        batch.add(f"addr add {address} dev {name}", f"addr del {address} dev {name}")
+                for address in removed:
+                    removals.add(f"addr del {address} dev {name}", self._restore_address(name, address, now))
+
+            if entry.get('state') == 'down' and now['up']:
+                removals.add(f"link set dev {name} down", f"link set dev {name} up")
+
+        return batch, warnings, None
+
+    def apply(self, desired, dry_run=False):
+        """Apply desired state for many interfaces as one transaction"""
+        config, error = self.validate(desired)
+        if error:
+            return {'success': False, 'error': error}
+
+        current = self.read_current()
+        if current is None:
+            return {'success': False, 'error': 'Cannot read current interface state'}
+
+        batch, warnings, error = self.compile(config, current)
+        if error:
+            return {'success': False, 'error': error}
+
+        if dry_run:
+            return {'success': True, 'dry_run': True, 'commands': batch.commands(), 'warnings': warnings}
+
+        result = batch.execute()
+        result['warnings'] = warnings
+        if result['success'] and result.get('applied'):
+            missing = self.missing_addresses(config)
+            if missing:
+                # The kernel dropped an address the batch added; never leave the interface like that
+                gone = {f"addr del {address} dev {name}" for name, address in missing}
+                undo = batch.inverse(skip=gone).execute(rollback=False)
+                return dict(result, success=False, rolled_back=undo['success'],
+                            error='Addresses missing after apply: ' +
+                                  ', '.join(f'{address} on {name}' for name, address in missing))
+        return result
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Structured event journal for Network Interface Manager
+
+Interface, route and tethering events are appended as JSON lines with a
+monotonically increasing sequence number to events.jsonl, which rotates
+to events.jsonl.1 ... .N once it reaches NIM_JOURNAL_MAX_BYTES. Writers
+in several processes (the web app and usb-monitor.sh through
+`journal.py append`) serialise on an flock of the file.
+
+Reads seek backwards from the end of the newest file, so tailing the
+last N events or everything after a `seq` cursor only reads the entries
+it returns, however large the journal has grown. The same reverse reader
+tails the free-form usb-monitor.log and app.log.
+
+    python3 journal.py append --category tethering --interface usb0 "Interface up"
+    python3 journal.py tail --after 120 --severity warning
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JOURNAL_FILE = os.environ.get('NIM_JOURNAL_FILE', os.path.join(BASE_DIR, 'events.jsonl'))
+JOURNAL_MAX_BYTES = int(os.environ.get('NIM_JOURNAL_MAX_BYTES', str(1 << 20)))
+JOURNAL_BACKUPS = int(os.environ.get('NIM_JOURNAL_BACKUPS', '3'))
+
+SEVERITIES = ('debug', 'info', 'warning', 'error')
+CATEGORIES = ('interface', 'route', 'tethering', 'app')
+
+# Free-form logs that can be tailed through /api/logs/<name>
+LOG_FILES = {
+    'usb-monitor': os.path.join(BASE_DIR, 'usb-monitor.log'),
+    'app': os.path.join(BASE_DIR, 'app.log'),
+}
+
+BLOCK_SIZE = 1 << 16
+
+
+def reverse_lines(path, block_size=BLOCK_SIZE):
+    """Yield the non-empty lines of a file last to first, reading from the end"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b''
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b'\n')
+            # The first piece may continue in the previous block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if remainder:
+            yield remainder
+
+
+def tail_lines(path, lines=100):
+    """Last `lines` lines of a text file, oldest first"""
+    result = []
+    try:
+        for line in reverse_lines(path):
+            result.append(line.decode('utf-8', errors='replace'))
+            if len(result) >= lines:
+                break
+    except FileNotFoundError:
+        pass
+    result.reverse()
+    return result
+
+
+class EventJournal:
+    def __init__(self, path=JOURNAL_FILE, max_bytes=JOURNAL_MAX_BYTES, backups=JOURNAL_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        # (inode, size, seq) after our last append, to skip re-reading the tail
+        self._last_write = None
+
+    def files(self):
+        """Journal files, newest first"""
+        return [self.path] + [f"{self.path}.{i}" for i in range(1, self.backups + 1)]
+
+    def _entries(self):
+        """Every readable entry, newest first"""
+        for path in self.files():
+            try:
+                for line in reverse_lines(path):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn or foreign line
+                        continue
+                    if isinstance(entry, dict) and isinstance(entry.get('seq'), int):
+                        yield entry
+            except FileNotFoundError:
+                continue
+
+    def last_seq(self):
+        for entry in self._entries():
+            return entry['seq']
+        return 0
+
+    def _open_locked(self):
+        """Open the current file for appending and hold its flock"""
+        while True:
+            created = not os.path.exists(self.path)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            if created and os.geteuid() == 0:
+                # usb-monitor runs as root; keep the file writable for the web app
+                owner = os.stat(os.path.dirname(os.path.abspath(self.path)))
+                try:
+                    os.fchown(fd, owner.st_uid, owner.st_gid)
+                except OSError:
+                    pass
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # Another writer may have rotated the file while we waited
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def record(self, category, message, severity='info', interface=None, source='app', **details):
+        """Append one event; returns the stored entry, or None if it could not be written"""
+        entry = {
+            'seq': 0,
+            'time': round(time.time(), 3),
+            'severity': severity if severity in SEVERITIES else 'info',
+            'category': category,
+            'source': source,
+            'message': message,
+        }
+        if interface:
+            entry['interface'] = interface
+        entry.update(details)
+
+        with self._lock:
+            try:
+                fd = self._open_locked()
+                try:
+                    stat = os.fstat(fd)
+                    if self._last_write and self._last_write[:2] == (stat.st_ino, stat.st_size):
+                        seq = self._last_write[2]
+                    else:
+                        seq = self.last_seq()
+                    entry['seq'] = seq + 1
+                    line = (json.dumps(entry, separators=(',', ':')) + '\n').encode()
+
+                    if stat.st_size and stat.st_size + len(line) > self.max_bytes:
+                        self._rotate()
+                        os.close(fd)
+                        fd = self._open_locked()
+                        stat = os.fstat(fd)
+
+                    os.write(fd, line)
+                    self._last_write = (stat.st_ino, stat.st_size + len(line), entry['seq'])
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                # Never log from here: JournalHandler would recurse
+                sys.stderr.write(f"Cannot write event journal {self.path}: {e}\n")
+                return None
+        return entry
+
+    def tail(self, after=None, limit=100, interface=None, severity=None, category=None):
+        """Events newer than `after` (or the last `limit`), oldest first
+
+        Scanning stops at the cursor, so a client polling with the last seq
+        it saw only reads the events written since. With a cursor, at most
+        `limit` events are returned and `next_after` resumes after them.
+        """
+        min_level = SEVERITIES.index(severity) if severity in SEVERITIES else 0
+        matches = []
+        last_seq = None
+        oldest_seq = None
+        reached_cursor = False
+
+        for entry in self._entries():
+            seq = entry['seq']
+            if last_seq is None:
+                last_seq = seq
+                if after is not None and after > seq:
+                    # Journal was reset under the client; start over
+                    after = None
+            if after is not None and seq <= after:
+                reached_cursor = True
+                break
+            oldest_seq = seq
+
+            if interface and entry.get('interface') != interface:
+                continue
+            if category and entry.get('category') != category:
+                continue
+            if min_level and SEVERITIES.index(entry.get('severity', 'info')) < min_level:
+                continue
+            matches.append(entry)
+            if after is None and len(matches) >= limit:
+                break
+
+        matches.reverse()
+        has_more = after is not None and len(matches) > limit
+        events = matches[:limit]
+        if has_more:
+            next_after = events[-1]['seq']
+        else:
+            next_after = last_seq if last_seq is not None else (after or 0)
+
+        return {
+            'success': True,
+            'events': events,
+            'last_seq': last_seq or 0,
+            'next_after': next_after,
+            'has_more': has_more,
+            # Entries between the cursor and the oldest kept one were rotated away
+            'truncated': bool(after is not None and not reached_cursor and oldest_seq
+                              and oldest_seq > after + 1)
+        }
+
+
+class JournalHandler(logging.Handler):
+    """Forward application log records (warnings and up by default) to the journal"""
+
+    def __init__(self, journal, level=logging.WARNING):
+        super().__init__(level)
+        self.journal = journal
+
+    def emit(self, record):
+        try:
+            severity = record.levelname.lower()
+            if severity == 'critical':
+                severity = 'error'
+            self.journal.record('app', self.format(record), severity=severity, logger=record.name)
+        except Exception:
+            self.handleError(record)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Network Interface Manager event journal')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    append = sub.add_parser('append', help='Record an event')
+    append.add_argument('message')
+    append.add_argument('--category', default='tethering', choices=CATEGORIES)
+    append.add_argument('--severity', default='info', choices=SEVERITIES)
+    append.add_argument('--interface')
+    append.add_argument('--source', default='cli')
+
+    tail = sub.add_parser('tail', help='Print recent events as JSON lines')
+    tail.add_argument('--after', type=int)
+    tail.add_argument('--limit', type=int, default=50)
+    tail.add_argument('--interface')
+    tail.add_argument('--severity', choices=SEVERITIES)
+    tail.add_argument('--category', choices=CATEGORIES)
+
+    args = parser.parse_args()
+    journal = EventJournal()
+    if args.command == 'append':
+        if journal.record(args.category, args.message, severity=args.severity,
+                          interface=args.interface, source=args.source) is None:
+            sys.exit(1)
+    else:
+        result = journal.tail(after=args.after, limit=args.limit, interface=args.interface,
+                              severity=args.severity, category=args.category)
+        for event in result['events']:
+            print(json.dumps(event))
+
+
+if __name__ == '__main__':
+    main()
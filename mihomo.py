@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Mihomo proxy integration for Network Interface Manager
+Loaded on first use so that startup does not pay for it
+"""
+
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+MIHOMO_CONFIG = '/etc/mihomo/config.yaml'
+
+
+class MihomoInspector:
+    def __init__(self, run_command, config_path=MIHOMO_CONFIG):
+        self.run_command = run_command
+        self.config_path = config_path
+
+    def get_info(self):
+        """Get Mihomo proxy service information"""
+        info = {
+            'running': False,
+            'config_path': self.config_path,
+            'tun_interface': None,
+            'configured_interfaces': [],
+            'load_balance_group': None
+        }
+
+        # Check if Mihomo service is running
+        result = self.run_command("systemctl is-active mihomo 2>/dev/null || pgrep -f mihomo")
+        if result['success'] and ('active' in result['output'] or result['output'].strip()):
+            info['running'] = True
+
+        # Check for TUN interface
+        tun_result = self.run_command("ip link show | grep Meta")
+        if tun_result['success'] and tun_result['output']:
+            info['tun_interface'] = 'Meta'
+
+        # Try to read Mihomo config to get interface information
+        try:
+            config_result = self.run_command(f"cat {self.config_path} 2>/dev/null")
+            if config_result['success']:
+                config_content = config_result['output']
+
+                # Look for interface-name configurations
+                interface_matches = re.findall(r'interface-name:\s*["\']?([^"\'\\s]+)["\']?', config_content)
+                info['configured_interfaces'] = list(set(interface_matches))
+
+                # Check for load balance configuration
+                if 'load-balance' in config_content and 'LB-LAN-USB' in config_content:
+                    info['load_balance_group'] = 'LB-LAN-USB'
+
+        except Exception as e:
+            logger.error(f"Error reading Mihomo config: {e}")
+
+        return info
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Reachability probing for Network Interface Manager
+Loaded on first use so that startup does not pay for it
+"""
+
+import json
+
+
+class Prober:
+    def __init__(self, run_command):
+        self.run_command = run_command
+
+    def ping(self, host, count=1, timeout=2, iface=None):
+        """Ping a host, optionally bound to an interface"""
+        bind = f" -I {iface}" if iface else ""
+        return self.run_command(f"ping -c {count} -W {timeout}{bind} {host}")
+
+    def http_public_ip(self, iface, timeout=10):
+        """Fetch the public IP seen through an interface"""
+        result = self.run_command(f"curl -s --connect-timeout {timeout} --interface {iface} http://httpbin.org/ip")
+        if not result['success']:
+            return {'success': False, 'error': f"HTTP test failed: {result['error']}"}
+        try:
+            ip_data = json.loads(result['output'])
+            return {'success': True, 'public_ip': ip_data.get('origin', 'Unknown')}
+        except ValueError:
+            return {'success': False, 'error': 'Failed to parse HTTP response'}
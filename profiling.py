@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Request-level timing and profiling for Network Interface Manager
+
+`traced_class` wraps every public method of a class so that, while a
+request is being traced on the current thread, each call is recorded as
+a span. Outside a traced request the wrapper costs one thread-local
+attribute lookup. Span trees are summarised into a Server-Timing header
+and the most recent ones are kept for /api/debug/traces.
+
+`RequestProfiler` arms cProfile for the next N requests and also keeps
+their span trees in collapsed-stack form, which flamegraph.pl and
+speedscope read directly.
+"""
+
+import io
+import os
+import re
+import time
+import threading
+import functools
+from collections import deque
+
+TRACE_ENABLED = os.environ.get('NIM_TRACE', '1') != '0'
+PROFILE_ENABLED = os.environ.get('NIM_DEBUG_PROFILE', '0') == '1'
+
+_local = threading.local()
+_TOKEN_RE = re.compile(r'[^A-Za-z0-9_-]')
+
+
+class Span:
+    __slots__ = ('name', 'detail', 'start', 'duration', 'children')
+
+    def __init__(self, name, detail=None):
+        self.name = name
+        self.detail = detail
+        self.start = time.perf_counter()
+        self.duration = None
+        self.children = []
+
+    def to_dict(self):
+        span = {'name': self.name, 'ms': round((self.duration or 0) * 1000, 2)}
+        if self.detail:
+            span['detail'] = self.detail
+        if self.children:
+            span['children'] = [child.to_dict() for child in self.children]
+        return span
+
+
+class Trace:
+    def __init__(self, name):
+        self.root = Span(name)
+        self.stack = [self.root]
+
+    def push(self, name, detail=None):
+        span = Span(name, detail)
+        self.stack[-1].children.append(span)
+        self.stack.append(span)
+        return span
+
+    def pop(self, span):
+        span.duration = time.perf_counter() - span.start
+        # Also closes spans left open by an exception further down
+        if span in self.stack:
+            while self.stack.pop() is not span:
+                pass
+
+    def finish(self):
+        self.root.duration = time.perf_counter() - self.root.start
+        self.stack = [self.root]
+        return self.root
+
+    def metrics(self):
+        """Total duration and call count per span name, across the tree"""
+        totals = {}
+        pending = list(self.root.children)
+        while pending:
+            span = pending.pop()
+            entry = totals.setdefault(span.name, [0.0, 0])
+            entry[0] += span.duration or 0
+            entry[1] += 1
+            pending.extend(span.children)
+        return totals
+
+    def server_timing(self, limit=12):
+        """Server-Timing header value, slowest span names first"""
+        metrics = sorted(self.metrics().items(), key=lambda item: item[1][0], reverse=True)
+        parts = [f'total;dur={self.root.duration * 1000:.1f}']
+        for name, (duration, count) in metrics[:limit]:
+            parts.append(f'{_TOKEN_RE.sub("_", name)};dur={duration * 1000:.1f};desc="x{count}"')
+        return ', '.join(parts)
+
+    def collapsed(self):
+        """Span tree as collapsed stacks (self time in microseconds)"""
+        lines = []
+        pending = [(self.root, self.root.name)]
+        while pending:
+            span, path = pending.pop()
+            child_time = sum(child.duration or 0 for child in span.children)
+            self_us = int(((span.duration or 0) - child_time) * 1e6)
+            if self_us > 0:
+                lines.append(f'{path} {self_us}')
+            for child in span.children:
+                pending.append((child, f'{path};{child.name}'))
+        return lines
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+def start_trace(name):
+    _local.trace = Trace(name)
+    return _local.trace
+
+
+def end_trace():
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    if trace is not None and trace.root.duration is None:
+        trace.finish()
+    return trace
+
+
+def command_span_name(cmd):
+    """Short span name for a shell command: cmd_<program>"""
+    words = cmd.split()
+    if words and words[0] == 'sudo':
+        words = words[1:]
+    program = os.path.basename(words[0]) if words else 'shell'
+    return f'cmd_{program}'
+
+
+def traced(name, detail=None):
+    """Decorator recording calls as spans of the current request trace"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = getattr(_local, 'trace', None)
+            if trace is None:
+                return func(*args, **kwargs)
+            span = trace.push(name, detail(*args, **kwargs) if detail else None)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                trace.pop(span)
+        return wrapper
+    return decorator
+
+
+def traced_command(func):
+    """Decorator for run_command: one span per shell command"""
+    @functools.wraps(func)
+    def wrapper(self, cmd, *args, **kwargs):
+        trace = getattr(_local, 'trace', None)
+        if trace is None:
+            return func(self, cmd, *args, **kwargs)
+        span = trace.push(command_span_name(cmd), cmd[:200])
+        try:
+            return func(self, cmd, *args, **kwargs)
+        finally:
+            trace.pop(span)
+    return wrapper
+
+
+def traced_class(cls):
+    """Wrap every public method of a class in a span, unless disabled"""
+    if not TRACE_ENABLED:
+        return cls
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith('_') or not callable(value) or isinstance(value, (staticmethod, classmethod)):
+            continue
+        if attr == 'run_command':
+            setattr(cls, attr, traced_command(value))
+        else:
+            setattr(cls, attr, traced(attr)(value))
+    return cls
+
+
+class TraceLog:
+    """Most recent request span trees"""
+
+    def __init__(self, size=50):
+        self.entries = deque(maxlen=size)
+
+    def add(self, path, trace):
+        self.entries.append({'path': path, 'time': time.time(), 'tree': trace.root.to_dict()})
+
+    def get(self, limit=None):
+        entries = list(self.entries)
+        return entries[-limit:] if limit else entries
+
+
+class RequestProfiler:
+    """cProfile the next N requests, one at a time"""
+
+    def __init__(self):
+        self.remaining = 0
+        self.sort = 'cumulative'
+        self.captured = []
+        self.collapsed = []
+        self.stats = None
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+
+    def arm(self, requests, sort='cumulative'):
+        with self._lock:
+            self.remaining = max(0, int(requests))
+            self.sort = sort
+            self.captured = []
+            self.collapsed = []
+            self.stats = None
+        return self.status()
+
+    def begin(self):
+        """Start profiling this request if armed; returns a profile or None"""
+        if self.remaining <= 0 or not self._active.acquire(blocking=False):
+            return None
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def end(self, profile, path, trace=None):
+        profile.disable()
+        self._active.release()
+
+        import pstats
+        with self._lock:
+            if self.remaining <= 0:
+                return
+            self.remaining -= 1
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.captured.append(path)
+            if trace is not None:
+                self.collapsed.extend(trace.collapsed())
+
+    def status(self):
+        return {'enabled': PROFILE_ENABLED, 'remaining': self.remaining,
+                'captured': list(self.captured), 'sort': self.sort}
+
+    def report(self, limit=40):
+        result = self.status()
+        with self._lock:
+            if self.stats is not None:
+                out = io.StringIO()
+                self.stats.stream = out
+                self.stats.sort_stats(self.sort).print_stats(limit)
+                result['pstats'] = out.getvalue()
+            result['collapsed'] = list(self.collapsed)
+        return result
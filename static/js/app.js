@@ -7,6 +7,9 @@ class NetworkInterfaceManager {
         this.interfaces = {};
         this.currentInterface = null;
         this.refreshInterval = null;
+        this.loadSequence = 0;
+        this.renderPending = false;
+        this.cardList = new KeyedCardList(document.getElementById('interfacesGrid'));
         this.init();
     }
 
@@ -46,18 +49,40 @@ class NetworkInterfaceManager {
                 this.refreshData();
             }
         });
+
+        // Pause polling while the tab is hidden
+        document.addEventListener('visibilitychange', () => {
+            if (document.hidden) {
+                this.stopAutoRefresh();
+            } else {
+                this.loadInterfaces();
+                this.startAutoRefresh();
+            }
+        });
     }
 
     async loadInterfaces() {
+        const sequence = ++this.loadSequence;
         try {
-            this.showLoading();
+            if (this.cardList.entries.size === 0) this.showLoading();
             const response = await fetch('/api/interfaces');
             if (!response.ok) throw new Error('Failed to fetch interfaces');
             
-            this.interfaces = await response.json();
-            this.renderInterfaces();
-            this.updateSystemStats();
+            const interfaces = await response.json();
+            // A newer request was started while this one was in flight
+            if (sequence !== this.loadSequence) return;
+            
+            this.interfaces = interfaces;
+            this.scheduleRender();
             this.updateConnectionStatus(true);
+            
+            // Server is still warming up and served its last snapshot
+            if (response.headers.get('X-Data-Stale')) {
+                this.updateConnectionStatus(true, 'Warming up');
+                setTimeout(() => {
+                    if (!document.hidden) this.loadInterfaces();
+                }, 2000);
+            }
         } catch (error) {
             console.error('Error loading interfaces:', error);
             this.showToast('Failed to load network interfaces', 'error');
@@ -65,10 +90,38 @@ class NetworkInterfaceManager {
         }
     }
 
+    // Coalesce renders into one per animation frame
+    scheduleRender() {
+        if (this.renderPending) return;
+        this.renderPending = true;
+        const frame = window.requestAnimationFrame || (callback => setTimeout(callback, 16));
+        frame(() => {
+            this.renderPending = false;
+            this.renderInterfaces();
+            this.updateSystemStats();
+        });
+    }
+
+    cardSignature(name, iface) {
+        return JSON.stringify([
+            iface.type, iface.state, iface.mtu, iface.speed,
+            (iface.addresses || []).map(addr => [addr.address, addr.type])
+        ]);
+    }
+
+    cardFields(iface) {
+        const stats = iface.stats || {};
+        return {
+            rx: stats.rx_formatted || '0 B',
+            tx: stats.tx_formatted || '0 B'
+        };
+    }
+
     renderInterfaces() {
         const grid = document.getElementById('interfacesGrid');
         
         if (Object.keys(this.interfaces).length === 0) {
+            this.cardList.clear();
             grid.innerHTML = `
                 <div class="loading-card">
                     <i class="fas fa-exclamation-triangle" style="font-size: 3rem; color: var(--warning); margin-bottom: 1rem;"></i>
@@ -78,9 +131,14 @@ class NetworkInterfaceManager {
             return;
         }
 
-        grid.innerHTML = Object.entries(this.interfaces)
-            .map(([name, iface]) => this.createInterfaceCard(name, iface))
-            .join('');
+        const filter = this.currentFilter();
+        const items = Object.entries(this.interfaces).map(([name, iface]) => ({
+            key: name,
+            signature: this.cardSignature(name, iface),
+            fields: this.cardFields(iface),
+            render: () => this.createInterfaceCard(name, iface)
+        }));
+        return this.cardList.update(items, card => this.applyFilter(card, filter));
     }
 
     createInterfaceCard(name, iface) {
@@ -126,11 +184,11 @@ class NetworkInterfaceManager {
                         </div>
                         <div class="info-item">
                             <div class="info-label">Downloaded</div>
-                            <div class="info-value">${rxFormatted}</div>
+                            <div class="info-value" data-field="rx">${rxFormatted}</div>
                         </div>
                         <div class="info-item">
                             <div class="info-label">Uploaded</div>
-                            <div class="info-value">${txFormatted}</div>
+                            <div class="info-value" data-field="tx">${txFormatted}</div>
                         </div>
                     </div>
                     
@@ -211,10 +269,17 @@ class NetworkInterfaceManager {
             }
         });
 
-        document.getElementById('totalInterfaces').textContent = totalInterfaces;
-        document.getElementById('activeInterfaces').textContent = activeInterfaces;
-        document.getElementById('totalRx').textContent = this.formatBytes(totalRx);
-        document.getElementById('totalTx').textContent = this.formatBytes(totalTx);
+        this.setText('totalInterfaces', totalInterfaces);
+        this.setText('activeInterfaces', activeInterfaces);
+        this.setText('totalRx', this.formatBytes(totalRx));
+        this.setText('totalTx', this.formatBytes(totalTx));
+    }
+
+    // Only touch the DOM when the value actually changed
+    setText(id, value) {
+        const element = document.getElementById(id);
+        const text = String(value);
+        if (element.textContent !== text) element.textContent = text;
     }
 
     formatBytes(bytes) {
@@ -225,14 +290,14 @@ class NetworkInterfaceManager {
         return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
     }
 
-    updateConnectionStatus(connected) {
+    updateConnectionStatus(connected, label) {
         const statusElement = document.getElementById('connectionStatus');
         const dot = statusElement.querySelector('.status-dot');
         const text = statusElement.querySelector('.status-text');
         
         if (connected) {
-            dot.style.background = 'var(--success)';
-            text.textContent = 'Connected';
+            dot.style.background = label ? 'var(--warning)' : 'var(--success)';
+            text.textContent = label || 'Connected';
         } else {
             dot.style.background = 'var(--danger)';
             text.textContent = 'Disconnected';
@@ -494,28 +559,29 @@ class NetworkInterfaceManager {
         }
     }
 
-    filterInterfaces() {
-        const typeFilter = document.getElementById('typeFilter').value;
-        const statusFilter = document.getElementById('statusFilter').value;
-        const searchInput = document.getElementById('searchInput').value.toLowerCase();
+    currentFilter() {
+        return {
+            type: document.getElementById('typeFilter').value,
+            status: document.getElementById('statusFilter').value,
+            search: document.getElementById('searchInput').value.toLowerCase()
+        };
+    }
+
+    applyFilter(card, filter) {
+        const interfaceName = card.dataset.interface.toLowerCase();
+        const interfaceType = card.dataset.type;
+        const interfaceStatus = card.dataset.status;
         
-        const cards = document.querySelectorAll('.interface-card');
+        const matchesType = !filter.type || interfaceType === filter.type;
+        const matchesStatus = !filter.status || interfaceStatus === filter.status;
+        const matchesSearch = !filter.search || interfaceName.includes(filter.search);
         
-        cards.forEach(card => {
-            const interfaceName = card.dataset.interface.toLowerCase();
-            const interfaceType = card.dataset.type;
-            const interfaceStatus = card.dataset.status;
-            
-            const matchesType = !typeFilter || interfaceType === typeFilter;
-            const matchesStatus = !statusFilter || interfaceStatus === statusFilter;
-            const matchesSearch = !searchInput || interfaceName.includes(searchInput);
-            
-            if (matchesType && matchesStatus && matchesSearch) {
-                card.style.display = 'block';
-            } else {
-                card.style.display = 'none';
-            }
-        });
+        card.style.display = matchesType && matchesStatus && matchesSearch ? 'block' : 'none';
+    }
+
+    filterInterfaces() {
+        const filter = this.currentFilter();
+        document.querySelectorAll('.interface-card').forEach(card => this.applyFilter(card, filter));
     }
 
     showModal() {
@@ -616,6 +682,7 @@ class NetworkInterfaceManager {
     }
 
     startAutoRefresh() {
+        this.stopAutoRefresh();
         // Refresh every 30 seconds
         this.refreshInterval = setInterval(() => {
             this.loadInterfaces();
@@ -1108,6 +1175,11 @@ function monitorUsbTethering() {
     networkManager.monitorUsbTethering();
 }
 
+// Exported for the browser-free render benchmark (benchmarks/render_bench.js)
+if (typeof module !== 'undefined' && module.exports) {
+    module.exports = { NetworkInterfaceManager };
+}
+
 // Initialize the application
 document.addEventListener('DOMContentLoaded', () => {
     networkManager = new NetworkInterfaceManager();
@@ -0,0 +1,93 @@
+// Keyed list of cards: rebuilds a card only when its signature changes,
+// patches [data-field] counters in place, and moves nodes instead of
+// re-creating them. Independent of the real DOM so it can be benchmarked.
+class KeyedCardList {
+    constructor(container, createElement) {
+        this.container = container;
+        this.createElement = createElement || KeyedCardList.elementFromHtml;
+        this.entries = new Map();
+    }
+
+    static elementFromHtml(html) {
+        const template = document.createElement('template');
+        template.innerHTML = html.trim();
+        return template.content.firstElementChild;
+    }
+
+    clear() {
+        this.entries.clear();
+        this.container.textContent = '';
+    }
+
+    // items: [{ key, signature, fields, render }], in display order
+    update(items, onRender) {
+        const stats = { created: 0, rebuilt: 0, patched: 0, moved: 0, removed: 0, unchanged: 0 };
+
+        if (this.entries.size === 0) {
+            // Drop loading or empty-state placeholders
+            this.container.textContent = '';
+        }
+
+        const keys = new Set(items.map(item => item.key));
+        for (const [key, entry] of this.entries) {
+            if (!keys.has(key)) {
+                entry.element.remove();
+                this.entries.delete(key);
+                stats.removed++;
+            }
+        }
+
+        let cursor = this.container.firstElementChild;
+        for (const item of items) {
+            let entry = this.entries.get(item.key);
+            let isNew = false;
+
+            if (!entry) {
+                entry = { signature: item.signature, fields: item.fields, element: this.createElement(item.render()) };
+                this.entries.set(item.key, entry);
+                onRender && onRender(entry.element);
+                stats.created++;
+                isNew = true;
+            } else if (entry.signature !== item.signature) {
+                const element = this.createElement(item.render());
+                if (cursor === entry.element) cursor = element;
+                this.container.replaceChild(element, entry.element);
+                entry.element = element;
+                entry.signature = item.signature;
+                entry.fields = item.fields;
+                onRender && onRender(element);
+                stats.rebuilt++;
+            } else if (this.patchFields(entry, item.fields)) {
+                stats.patched++;
+            } else {
+                stats.unchanged++;
+            }
+
+            if (cursor === entry.element) {
+                cursor = cursor.nextElementSibling;
+            } else {
+                this.container.insertBefore(entry.element, cursor);
+                if (!isNew) stats.moved++;
+            }
+        }
+        return stats;
+    }
+
+    patchFields(entry, fields) {
+        let changed = false;
+        for (const [field, value] of Object.entries(fields)) {
+            if (entry.fields[field] !== value) {
+                const node = entry.element.querySelector(`[data-field="${field}"]`);
+                if (node) node.textContent = value;
+                changed = true;
+            }
+        }
+        entry.fields = fields;
+        return changed;
+    }
+}
+
+// Exported for the browser-free render benchmark (benchmarks/render_bench.js)
+if (typeof module !== 'undefined' && module.exports) {
+    module.exports = { KeyedCardList };
+}
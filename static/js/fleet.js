@@ -0,0 +1,230 @@
+// Fleet Overview - aggregator dashboard
+
+class FleetView {
+    constructor() {
+        this.refreshInterval = null;
+        this.expanded = new Set();
+        this.details = {};
+        this.cardList = new KeyedCardList(document.getElementById('nodesGrid'));
+        this.init();
+    }
+
+    init() {
+        this.loadNodes();
+        this.startAutoRefresh();
+
+        document.addEventListener('visibilitychange', () => {
+            if (document.hidden) {
+                this.stopAutoRefresh();
+            } else {
+                this.loadNodes();
+                this.startAutoRefresh();
+            }
+        });
+    }
+
+    async loadNodes() {
+        try {
+            const response = await fetch('/api/fleet');
+            const data = await response.json();
+            if (!response.ok) throw new Error(data.error || 'Failed to fetch fleet');
+
+            await Promise.all([...this.expanded].map(node => this.loadDetails(node)));
+            this.render(data);
+            this.updateConnectionStatus(true);
+        } catch (error) {
+            console.error('Error loading fleet:', error);
+            this.updateConnectionStatus(false, error.message);
+        }
+    }
+
+    async loadDetails(node) {
+        const response = await fetch(`/api/fleet/${encodeURIComponent(node)}`);
+        if (response.ok) {
+            this.details[node] = await response.json();
+        }
+    }
+
+    async toggleDetails(node) {
+        if (this.expanded.has(node)) {
+            this.expanded.delete(node);
+            delete this.details[node];
+        } else {
+            this.expanded.add(node);
+            await this.loadDetails(node);
+        }
+        this.loadNodes();
+    }
+
+    render(data) {
+        document.getElementById('nodeCount').textContent = data.count;
+        document.getElementById('staleCount').textContent = data.stale;
+        document.getElementById('upInterfaces').textContent =
+            data.nodes.reduce((total, node) => total + node.interfaces_up, 0);
+
+        const grid = document.getElementById('nodesGrid');
+        if (data.nodes.length === 0) {
+            this.cardList.clear();
+            grid.innerHTML = `
+                <div class="loading-card">
+                    <i class="fas fa-satellite-dish" style="font-size: 2rem; color: var(--text-muted); margin-bottom: 1rem;"></i>
+                    <p>No agents have reported yet</p>
+                </div>
+            `;
+            return;
+        }
+        return this.cardList.update(data.nodes.map(node => ({
+            key: node.node,
+            signature: this.cardSignature(node),
+            fields: this.cardFields(node),
+            render: () => this.createNodeCard(node)
+        })));
+    }
+
+    // Everything that changes the card's structure; counters that tick on
+    // every report are patched in place through cardFields instead
+    cardSignature(node) {
+        const expanded = this.expanded.has(node.node);
+        return JSON.stringify([
+            node.stale, node.address, node.default_routes, expanded,
+            expanded ? this.interfaceRows(node.node) : null
+        ]);
+    }
+
+    cardFields(node) {
+        return {
+            age: this.formatAge(node.age_s),
+            up: `${node.interfaces_up} / ${node.interfaces_total}`,
+            uploads: `${node.pushes} (${this.formatBytes(node.bytes_received)})`
+        };
+    }
+
+    createNodeCard(node) {
+        const name = this.escapeHtml(node.node);
+        const statusClass = node.stale ? 'status-down' : 'status-up';
+        const statusText = node.stale ? 'STALE' : 'ONLINE';
+        const routes = node.default_routes.length
+            ? node.default_routes.map(route => `<div class="address-item"><span>${this.escapeHtml(route)}</span></div>`).join('')
+            : '<p class="text-muted">No default route</p>';
+
+        return `
+            <div class="interface-card" data-node="${name}">
+                <div class="interface-header">
+                    <div class="interface-name">
+                        <i class="fas fa-server"></i>
+                        <h3>${name}</h3>
+                    </div>
+                    <div class="interface-status ${statusClass}">
+                        <i class="fas fa-circle"></i>
+                        ${statusText}
+                    </div>
+                </div>
+                <div class="interface-body">
+                    <div class="interface-info">
+                        <div class="info-item">
+                            <div class="info-label">Last Report</div>
+                            <div class="info-value" data-field="age">${this.formatAge(node.age_s)}</div>
+                        </div>
+                        <div class="info-item">
+                            <div class="info-label">Interfaces Up</div>
+                            <div class="info-value" data-field="up">${node.interfaces_up} / ${node.interfaces_total}</div>
+                        </div>
+                        <div class="info-item">
+                            <div class="info-label">Address</div>
+                            <div class="info-value">${this.escapeHtml(node.address || 'N/A')}</div>
+                        </div>
+                        <div class="info-item">
+                            <div class="info-label">Uploads</div>
+                            <div class="info-value" data-field="uploads">${node.pushes} (${this.formatBytes(node.bytes_received)})</div>
+                        </div>
+                    </div>
+                    <div class="addresses-section">
+                        <h4>Default Routes</h4>
+                        ${routes}
+                    </div>
+                    ${this.expanded.has(node.node) ? this.createInterfaceList(node.node) : ''}
+                    <div class="interface-actions">
+                        <button class="btn btn-secondary btn-small" onclick="fleetView.toggleDetails(${this.escapeHtml(JSON.stringify(node.node))})">
+                            <i class="fas fa-list"></i>
+                            ${this.expanded.has(node.node) ? 'Hide' : 'Interfaces'}
+                        </button>
+                    </div>
+                </div>
+            </div>
+        `;
+    }
+
+    interfaceRows(node) {
+        const detail = this.details[node];
+        if (!detail) return [];
+        return Object.entries(detail.state.interfaces || {}).map(([name, iface]) => {
+            const ipv4 = (iface.addresses || []).find(addr => addr.type === 'IPv4');
+            const stats = iface.stats || {};
+            return [name, ipv4 ? ipv4.address : '', iface.state || '', stats.rx_bytes || 0, stats.tx_bytes || 0];
+        });
+    }
+
+    createInterfaceList(node) {
+        if (!this.details[node]) return '';
+        const rows = this.interfaceRows(node).map(([name, address, state, rx, tx]) => {
+            const stateClass = state === 'UP' ? 'status-up' : 'status-down';
+            return `
+                <div class="address-item">
+                    <span><strong>${this.escapeHtml(name)}</strong> ${this.escapeHtml(address)}</span>
+                    <span class="${stateClass}">${this.escapeHtml(state)}
+                        <span class="text-muted">&darr; ${this.formatBytes(rx)} &uarr; ${this.formatBytes(tx)}</span>
+                    </span>
+                </div>
+            `;
+        }).join('');
+        return `<div class="addresses-section"><h4>Interfaces</h4>${rows}</div>`;
+    }
+
+    formatAge(seconds) {
+        if (seconds === null || seconds === undefined) return 'never';
+        if (seconds < 60) return `${Math.round(seconds)}s ago`;
+        if (seconds < 3600) return `${Math.round(seconds / 60)}m ago`;
+        return `${Math.round(seconds / 3600)}h ago`;
+    }
+
+    formatBytes(bytes) {
+        if (bytes === 0) return '0 B';
+        const k = 1024;
+        const sizes = ['B', 'KB', 'MB', 'GB', 'TB'];
+        const i = Math.floor(Math.log(bytes) / Math.log(k));
+        return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
+    }
+
+    escapeHtml(value) {
+        return String(value).replace(/[&<>"']/g, char => ({
+            '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+        }[char]));
+    }
+
+    updateConnectionStatus(connected, label) {
+        const statusIndicator = document.getElementById('connectionStatus');
+        const statusDot = statusIndicator.querySelector('.status-dot');
+        const statusText = statusIndicator.querySelector('.status-text');
+
+        statusDot.style.background = connected ? 'var(--success)' : 'var(--danger)';
+        statusText.textContent = connected ? 'Connected' : (label || 'Disconnected');
+    }
+
+    startAutoRefresh() {
+        this.stopAutoRefresh();
+        this.refreshInterval = setInterval(() => this.loadNodes(), 5000);
+    }
+
+    stopAutoRefresh() {
+        if (this.refreshInterval) {
+            clearInterval(this.refreshInterval);
+            this.refreshInterval = null;
+        }
+    }
+}
+
+let fleetView;
+
+document.addEventListener('DOMContentLoaded', () => {
+    fleetView = new FleetView();
+});
@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+"""
+Traffic-class steering for Network Interface Manager
+
+A class matches IPv4 connections by destination port, destination CIDR
+or DSCP and is pinned to an uplink, with an optional fallback. The first
+packet of a connection is classified in an nftables table
+(`inet nim_steering`), which stores the class mark on the conntrack
+entry and restores it on every later packet. `ip rule fwmark` rules then
+send each mark to a routing table holding only the default route of the
+class's current uplink.
+
+The nftables table is replaced in one `nft -f` transaction, and the
+routing tables and rules are updated as one IpBatch. When an uplink goes
+down only the fwmark rules of the affected classes move to the fallback
+table; the nftables table is left alone. Per-class byte counters are
+nftables named counters that are carried across re-applies.
+
+    python3 steering.py compile steering.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+import ipaddress
+import threading
+import logging
+
+from ipbatch import IpBatch, valid_interface_name
+from checkpoints import route_spec, rule_spec
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STEERING_FILE = os.environ.get('NIM_STEERING_FILE', os.path.join(BASE_DIR, 'steering.json'))
+STEERING_INTERVAL = float(os.environ.get('NIM_STEERING_INTERVAL', '2'))  # seconds
+
+NFT_TABLE = 'nim_steering'
+# Class i is marked MARK_BASE + i + 1 and looked up at rule priority RULE_PREF + i
+MARK_BASE = int(os.environ.get('NIM_STEERING_MARK_BASE', '0x1000'), 0)
+RULE_PREF = int(os.environ.get('NIM_STEERING_PREF', '1000'))
+# Uplink j gets routing table TABLE_BASE + j (setup-load-balancing.sh uses 1 and 2)
+TABLE_BASE = int(os.environ.get('NIM_STEERING_TABLE_BASE', '200'))
+MAX_CLASSES = 32
+MAX_UPLINKS = 16
+
+CLASS_NAME_RE = re.compile(r'^[a-z][a-z0-9_]{0,23}$')
+PORT_RE = re.compile(r'^(\d{1,5})(?:-(\d{1,5}))?(?:/(tcp|udp))?$')
+PROC_IPV4_CONF = '/proc/sys/net/ipv4/conf'
+PROC_NET_ROUTE = '/proc/net/route'
+SYSFS_NET = '/sys/class/net'
+RTF_GATEWAY = 0x2
+
+# DSCP code points by name (RFC 2474, 2597, 3246, 8622)
+DSCP_NAMES = {'ef': 46, 'va': 44, 'le': 1}
+DSCP_NAMES.update({f'cs{i}': 8 * i for i in range(8)})
+DSCP_NAMES.update({f'af{x}{y}': 8 * x + 2 * y for x in range(1, 5) for y in range(1, 4)})
+
+
+def validate(config):
+    """Normalise a steering config, return (config, error)"""
+    if not isinstance(config, dict):
+        return None, 'Steering config must be an object'
+    uplinks = config.get('uplinks')
+    classes = config.get('classes')
+    if not isinstance(uplinks, list) or not uplinks:
+        return None, 'uplinks must be a non-empty list'
+    if not isinstance(classes, list) or not classes:
+        return None, 'classes must be a non-empty list'
+    if len(uplinks) > MAX_UPLINKS or len(classes) > MAX_CLASSES:
+        return None, f'At most {MAX_UPLINKS} uplinks and {MAX_CLASSES} classes'
+
+    normalised_uplinks = []
+    for uplink in uplinks:
+        if not isinstance(uplink, dict) or not valid_interface_name(uplink.get('interface')):
+            return None, f'Invalid uplink {uplink!r}'
+        if not uplink.get('gateway'):
+            return None, f"{uplink['interface']}: gateway required (none detected)"
+        try:
+            gateway = str(ipaddress.IPv4Address(uplink['gateway']))
+        except (TypeError, ValueError):
+            return None, f"{uplink['interface']}: invalid gateway {uplink.get('gateway')!r}"
+        normalised_uplinks.append({'interface': uplink['interface'], 'gateway': gateway})
+    names = [u['interface'] for u in normalised_uplinks]
+    if len(set(names)) != len(names):
+        return None, 'Each uplink may only be listed once'
+
+    normalised_classes = []
+    for spec in classes:
+        if not isinstance(spec, dict):
+            return None, 'Each class must be an object'
+        name = spec.get('name')
+        if not isinstance(name, str) or not CLASS_NAME_RE.match(name):
+            return None, f'Invalid class name {name!r} (lowercase letters, digits, _)'
+        if any(c['name'] == name for c in normalised_classes):
+            return None, f'Duplicate class {name}'
+        if spec.get('uplink') not in names:
+            return None, f"{name}: uplink {spec.get('uplink')!r} is not one of the uplinks"
+        fallback = spec.get('fallback')
+        if fallback is not None and (fallback not in names or fallback == spec['uplink']):
+            return None, f'{name}: fallback must be another uplink'
+
+        for field in ('ports', 'cidrs', 'dscp'):
+            # A bare string would otherwise be matched one character at a time
+            if not isinstance(spec.get(field, []), list):
+                return None, f'{name}: {field} must be a list'
+
+        ports = []
+        for port in spec.get('ports', []):
+            match = PORT_RE.match(str(port))
+            if not match or not all(0 < int(p) < 65536 for p in match.groups()[:2] if p):
+                return None, f'{name}: invalid port {port!r} (443, 6881-6889, 53/udp)'
+            if match.group(2) and int(match.group(2)) < int(match.group(1)):
+                return None, f'{name}: invalid port range {port!r}'
+            ports.append(str(port))
+
+        cidrs = []
+        for cidr in spec.get('cidrs', []):
+            try:
+                # The uplink tables and fwmark rules are IPv4 only
+                cidrs.append(str(ipaddress.IPv4Network(cidr, strict=False)))
+            except (TypeError, ValueError):
+                return None, f'{name}: invalid IPv4 CIDR {cidr!r}'
+
+        dscp = []
+        for value in spec.get('dscp', []):
+            code = DSCP_NAMES.get(str(value).lower(), value)
+            if not isinstance(code, int) and not str(code).isdigit():
+                return None, f'{name}: unknown DSCP {value!r}'
+            if not 0 <= int(code) <= 63:
+                return None, f'{name}: DSCP must be between 0 and 63'
+            dscp.append(int(code))
+
+        if not ports and not cidrs and not dscp:
+            return None, f'{name}: give at least one of ports, cidrs or dscp'
+        normalised_classes.append({'name': name, 'uplink': spec['uplink'], 'fallback': fallback,
+                                   'ports': ports, 'cidrs': cidrs, 'dscp': dscp})
+
+    return {'uplinks': normalised_uplinks, 'classes': normalised_classes}, None
+
+
+def connected_networks():
+    """{interface: [networks]} of the main-table routes without a gateway (connected and peer routes)"""
+    networks = {}
+    try:
+        with open(PROC_NET_ROUTE) as f:
+            next(f, None)
+            for line in f:
+                fields = line.split()
+                if len(fields) < 8 or int(fields[3], 16) & RTF_GATEWAY:
+                    continue
+                destination = socket.inet_ntoa(struct.pack('<I', int(fields[1], 16)))
+                mask = socket.inet_ntoa(struct.pack('<I', int(fields[7], 16)))
+                networks.setdefault(fields[0], []).append(ipaddress.IPv4Network(f'{destination}/{mask}'))
+    except (OSError, ValueError):
+        return None
+    return networks
+
+
+def class_mark(index):
+    return MARK_BASE + index + 1
+
+
+def nft_set(elements):
+    return '{ ' + ', '.join(str(e) for e in elements) + ' }'
+
+
+def class_matches(spec):
+    """nftables match expressions for a class, one per rule"""
+    matches = []
+    by_proto = {'tcp': [], 'udp': [], None: []}
+    for port in spec['ports']:
+        low, high, proto = PORT_RE.match(port).groups()
+        by_proto[proto].append(f'{low}-{high}' if high else low)
+    if by_proto[None]:
+        matches.append(f'meta l4proto {{ tcp, udp }} th dport {nft_set(by_proto[None])}')
+    for proto in ('tcp', 'udp'):
+        if by_proto[proto]:
+            matches.append(f'{proto} dport {nft_set(by_proto[proto])}')
+
+    if spec['cidrs']:
+        matches.append(f"ip daddr {nft_set(spec['cidrs'])}")
+    if spec['dscp']:
+        matches.append(f"ip dscp {nft_set(spec['dscp'])}")
+    return matches
+
+
+def compile_nft(config, counters=None):
+    """nftables script replacing the steering table in one transaction
+
+    `counters` ({name: (packets, bytes)}) seeds the named counters so
+    re-applying does not reset them.
+    """
+    counters = counters or {}
+    lines = [f'table inet {NFT_TABLE}', f'delete table inet {NFT_TABLE}', f'table inet {NFT_TABLE} {{']
+    marks = [class_mark(i) for i in range(len(config['classes']))]
+    uplinks = nft_set(f'"{u["interface"]}"' for u in config['uplinks'])
+
+    for spec in config['classes']:
+        for direction in ('tx', 'rx'):
+            name = f"cls_{spec['name']}_{direction}"
+            packets, nbytes = counters.get(name, (0, 0))
+            lines.append(f'    counter {name} {{ packets {packets} bytes {nbytes} }}')
+
+    lines += ['', '    chain classify {']
+    for index, spec in enumerate(config['classes']):
+        action = f'meta mark set {marks[index]:#x} ct mark set {marks[index]:#x} return'
+        for match in class_matches(spec):
+            lines.append(f'        {match} {action}')
+    lines.append('    }')
+
+    lines += ['', '    chain account {']
+    for index, spec in enumerate(config['classes']):
+        lines.append(f"        ct mark {marks[index]:#x} ct direction original counter name cls_{spec['name']}_tx")
+        lines.append(f"        ct mark {marks[index]:#x} ct direction reply counter name cls_{spec['name']}_rx")
+    lines.append('    }')
+
+    # Only the original direction carries the mark: replies to the LAN
+    # must keep using the main table
+    restore = f'ct direction original ct mark {nft_set(f"{m:#x}" for m in marks)} meta mark set ct mark'
+    lines += [
+        '',
+        '    chain prerouting {',
+        '        type filter hook prerouting priority mangle; policy accept;',
+        '        ct state new ct mark 0x0 meta mark 0x0 jump classify',
+        f'        {restore}',
+        '        jump account',
+        '    }',
+        '',
+        '    chain output {',
+        '        type route hook output priority mangle; policy accept;',
+        '        ct state new ct mark 0x0 meta mark 0x0 jump classify',
+        f'        {restore}',
+        '        jump account',
+        '    }',
+        '',
+        '    # Locally originated flows were given the source address of the',
+        '    # main-table route before being re-routed; only flows actually leaving',
+        '    # through an uplink (not the LAN, not a main-table fallback) are NATed',
+        '    chain postrouting {',
+        '        type nat hook postrouting priority srcnat; policy accept;',
+        f'        oifname {uplinks} meta mark {nft_set(f"{m:#x}" for m in marks)} masquerade',
+        '    }',
+        '}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+class SteeringController:
+    def __init__(self, run_command, uplink_up=None, path=STEERING_FILE, interval=STEERING_INTERVAL,
+                 on_event=None):
+        self.run_command = run_command
+        # uplink_up(interface) -> bool
+        self.uplink_up = uplink_up or self._carrier_up
+        self.path = path
+        self.interval = interval
+        # on_event(event, message, severity, **details)
+        self.on_event = on_event
+        self.config = None
+        self.pending = None  # saved config whose apply at startup failed, retried by the loop
+        self.active = {}  # class name -> uplink interface, or None for the main table
+        self.last_change = None
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _carrier_up(interface):
+        from failover import read_carrier
+        return read_carrier(interface) is not False
+
+    def _event(self, event, message, severity='info', **details):
+        if self.on_event:
+            try:
+                self.on_event(event, message, severity, **details)
+            except Exception as e:
+                logger.error(f"Steering event callback failed: {e}")
+
+    def tables(self, config):
+        return {uplink['interface']: TABLE_BASE + i for i, uplink in enumerate(config['uplinks'])}
+
+    def usable(self, config):
+        """{interface: bool}: up, the device exists and the gateway is still on a connected subnet
+
+        A route via a gateway that is not on-link cannot be installed, and a
+        failing route would hold back the rule moves in the same batch.
+        """
+        networks = connected_networks()
+        state = {}
+        for uplink in config['uplinks']:
+            name = uplink['interface']
+            gateway = ipaddress.IPv4Address(uplink['gateway'])
+            state[name] = (os.path.isdir(f"{SYSFS_NET}/{name}") and bool(self.uplink_up(name))
+                           and (networks is None or any(gateway in net for net in networks.get(name, []))))
+        return state
+
+    def choose_uplinks(self, config):
+        """Uplink each class should use now: primary, then fallback, else the main table"""
+        state = self.usable(config)
+        active = {}
+        for spec in config['classes']:
+            if state[spec['uplink']]:
+                active[spec['name']] = spec['uplink']
+            elif spec['fallback'] and state[spec['fallback']]:
+                active[spec['name']] = spec['fallback']
+            else:
+                active[spec['name']] = None
+        return active
+
+    def _read_json(self, command):
+        result = self.run_command(command)
+        if not result['success']:
+            return None
+        try:
+            return json.loads(result['output'] or '[]')
+        except ValueError:
+            return None
+
+    def plan_rules(self, config, active):
+        """IpBatch bringing the steering tables and fwmark rules to `active`, or None"""
+        routes = self._read_json("ip -j -4 route show table all")
+        rules = self._read_json("ip -j -4 rule show")
+        if routes is None or rules is None:
+            return None
+
+        tables = self.tables(config) if config else {}
+        our_tables = {str(TABLE_BASE + i) for i in range(MAX_UPLINKS)}
+        current_routes = {r['table']: route_spec(r) for r in routes
+                          if r.get('table') in our_tables and r['dst'] == 'default'}
+        current_rules = [rule_spec(r) for r in rules
+                         if RULE_PREF - 1 <= r.get('priority', 0) < RULE_PREF + MAX_CLASSES]
+
+        wanted_routes = {}
+        wanted_rules = []
+        if config:
+            # Only uplinks a class uses now: the others may be gone (unplugged
+            # tether) and their routes would fail the whole batch
+            used = set(active.values())
+            for uplink in config['uplinks']:
+                if uplink['interface'] not in used:
+                    continue
+                table = str(tables[uplink['interface']])
+                wanted_routes[table] = (f"default via {uplink['gateway']} dev {uplink['interface']} "
+                                        f"proto static table {table}")
+            # Destinations in the main table (the LAN, connected subnets) win over steering
+            wanted_rules.append(f"pref {RULE_PREF - 1} lookup main suppress_prefixlength 0")
+            for index, spec in enumerate(config['classes']):
+                if active.get(spec['name']):
+                    wanted_rules.append(f"pref {RULE_PREF + index} fwmark {class_mark(index):#x} "
+                                        f"lookup {tables[active[spec['name']]]}")
+
+        batch = IpBatch(self.run_command)
+        for table, spec in wanted_routes.items():
+            previous = current_routes.get(table)
+            if previous == spec:
+                continue
+            batch.add(f"route replace {spec}", f"route replace {previous}" if previous else f"route del {spec}")
+        # Add before delete: a class is never left without a rule
+        for spec in wanted_rules:
+            if spec not in current_rules:
+                batch.add(f"rule add {spec}", f"rule del {spec}")
+        for spec in current_rules:
+            if spec not in wanted_rules:
+                batch.add(f"rule del {spec}", f"rule add {spec}")
+        configured = {str(t) for t in tables.values()}
+        for table, spec in current_routes.items():
+            # Routes of idle configured uplinks stay for a quick switch back
+            if table not in wanted_routes and table not in configured:
+                batch.add(f"route del {spec}", f"route add {spec}")
+        return batch
+
+    def read_counters(self):
+        """Named counter values from the live table, {name: (packets, bytes)}"""
+        result = self.run_command(f"sudo nft -j list counters table inet {NFT_TABLE}")
+        if not result['success']:
+            return {}
+        try:
+            entries = json.loads(result['output']).get('nftables', [])
+        except (ValueError, AttributeError):
+            return {}
+        counters = {}
+        for entry in entries:
+            counter = entry.get('counter')
+            if counter:
+                counters[counter['name']] = (counter.get('packets', 0), counter.get('bytes', 0))
+        return counters
+
+    def rp_filter_warnings(self, config):
+        """Strict reverse-path filtering drops replies to steered flows"""
+        warnings = []
+        for uplink in config['uplinks']:
+            try:
+                with open(f"{PROC_IPV4_CONF}/{uplink['interface']}/rp_filter") as f:
+                    strict = f.read().strip() == '1'
+            except OSError:
+                continue
+            if strict:
+                warnings.append(f"{uplink['interface']}: rp_filter is strict (1) and may drop replies to "
+                                f"steered flows; set net.ipv4.conf.{uplink['interface']}.rp_filter=2")
+        return warnings
+
+    def apply(self, config, dry_run=False):
+        """Validate and apply a steering config: routing first, then the nftables table"""
+        config, error = validate(config)
+        if error:
+            return {'success': False, 'error': error}
+
+        with self._lock:
+            active = self.choose_uplinks(config)
+            batch = self.plan_rules(config, active)
+            if batch is None:
+                return {'success': False, 'error': 'Cannot read routing rules'}
+            script = compile_nft(config, self.read_counters())
+            warnings = self.rp_filter_warnings(config)
+            if dry_run:
+                return {'success': True, 'dry_run': True, 'commands': batch.commands(), 'nft': script,
+                        'active': active, 'warnings': warnings}
+
+            result = batch.execute()
+            if not result['success']:
+                return result
+            nft = self.run_command("sudo nft -f -", input=script)
+            if not nft['success']:
+                undo = batch.inverse().execute(rollback=False)
+                return {'success': False, 'error': f"nftables rejected the rule set: {nft['error']}",
+                        'rolled_back': undo['success']}
+
+            self.config = config
+            self.pending = None
+            self.active = active
+            self.last_change = time.time()
+            self.save()
+
+        self._event('applied', f"Traffic steering applied ({len(config['classes'])} classes)",
+                    active=active)
+        self.start()
+        return {'success': True, 'message': 'Traffic steering applied', 'active': active,
+                'applied': result['applied'], 'warnings': warnings}
+
+    def refresh(self):
+        """Move classes whose uplink changed state to their fallback (or back)"""
+        with self._lock:
+            if not self.config:
+                return None
+            active = self.choose_uplinks(self.config)
+            if active == self.active:
+                return None
+            batch = self.plan_rules(self.config, active)
+            if batch is None:
+                return None
+            result = batch.execute()
+            moved = {name: uplink for name, uplink in active.items() if self.active.get(name) != uplink}
+            if result['success']:
+                self.active = active
+                self.last_change = time.time()
+
+        if result['success']:
+            for name, uplink in moved.items():
+                self._event('rerouted', f"Steering class {name} now uses {uplink or 'the main table'}",
+                            'warning', steering_class=name, uplink=uplink)
+        else:
+            self._event('reroute_failed', f"Steering reroute failed: {result['error']}", 'error')
+        return result
+
+    def disable(self):
+        """Remove the steering rules, tables and nftables table"""
+        with self._lock:
+            self.stop()
+            batch = self.plan_rules(None, {})
+            if batch is None:
+                return {'success': False, 'error': 'Cannot read routing rules'}
+            result = batch.execute()
+            if not result['success']:
+                return result
+            self.run_command("sudo nft -f -", input=f'table inet {NFT_TABLE}\ndelete table inet {NFT_TABLE}\n')
+            self.config = None
+            self.pending = None
+            self.active = {}
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+        self._event('disabled', 'Traffic steering disabled')
+        return {'success': True, 'message': 'Traffic steering disabled'}
+
+    def save(self):
+        try:
+            temp = self.path + '.tmp'
+            with open(temp, 'w') as f:
+                json.dump(self.config, f, indent=2)
+            os.replace(temp, self.path)
+        except OSError as e:
+            logger.warning(f"Cannot save steering config: {e}")
+
+    def load(self):
+        """Re-apply the saved config, if any"""
+        try:
+            with open(self.path) as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cannot read steering config {self.path}: {e}")
+            return None
+        result = self.apply(config)
+        if not result['success'] and validate(config)[1] is None:
+            logger.warning(f"Steering config not applied, retrying every {self.interval:g}s: {result['error']}")
+            self.pending = config
+            self.start()
+        return result
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='steering', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+    def notify(self):
+        """Re-check uplinks now, e.g. on a failover event, without waiting for the interval"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop_event.is_set():
+                return
+            try:
+                if self.pending and not self.config:
+                    if self.apply(self.pending)['success']:
+                        self.pending = None
+                    continue
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Steering refresh failed: {e}")
+
+    def get_status(self):
+        with self._lock:
+            if not self.config:
+                return {'enabled': False, 'classes': [], 'uplinks': []}
+            counters = self.read_counters()
+            tables = self.tables(self.config)
+            classes = []
+            for index, spec in enumerate(self.config['classes']):
+                tx = counters.get(f"cls_{spec['name']}_tx", (0, 0))
+                rx = counters.get(f"cls_{spec['name']}_rx", (0, 0))
+                active = self.active.get(spec['name'])
+                classes.append(dict(spec, mark=f'{class_mark(index):#x}', active=active,
+                                    table=tables.get(active), on_fallback=active is not None and active != spec['uplink'],
+                                    tx_packets=tx[0], tx_bytes=tx[1], rx_packets=rx[0], rx_bytes=rx[1]))
+            return {
+                'enabled': True,
+                'uplinks': [dict(u, table=tables[u['interface']]) for u in self.config['uplinks']],
+                'classes': classes,
+                'last_change': self.last_change,
+                'counters_available': bool(counters)
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Network Interface Manager traffic steering')
+    sub = parser.add_subparsers(dest='command', required=True)
+    compile_cmd = sub.add_parser('compile', help='Print the nftables script for a config file')
+    compile_cmd.add_argument('config')
+
+    args = parser.parse_args()
+    with open(args.config) as f:
+        config, error = validate(json.load(f))
+    if error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.write(compile_nft(config))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import json
+import os
+import time
+
+import pytest
+
+import checkpoints
+from checkpoints import ConfigCheckpoints, GUARD_CHECKPOINT, GUARD_FILE
+
+
+class FakeKernel:
+    """run_command stand-in keeping links, routes and rules, applying `ip -batch` lines to them"""
+
+    def __init__(self):
+        self.links = {'eth0': {'up': True, 'mtu': 1500, 'addresses': ['192.0.2.2/24']},
+                      'usb0': {'up': True, 'mtu': 1500, 'addresses': ['10.0.0.2/24']}}
+        self.routes = ['default via 192.0.2.1 dev eth0 proto static',
+                       'default via 10.0.0.1 dev usb0 table 7',
+                       '198.51.100.0/24 via 10.0.0.1 dev usb0']
+        self.rules = ['pref 100 fwmark 0x7 lookup 7']
+        self.drop = set()
+        self.batches = []
+
+    def __call__(self, cmd, timeout=10, input=None):
+        if cmd == 'ip -j addr show':
+            return self.ok([{'ifname': name, 'flags': ['UP'] if link['up'] else [], 'mtu': link['mtu'],
+                             'addr_info': [{'family': 'inet', 'local': a.split('/')[0],
+                                            'prefixlen': int(a.split('/')[1]), 'scope': 'global'}
+                                           for a in link['addresses']]}
+                            for name, link in self.links.items()])
+        if cmd == 'ip -j -4 route show table all':
+            return self.ok([self.route_json(spec) for spec in self.routes])
+        if cmd == 'ip -j -4 rule show':
+            return self.ok([{'priority': 0, 'src': 'all', 'table': 'local'}] +
+                           [self.rule_json(spec) for spec in self.rules])
+        if cmd.endswith('-batch -'):
+            lines = input.splitlines()
+            self.batches.append(lines)
+            for number, line in enumerate(lines, 1):
+                error = self.apply(line.split())
+                if error and '-force' not in cmd:
+                    return {'success': False, 'output': '', 'error': f'{error}\nCommand failed -:{number}'}
+            return self.ok(None)
+        return self.ok(None)
+
+    @staticmethod
+    def ok(value):
+        return {'success': True, 'output': json.dumps(value) if value is not None else '', 'error': ''}
+
+    @staticmethod
+    def route_json(spec):
+        words = spec.split()
+        route = {'dst': words[0], 'flags': []}
+        keys = {'via': 'gateway', 'dev': 'dev', 'proto': 'protocol', 'table': 'table', 'metric': 'metric'}
+        for key, value in zip(words[1::2], words[2::2]):
+            route[keys[key]] = int(value) if key == 'metric' else value
+        return route
+
+    @staticmethod
+    def rule_json(spec):
+        words = spec.split()
+        return {'priority': int(words[1]), 'src': 'all', 'fwmark': words[3], 'table': words[5]}
+
+    @staticmethod
+    def route_key(spec):
+        route = FakeKernel.route_json(spec)
+        return route.get('table', 'main'), route['dst'], route.get('metric', 0)
+
+    def apply(self, words):
+        kind, action, rest = words[0], words[1], words[2:]
+        if kind == 'addr':
+            addresses = self.links[rest[2]]['addresses']
+            if action == 'add':
+                if rest[0] in addresses:
+                    return 'RTNETLINK answers: File exists'
+                if rest[0] not in self.drop:
+                    addresses.append(rest[0])
+            elif action == 'del':
+                if rest[0] not in addresses:
+                    return 'RTNETLINK answers: Cannot assign requested address'
+                addresses.remove(rest[0])
+        elif kind == 'route':
+            spec = ' '.join(rest)
+            same = [r for r in self.routes if self.route_key(r) == self.route_key(spec)]
+            if action == 'add' and same:
+                return 'RTNETLINK answers: File exists'
+            if action == 'del' and not same:
+                return 'RTNETLINK answers: No such process'
+            self.routes = [r for r in self.routes if r not in same]
+            if action in ('add', 'replace'):
+                self.routes.append(spec)
+        elif kind == 'rule':
+            spec = ' '.join(rest)
+            if action == 'add':
+                self.rules.append(spec)
+            elif spec in self.rules:
+                self.rules.remove(spec)
+            else:
+                return 'RTNETLINK answers: No such file or directory'
+        elif kind == 'link':
+            link = self.links[rest[1]]
+            if rest[2] == 'mtu':
+                link['mtu'] = int(rest[3])
+            else:
+                link['up'] = rest[2] == 'up'
+        return None
+
+    def state(self):
+        return json.loads(json.dumps([self.links, sorted(self.routes), sorted(self.rules)]))
+
+
+@pytest.fixture
+def kernel():
+    return FakeKernel()
+
+
+@pytest.fixture
+def store(kernel, tmp_path):
+    return ConfigCheckpoints(kernel, directory=str(tmp_path))
+
+
+@pytest.fixture(autouse=True)
+def promote_secondaries_on(monkeypatch):
+    monkeypatch.setattr(checkpoints.BulkInterfaceConfig, 'promote_secondaries', lambda self, iface: True)
+
+
+def change(kernel):
+    kernel.links['usb0']['addresses'] = ['10.0.0.3/24']
+    kernel.links['eth0']['mtu'] = 9000
+    kernel.routes = ['default via 192.0.2.254 dev eth0 proto static',
+                     'default via 10.0.0.1 dev usb0 table 7',
+                     '203.0.113.0/24 via 10.0.0.1 dev usb0']
+    kernel.rules = ['pref 200 fwmark 0x9 lookup 7']
+
+
+def test_capture_skips_builtin_rules(store):
+    checkpoint = store.capture()
+    assert checkpoint['links']['usb0'] == {'up': True, 'mtu': 1500, 'addresses': ['10.0.0.2/24']}
+    assert checkpoint['routes'] == ['default via 192.0.2.1 dev eth0 proto static',
+                                    'default via 10.0.0.1 dev usb0 table 7',
+                                    '198.51.100.0/24 via 10.0.0.1 dev usb0']
+    assert checkpoint['rules'] == ['pref 100 fwmark 0x7 lookup 7']
+
+
+def test_plan_orders_additions_before_removals(store, kernel):
+    checkpoint = store.capture()
+    change(kernel)
+    batch, warnings, error = store.plan(checkpoint)
+    assert error is None and warnings == []
+    assert batch.commands() == [
+        'link set dev eth0 mtu 1500',
+        'addr add 10.0.0.2/24 dev usb0',
+        'route replace default via 192.0.2.1 dev eth0 proto static',
+        'route add 198.51.100.0/24 via 10.0.0.1 dev usb0',
+        'rule add pref 100 fwmark 0x7 lookup 7',
+        'rule del pref 200 fwmark 0x9 lookup 7',
+        'route del 203.0.113.0/24 via 10.0.0.1 dev usb0',
+        'addr del 10.0.0.3/24 dev usb0',
+    ]
+    # Nothing to do once the live state matches
+    assert store.plan(store.capture())[0].commands() == []
+
+
+def test_plan_skips_vanished_interfaces(store, kernel):
+    checkpoint = store.capture()
+    del kernel.links['usb0']
+    kernel.routes = kernel.routes[:1]
+    batch, warnings, error = store.plan(checkpoint)
+    assert error is None
+    assert batch.commands() == []
+    assert 'usb0: interface no longer exists, skipped' in warnings
+
+
+def test_restore_round_trip(store, kernel):
+    original = kernel.state()
+    assert store.save('known-good')['success']
+    change(kernel)
+    result = store.restore('known-good')
+    assert result['success'], result
+    assert kernel.state() == original
+    assert store.verify(store.load('known-good')) == ([], set())
+
+
+def test_restore_rolls_back_when_an_address_vanishes(store, kernel):
+    store.save('known-good')
+    change(kernel)
+    changed = kernel.state()
+    # Applied without error, but the kernel did not keep the address
+    kernel.drop = {'10.0.0.2/24'}
+    result = store.restore('known-good')
+    assert not result['success'] and result['rolled_back']
+    assert result['error'] == 'Restore incomplete, missing: 10.0.0.2/24 on usb0'
+    assert kernel.state() == changed
+
+
+def test_restore_failure_rolls_back(store, kernel):
+    store.save('known-good')
+    change(kernel)
+    changed = kernel.state()
+    kernel.apply = lambda words, apply=kernel.apply: \
+        'RTNETLINK answers: File exists' if words[:2] == ['rule', 'add'] else apply(words)
+    result = store.restore('known-good')
+    assert not result['success'] and result['rolled_back']
+    assert result['failed_command'] == 'rule add pref 100 fwmark 0x7 lookup 7'
+    assert kernel.state() == changed
+
+
+def test_guard_is_persisted_and_resumed(kernel, tmp_path):
+    store = ConfigCheckpoints(kernel, directory=str(tmp_path))
+    assert store.arm(60, 'test')['success']
+    store._guard['timer'].cancel()  # the process dies before the deadline
+    with open(tmp_path / GUARD_FILE) as f:
+        stored = json.load(f)
+    assert stored['checkpoint'] == GUARD_CHECKPOINT and stored['reason'] == 'test'
+
+    # Another process must not overwrite the pending checkpoint
+    other = ConfigCheckpoints(kernel, directory=str(tmp_path))
+    assert not other.arm(60, 'second')['success']
+
+    # After a restart the guard comes back with its original deadline
+    restarted = ConfigCheckpoints(kernel, directory=str(tmp_path))
+    guard = restarted.resume()
+    assert guard['deadline'] == stored['deadline'] and 55 < guard['remaining_s'] <= 60
+    assert restarted.confirm()['success']
+    assert not os.path.exists(tmp_path / GUARD_FILE)
+
+
+def test_expired_guard_reverts_on_resume(kernel, tmp_path):
+    store = ConfigCheckpoints(kernel, directory=str(tmp_path))
+    original = kernel.state()
+    store.arm(60, 'test')
+    store._guard['timer'].cancel()  # the process dies before the deadline
+    change(kernel)
+    guard_path = tmp_path / GUARD_FILE
+    stored = json.loads(guard_path.read_text())
+    stored['deadline'] = time.time() - 1
+    guard_path.write_text(json.dumps(stored))
+
+    events = []
+    restarted = ConfigCheckpoints(kernel, directory=str(tmp_path),
+                                  on_event=lambda event, *args, **details: events.append(event))
+    restarted.resume()
+    deadline = time.monotonic() + 5
+    while 'reverted' not in events and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert kernel.state() == original
+    assert events[:1] == ['expired'] and 'reverted' in events
+    assert not guard_path.exists()
+
+
+def test_guard_checkpoint_cannot_be_deleted_while_pending(store):
+    store.arm(60, 'test')
+    assert not store.delete(GUARD_CHECKPOINT)['success']
+    store.confirm()
+    assert store.delete(GUARD_CHECKPOINT)['success']
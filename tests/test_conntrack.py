@@ -0,0 +1,92 @@
+import io
+import os
+import re
+
+from conntrack import (ConntrackAggregator, ConntrackReader, AddressResolver, UNKNOWN_INTERFACE,
+                       parse_entry, read_chunks)
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'nf_conntrack')
+
+INTERFACES = {
+    'lan': {'addresses': [{'address': '192.168.1.1/24'}]},
+    'usb0': {'addresses': [{'address': '10.0.0.2/24'}]},
+    'usb1': {'addresses': [{'address': '10.1.0.2/24'}, {'address': 'fd01::2/64'}]},
+}
+
+
+def read_fixture():
+    with open(FIXTURE) as f:
+        return f.read()
+
+
+def test_parse_entry():
+    line = read_fixture().splitlines()[0]
+    assert parse_entry(line) == ('tcp', 'ESTABLISHED', '93.184.216.34', '10', '1200',
+                                 '10.0.0.2', '8', '9000', '1')
+    assert parse_entry('not a conntrack entry') is None
+
+
+def test_aggregate_fixture():
+    result = ConntrackReader(path=FIXTURE).aggregate(INTERFACES)
+    assert result['success']
+    assert result['source'] == FIXTURE
+    assert result['total'] == 7
+    assert result['skipped'] == 1
+    assert result['acct_enabled']
+
+    usb0 = result['by_interface']['usb0']
+    # Masqueraded LAN traffic (reply tuple to our address) and traffic from the host itself
+    assert usb0['connections'] == 3
+    assert (usb0['bytes_out'], usb0['bytes_in']) == (1344, 9084)
+    assert (usb0['packets_out'], usb0['packets_in']) == (12, 9)
+    assert usb0['protocols'] == {'tcp': 2, 'icmp': 1}
+    assert usb0['states'] == {'ESTABLISHED': 1, 'SYN_SENT': 1}
+    assert usb0['share'] == 42.9
+
+    usb1 = result['by_interface']['usb1']
+    assert usb1['connections'] == 2
+    assert usb1['protocols'] == {'udp': 1, 'tcp': 1}
+    assert (usb1['bytes_out'], usb1['bytes_in']) == (270, 420)
+
+    # Inbound connection: the reply goes to a remote peer, the original destination is ours
+    assert result['by_interface']['lan']['connections'] == 1
+    assert result['by_interface'][UNKNOWN_INTERFACE]['connections'] == 1
+
+    assert {mark: bucket['connections'] for mark, bucket in result['by_mark'].items()} == \
+        {'0': 2, '1': 2, '2': 2, '3': 1}
+
+
+def test_chunk_boundaries_do_not_change_totals():
+    text = read_fixture()
+    whole = ConntrackAggregator(AddressResolver(INTERFACES))
+    whole.feed(text)
+
+    chunked = ConntrackAggregator(AddressResolver(INTERFACES))
+    for chunk in read_chunks(io.StringIO(text), size=37):
+        assert chunk.endswith('\n')
+        chunked.feed(chunk)
+    assert chunked.summary() == whole.summary()
+
+
+def test_without_accounting():
+    text = re.sub(r' packets=\d+ bytes=\d+', '', read_fixture())
+    aggregator = ConntrackAggregator(AddressResolver(INTERFACES))
+    aggregator.feed_stream(io.StringIO(text))
+    summary = aggregator.summary()
+    assert summary['total'] == 7
+    assert not summary['acct_enabled']
+    assert summary['by_interface']['usb0']['connections'] == 3
+    assert summary['by_interface']['usb0']['bytes_out'] == 0
+
+
+def test_falls_back_to_command(tmp_path):
+    reader = ConntrackReader(path=str(tmp_path / 'missing'), command=['cat', FIXTURE])
+    result = reader.aggregate(INTERFACES)
+    assert result['success']
+    assert result['source'] == f'cat {FIXTURE}'
+    assert result['total'] == 7
+
+    failing = ConntrackReader(path=str(tmp_path / 'missing'), command=['cat', str(tmp_path / 'missing')])
+    result = failing.aggregate(INTERFACES)
+    assert not result['success']
+    assert 'conntrack failed' in result['error']
@@ -0,0 +1,218 @@
+import os
+import sys
+import time
+import ctypes
+import shutil
+import socket
+import subprocess
+import threading
+
+import pytest
+
+from checkpoints import run_command
+from dhcp import (DhcpManager, DhcpTestServer, build_packet, parse_packet, lease_from_ack, external_clients,
+                  BOOTREQUEST, DHCPDISCOVER, DHCPOFFER, DHCPREQUEST, DHCPACK, DHCPNAK, OPT_REQUESTED_IP,
+                  OPT_SERVER_ID)
+
+NETNS = 'nimdhcptest'
+CLIENT = 'nimdh0'
+PEER = 'nimdh1'
+SERVER_ADDRESS = ('10.79.0.1', 24)
+POOL = ('10.79.0.100', '10.79.0.104')
+CLONE_NEWNET = 0x40000000
+
+MAC_A = bytes.fromhex('020000000001')
+MAC_B = bytes.fromhex('020000000002')
+
+
+def has_net_admin():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('CapEff:'):
+                    return bool(int(line.split()[1], 16) & (1 << 12))
+    except OSError:
+        pass
+    return False
+
+
+needs_net_admin = pytest.mark.skipif(
+    not (sys.platform.startswith('linux') and has_net_admin() and shutil.which('ip')),
+    reason='needs CAP_NET_ADMIN and iproute2')
+
+
+def run(cmd, timeout=10, input=None):
+    if not shutil.which('sudo'):
+        cmd = cmd.replace('sudo ', '')
+    return run_command(cmd, timeout=timeout, input=input)
+
+
+def sh(cmd):
+    result = run(cmd)
+    assert result['success'], f"{cmd}: {result['error']}"
+    return result['output']
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append((parse_packet(data), address))
+
+
+def offline_server():
+    server = DhcpTestServer('lab0', POOL, address=SERVER_ADDRESS)
+    server.sock = FakeSocket()
+    return server
+
+
+def request(message_type, mac, xid=1, ciaddr='0.0.0.0', requested=None, server=None):
+    options = []
+    if requested:
+        options.append((OPT_REQUESTED_IP, socket.inet_aton(requested)))
+    if server:
+        options.append((OPT_SERVER_ID, socket.inet_aton(server)))
+    return parse_packet(build_packet(BOOTREQUEST, message_type, xid, mac, ciaddr=ciaddr,
+                                     broadcast=True, options=options))
+
+
+def test_packet_round_trip():
+    packet = request(DHCPREQUEST, MAC_A, xid=0x1234, requested='10.79.0.101', server='10.79.0.1')
+    assert packet['op'] == BOOTREQUEST and packet['type'] == DHCPREQUEST
+    assert packet['xid'] == 0x1234 and packet['broadcast']
+    assert packet['mac'] == MAC_A
+    assert parse_packet(b'\x00' * 300) is None
+
+
+def test_server_exchange():
+    server = offline_server()
+    server.handle(request(DHCPDISCOVER, MAC_A))
+    offer, destination = server.sock.sent[-1]
+    assert offer['type'] == DHCPOFFER and destination == ('255.255.255.255', 68)
+    assert offer['yiaddr'] == POOL[0]
+
+    server.handle(request(DHCPREQUEST, MAC_A, requested=offer['yiaddr'], server=SERVER_ADDRESS[0]))
+    ack, _ = server.sock.sent[-1]
+    assert ack['type'] == DHCPACK
+    lease = lease_from_ack(ack)
+    assert lease == {'address': POOL[0], 'prefixlen': 24, 'router': SERVER_ADDRESS[0], 'dns': [],
+                     'server': SERVER_ADDRESS[0], 'lease_time': 600, 'renew': 300, 'rebind': 525}
+    assert server.bindings == {MAC_A: POOL[0]}
+
+    # Another client asking for the same address is refused
+    server.handle(request(DHCPREQUEST, MAC_B, requested=POOL[0]))
+    assert server.sock.sent[-1][0]['type'] == DHCPNAK
+
+    # INIT-REBOOT from another network is not ours to answer
+    sent = len(server.sock.sent)
+    server.handle(request(DHCPREQUEST, MAC_B, requested='192.168.50.7'))
+    assert len(server.sock.sent) == sent
+    assert server.stats['DISCOVER'] == 1 and server.stats['REQUEST'] == 3
+
+
+def test_take_over_stops_external_client(tmp_path):
+    # A process whose argv[0] is "dhclient" and which names the interface, like the one
+    # configure-usb-tethering.sh leaves behind
+    process = subprocess.Popen(['dhclient', '-c', 'import time; time.sleep(60)', 'nimfake0'],
+                               executable=sys.executable)
+    try:
+        deadline = time.monotonic() + 5
+        while process.pid not in external_clients('nimfake0') and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert external_clients('nimfake0') == [process.pid]
+
+        events = []
+        manager = DhcpManager(run, path=str(tmp_path / 'leases.json'), watch_links=False,
+                              on_event=lambda event, *args, **details: events.append((event, details)))
+        assert manager.take_over('nimfake0') is None
+        process.wait(5)
+        assert external_clients('nimfake0') == []
+        assert events == [('takeover', {'interface': 'nimfake0', 'pids': [process.pid]})]
+        assert manager.take_over('nimfake0') is None
+    finally:
+        process.kill()
+        process.wait()
+
+
+def in_netns(func):
+    """Call func on a thread that has joined NETNS; sockets it creates stay there"""
+    result = {}
+
+    def target():
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = os.open(f'/run/netns/{NETNS}', os.O_RDONLY)
+            try:
+                if libc.setns(fd, CLONE_NEWNET) != 0:
+                    raise OSError(ctypes.get_errno(), 'setns failed')
+            finally:
+                os.close(fd)
+            result['value'] = func()
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result.get('value')
+
+
+@pytest.fixture
+def lab():
+    """veth pair with the server end in its own namespace and a test server on it"""
+    run(f'ip netns del {NETNS}')
+    run(f'ip link del {CLIENT}')
+    sh(f'ip netns add {NETNS}')
+    server = None
+    try:
+        sh(f'ip link add {CLIENT} type veth peer name {PEER} netns {NETNS}')
+        sh(f'ip netns exec {NETNS} ip addr add {SERVER_ADDRESS[0]}/{SERVER_ADDRESS[1]} dev {PEER}')
+        sh(f'ip netns exec {NETNS} ip link set {PEER} up')
+        sh(f'ip link set {CLIENT} up')
+        server = DhcpTestServer(PEER, POOL, address=SERVER_ADDRESS)
+        in_netns(server.start)
+        yield server
+    finally:
+        if server:
+            server.stop()
+        run(f'ip link del {CLIENT}')
+        run(f'ip netns del {NETNS}')
+
+
+@needs_net_admin
+def test_acquire_reboot_and_release(lab, tmp_path):
+    leases = str(tmp_path / 'leases.json')
+    events = []
+    on_event = lambda event, *args, **details: events.append(event)
+
+    manager = DhcpManager(run, path=leases, on_event=on_event, watch_links=False)
+    result = manager.start(CLIENT, wait=True, timeout=15)
+    assert result['success'], result
+    status = result['interfaces'][CLIENT]
+    address = status['lease']['address']
+    assert address in lab.pool
+    assert status['last']['path'] == 'discover'
+    assert manager.addresses(CLIENT) == [f'{address}/24']
+    assert lab.stats['DISCOVER'] >= 1 and lab.stats['REQUEST'] >= 1
+    assert lab.bindings[bytes.fromhex(status['mac'].replace(':', ''))] == address
+    assert 'bound' in events
+
+    # Restart: the cached lease is confirmed with a single REQUEST, the address never goes away
+    manager.shutdown()
+    assert manager.addresses(CLIENT) == [f'{address}/24']
+    discovers = lab.stats['DISCOVER']
+    manager = DhcpManager(run, path=leases, on_event=on_event, watch_links=False)
+    result = manager.start(CLIENT, wait=True, timeout=15)
+    assert result['success'], result
+    status = result['interfaces'][CLIENT]
+    assert status['last']['path'] == 'init-reboot'
+    assert status['lease']['address'] == address
+    assert lab.stats['DISCOVER'] == discovers
+    assert manager.addresses(CLIENT) == [f'{address}/24']
+
+    assert manager.stop(CLIENT)['success']
+    assert manager.addresses(CLIENT) == []
+    assert manager.get_status()['managed'] == []
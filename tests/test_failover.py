@@ -0,0 +1,40 @@
+import pytest
+
+from failover import FailoverController
+
+
+def controller():
+    return FailoverController(lambda cmd, **kwargs: {'success': True, 'output': '', 'error': ''},
+                              prober=object(), link_monitor=False)
+
+
+@pytest.mark.parametrize('uplink', [
+    {'interface': 'eth0', 'gateway': '127.0.0.1; touch /tmp/pwned'},
+    {'interface': 'eth0; reboot', 'gateway': '192.0.2.1'},
+    {'interface': 'eth0'},
+    {'interface': 'eth0', 'gateway': '192.0.2.1', 'weight': 'heavy'},
+    {'interface': 'eth0', 'gateway': '192.0.2.1', 'weight': 0},
+    'eth0',
+])
+def test_configure_rejects_bad_uplinks(uplink):
+    failover = controller()
+    result = failover.configure([uplink])
+    assert not result['success']
+    assert failover.uplinks == []
+
+
+def test_configure_rejects_non_integer_timing():
+    result = controller().configure([{'interface': 'eth0', 'gateway': '192.0.2.1'}], interval_ms='abc')
+    assert not result['success']
+    assert 'integers' in result['error']
+
+
+def test_configure_accepts_valid_uplinks():
+    failover = controller()
+    result = failover.configure([{'interface': 'usb0', 'gateway': '192.0.2.1', 'weight': 2},
+                                 {'interface': 'eth0', 'gateway': '198.51.100.1'}],
+                                interval_ms='50', multiplier=3, budget_ms=1000)
+    assert result['success']
+    assert [(u.interface, u.gateway, u.weight) for u in failover.uplinks] == \
+        [('usb0', '192.0.2.1', 2), ('eth0', '198.51.100.1', 1)]
+    assert failover.interval_ms == 50
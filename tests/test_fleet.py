@@ -0,0 +1,245 @@
+import copy
+import gzip
+import io
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import pytest
+
+import fleet
+from fleet import (FleetAgent, FleetAggregator, MAX_FRAMES, decompress, diff, flatten, unflatten)
+
+
+class Collector:
+    """Snapshot source the test mutates between frames"""
+
+    def __init__(self):
+        self.state = {
+            'interfaces': {
+                'eth0': {'state': 'UP', 'stats': {'rx_bytes': 0, 'tx_bytes': 0}},
+                'usb0': {'state': 'UP', 'stats': {'rx_bytes': 0, 'tx_bytes': 0}},
+            },
+            'routes': ['default via 10.0.0.1 dev eth0'],
+            'probes': {},
+        }
+
+    def __call__(self):
+        return copy.deepcopy(self.state)
+
+
+def deliver(agent, aggregator):
+    result = aggregator.ingest(json.loads(json.dumps(agent.payload())))
+    agent.frames = []
+    return result
+
+
+@pytest.fixture
+def chain():
+    collector = Collector()
+    agent = FleetAgent(collector, aggregator='http://unused', node='gw1', token='')
+    return collector, agent, FleetAggregator(token='')
+
+
+def test_flatten_round_trip():
+    state = Collector()()
+    flat = flatten(state)
+    assert flat['interfaces/eth0/stats/rx_bytes'] == 0
+    assert flat['probes'] == {}
+    assert unflatten(flat) == state
+
+    changed, removed = diff(flat, dict(flat, **{'interfaces/eth0/state': 'DOWN'}))
+    assert changed == {'interfaces/eth0/state': 'DOWN'}
+    assert removed == []
+
+
+def test_delta_chain_reproduces_agent_state(chain):
+    collector, agent, aggregator = chain
+
+    first = agent.build_frame()
+    assert first['full']
+    assert deliver(agent, aggregator) == {'success': True, 'seq': 1}
+
+    collector.state['interfaces']['eth0']['stats']['rx_bytes'] = 4096
+    collector.state['interfaces']['usb0']['state'] = 'DOWN'
+    second = agent.build_frame()
+    assert second['base'] == 1
+    assert second['set'] == {'interfaces/eth0/stats/rx_bytes': 4096, 'interfaces/usb0/state': 'DOWN'}
+
+    del collector.state['interfaces']['usb0']
+    collector.state['routes'] = []
+    third = agent.build_frame()
+    assert sorted(third['del']) == ['interfaces/usb0/state', 'interfaces/usb0/stats/rx_bytes',
+                                    'interfaces/usb0/stats/tx_bytes']
+
+    # Two deltas in one batch
+    assert deliver(agent, aggregator) == {'success': True, 'seq': 3}
+    node = aggregator.get_node('gw1')
+    assert node['state'] == collector()
+    assert node['synced']
+    assert node['interfaces_total'] == 1
+    assert node['default_routes'] == []
+
+
+def test_retransmitted_frames_are_skipped(chain):
+    collector, agent, aggregator = chain
+    agent.build_frame()
+    collector.state['interfaces']['eth0']['state'] = 'DOWN'
+    agent.build_frame()
+    payload = json.loads(json.dumps(agent.payload()))
+
+    assert aggregator.ingest(payload)['seq'] == 2
+    # The acknowledgement was lost and the agent sent the same batch again
+    assert aggregator.ingest(payload) == {'success': True, 'seq': 2}
+    assert aggregator.get_node('gw1')['state'] == collector()
+
+
+def test_gap_in_chain_requests_resync(chain):
+    collector, agent, aggregator = chain
+    agent.build_frame()
+    deliver(agent, aggregator)
+
+    collector.state['interfaces']['eth0']['state'] = 'DOWN'
+    agent.build_frame()
+    agent.frames = []  # lost upload
+
+    collector.state['interfaces']['eth0']['state'] = 'UP'
+    agent.build_frame()
+    result = deliver(agent, aggregator)
+    assert result['resync'] and not result['success']
+    node = aggregator.get_node('gw1')
+    assert not node['synced'] and node['resyncs'] == 1
+
+    agent.full_next = True
+    agent.build_frame()
+    assert deliver(agent, aggregator) == {'success': True, 'seq': 4}
+    assert aggregator.get_node('gw1')['state'] == collector()
+
+
+def test_buffer_collapses_to_full_snapshot(chain):
+    collector, agent, aggregator = chain
+    for i in range(MAX_FRAMES + 1):
+        collector.state['interfaces']['eth0']['stats']['rx_bytes'] = i
+        agent.build_frame()
+    assert len(agent.frames) == 1 and agent.frames[0]['full']
+    assert deliver(agent, aggregator) == {'success': True, 'seq': MAX_FRAMES + 1}
+    assert aggregator.get_node('gw1')['state'] == collector()
+
+
+def test_rejects_reserved_and_malformed(chain):
+    _, _, aggregator = chain
+    assert not aggregator.ingest({'node': 'push', 'frames': []})['success']
+    assert not aggregator.ingest({'node': 'a/b', 'frames': []})['success']
+    assert not aggregator.ingest({'node': 'gw1', 'frames': [{'seq': 1}]})['success']
+
+
+def test_decompress_limit():
+    assert decompress(gzip.compress(b'x' * 100), limit=100) == b'x' * 100
+    with pytest.raises(ValueError):
+        decompress(gzip.compress(b'x' * 101), limit=100)
+
+
+class Response(io.BytesIO):
+    """Just enough of an urlopen() response for FleetAgent.push"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@pytest.fixture
+def fleet_app(monkeypatch):
+    """The real Flask app with a fresh aggregator; agent uploads go through its test client"""
+    import app
+
+    aggregator = FleetAggregator(token='secret')
+    monkeypatch.setattr(app, 'fleet_aggregator', aggregator)
+    client = app.app.test_client()
+
+    def urlopen(req, timeout=None):
+        response = client.post(urllib.parse.urlsplit(req.full_url).path, data=req.data,
+                               headers=dict(req.header_items()))
+        if response.status_code >= 400:
+            raise urllib.error.HTTPError(req.full_url, response.status_code, response.status,
+                                         response.headers, Response(response.data))
+        return Response(response.data)
+
+    monkeypatch.setattr(urllib.request, 'urlopen', urlopen)
+    return client, aggregator
+
+
+def test_push_through_route_and_resync(fleet_app):
+    client, aggregator = fleet_app
+    collector = Collector()
+    agent = FleetAgent(collector, aggregator='http://aggregator', node='gw1', token='secret')
+    assert agent.url == 'http://aggregator/api/fleet/push'
+
+    agent.build_frame()
+    assert agent.push()['success']
+    assert agent.frames == []
+
+    # The aggregator restarted and forgot the node: the next delta is refused with 409
+    aggregator.forget('gw1')
+    collector.state['interfaces']['eth0']['state'] = 'DOWN'
+    agent.build_frame()
+    result = agent.push()
+    assert result['success'] and result['resync']
+    assert agent.full_next and agent.stats['resyncs'] == 1
+
+    agent.build_frame()
+    result = agent.push()
+    assert result['success'] and not result['resync']
+    assert agent.stats['pushes'] == 3
+    assert client.get('/api/fleet/gw1').get_json()['state'] == collector()
+
+    intruder = FleetAgent(collector, aggregator='http://aggregator', node='gw2', token='wrong')
+    intruder.build_frame()
+    result = intruder.push()
+    assert not result['success'] and 'HTTP 403' in result['error']
+    assert client.get('/api/fleet/gw2').status_code == 404
+
+
+def test_push_route_rejects_bad_uploads(fleet_app, monkeypatch):
+    client, aggregator = fleet_app
+    headers = {'X-Fleet-Token': 'secret'}
+
+    response = client.post('/api/fleet/push', data=b'{}', headers={'X-Fleet-Token': 'wrong'})
+    assert response.status_code == 403
+
+    response = client.post('/api/fleet/push', data=b'not json', headers=headers)
+    assert response.status_code == 400
+
+    response = client.post('/api/fleet/push', data=b'{}', headers=dict(headers, **{'Content-Encoding': 'gzip'}))
+    assert response.status_code == 400
+
+    response = client.post('/api/fleet/push', data=json.dumps({'node': 'a/b', 'frames': []}), headers=headers)
+    assert response.status_code == 400
+
+    # A delta for a node the aggregator has never seen
+    agent = FleetAgent(Collector(), aggregator='http://aggregator', node='gw1', token='secret')
+    agent.build_frame()
+    agent.frames = []
+    agent.build_frame()
+    response = client.post('/api/fleet/push', data=json.dumps(agent.payload()), headers=headers)
+    assert response.status_code == 409 and response.get_json()['resync']
+
+    monkeypatch.setattr(fleet, 'MAX_PAYLOAD', 64)
+    response = client.post('/api/fleet/push', data=b' ' * 65, headers=headers)
+    assert response.status_code == 413
+    assert [n['node'] for n in aggregator.summary()['nodes']] == ['gw1']
+    assert not aggregator.get_node('gw1')['synced']
+
+
+def test_forget_route_requires_token(fleet_app):
+    client, aggregator = fleet_app
+    agent = FleetAgent(Collector(), aggregator='http://aggregator', node='gw1', token='secret')
+    agent.build_frame()
+    assert agent.push()['success']
+
+    assert client.delete('/api/fleet/gw1', headers={'X-Fleet-Token': 'wrong'}).status_code == 403
+    assert client.delete('/api/fleet/gw1', headers={'X-Fleet-Token': 'secret'}).status_code == 200
+    assert aggregator.get_node('gw1') is None
+    assert client.delete('/api/fleet/gw1', headers={'X-Fleet-Token': 'secret'}).status_code == 404
@@ -0,0 +1,156 @@
+import json
+
+import pytest
+
+from ipbatch import IpBatch, BulkInterfaceConfig
+
+PROMOTE = 'net/ipv4/conf/eth0/promote_secondaries'
+
+
+class FakeIp:
+    """run_command stand-in that records every call and applies `addr` lines to its links
+
+    The first `ip -batch` fails at `fail_line`; addresses in `drop` vanish as
+    soon as they are added, like secondaries taken with a removed primary.
+    """
+
+    def __init__(self, links=None, fail_line=None, drop=()):
+        self.links = {name: list(addresses) for name, addresses in (links or {}).items()}
+        self.fail_line = fail_line
+        self.drop = set(drop)
+        self.calls = []
+
+    def __call__(self, cmd, timeout=10, input=None):
+        lines = input.splitlines() if input else None
+        self.calls.append((cmd, lines))
+        if cmd == 'ip -j addr show':
+            return {'success': True, 'output': json.dumps([
+                {'ifname': name, 'flags': ['UP'], 'mtu': 1500,
+                 'addr_info': [{'family': 'inet', 'local': a.split('/')[0], 'prefixlen': int(a.split('/')[1]),
+                                'scope': 'global', 'broadcast': '10.0.0.255'} for a in addresses]}
+                for name, addresses in self.links.items()]), 'error': ''}
+        if cmd.endswith('-batch -'):
+            if self.fail_line and cmd == 'sudo ip -batch -':
+                lines, failed = lines[:self.fail_line - 1], self.fail_line
+                self.fail_line = None
+                self.apply(lines)
+                return {'success': False, 'output': '',
+                        'error': f'RTNETLINK answers: File exists\nCommand failed -:{failed}'}
+            self.apply(lines)
+        return {'success': True, 'output': '', 'error': ''}
+
+    def apply(self, lines):
+        for line in lines:
+            words = line.split()
+            if words[0] != 'addr':
+                continue
+            addresses = self.links.setdefault(words[4], [])
+            if words[1] == 'add' and words[2] not in self.drop:
+                addresses.append(words[2])
+            elif words[1] == 'del' and words[2] in addresses:
+                addresses.remove(words[2])
+
+    def commands(self):
+        return [cmd for cmd, _ in self.calls if cmd != 'ip -j addr show']
+
+
+def bulk(fake, promote):
+    config = BulkInterfaceConfig(fake)
+    config.promote_secondaries = lambda iface: promote
+    return config
+
+
+def test_batch_runs_in_one_process():
+    fake = FakeIp()
+    batch = IpBatch(fake)
+    batch.add('addr add 10.0.0.2/24 dev eth0', 'addr del 10.0.0.2/24 dev eth0')
+    batch.add('link set dev eth0 up')
+    assert batch.execute() == {'success': True, 'applied': ['addr add 10.0.0.2/24 dev eth0',
+                                                            'link set dev eth0 up']}
+    assert fake.calls == [('sudo ip -batch -', ['addr add 10.0.0.2/24 dev eth0', 'link set dev eth0 up'])]
+
+
+def test_failure_rolls_back_applied_lines_in_reverse():
+    fake = FakeIp(fail_line=3)
+    batch = IpBatch(fake)
+    batch.add('addr add 10.0.0.2/24 dev eth0', 'addr del 10.0.0.2/24 dev eth0')
+    batch.add('link set dev eth0 mtu 9000', 'link set dev eth0 mtu 1500')
+    batch.add('addr add 10.0.0.3/24 dev eth0', 'addr del 10.0.0.3/24 dev eth0')
+    result = batch.execute()
+    assert not result['success'] and result['rolled_back']
+    assert result['failed_command'] == 'addr add 10.0.0.3/24 dev eth0'
+    assert result['applied'] == ['addr add 10.0.0.2/24 dev eth0', 'link set dev eth0 mtu 9000']
+    assert fake.calls[-1] == ('sudo ip -force -batch -', ['link set dev eth0 mtu 1500',
+                                                          'addr del 10.0.0.2/24 dev eth0'])
+
+
+def test_inverse_skips_and_keeps_sysctls():
+    batch = IpBatch(FakeIp())
+    batch.hold_sysctl(PROMOTE, 1, 0)
+    batch.add('addr add 10.0.0.2/24 dev eth0', 'addr del 10.0.0.2/24 dev eth0')
+    batch.add('addr del 10.0.0.1/24 dev eth0', 'addr add 10.0.0.1/24 dev eth0')
+    undo = batch.inverse(skip={'addr del 10.0.0.2/24 dev eth0'})
+    assert undo.commands() == ['addr add 10.0.0.1/24 dev eth0']
+    assert undo.sysctls == {PROMOTE: (1, 0)}
+
+
+@pytest.mark.parametrize('promote', [True, False])
+def test_same_subnet_change_adds_before_removing(promote):
+    fake = FakeIp({'eth0': ['10.0.0.1/24']})
+    result = bulk(fake, promote).apply({'eth0': {'ip': '10.0.0.2', 'netmask': '24'}})
+    assert result['success']
+    assert fake.links == {'eth0': ['10.0.0.2/24']}
+    batch = [('sudo ip -batch -', ['addr add 10.0.0.2/24 dev eth0', 'addr del 10.0.0.1/24 dev eth0'])]
+    if promote:
+        assert [call for call in fake.calls if call[0] != 'ip -j addr show'] == batch
+    else:
+        # The kernel would delete the new secondary together with the old primary
+        assert [call for call in fake.calls if call[0] != 'ip -j addr show'] == \
+            [(f'sudo sysctl -qw {PROMOTE}=1', None)] + batch + [(f'sudo sysctl -qw {PROMOTE}=0', None)]
+
+
+def test_other_subnet_needs_no_sysctl():
+    fake = FakeIp({'eth0': ['10.0.0.1/24']})
+    batch, warnings, error = bulk(fake, False).compile(
+        {'eth0': {'addresses': ['10.9.0.1/24']}}, bulk(fake, False).read_current())
+    assert error is None and warnings == []
+    assert batch.sysctls == {}
+    assert batch.commands() == ['addr add 10.9.0.1/24 dev eth0', 'addr del 10.0.0.1/24 dev eth0']
+
+
+def test_failed_apply_rolls_back_with_sysctl_held():
+    fake = FakeIp({'eth0': ['10.0.0.1/24']}, fail_line=2)
+    result = bulk(fake, False).apply({'eth0': {'addresses': ['10.0.0.2/24']}})
+    assert not result['success'] and result['rolled_back']
+    assert fake.links == {'eth0': ['10.0.0.1/24']}
+    assert fake.commands() == [f'sudo sysctl -qw {PROMOTE}=1', 'sudo ip -batch -',
+                               'sudo ip -force -batch -', f'sudo sysctl -qw {PROMOTE}=0']
+    assert fake.calls[-2][1] == ['addr del 10.0.0.2/24 dev eth0']
+
+
+def test_sysctl_failure_applies_nothing():
+    fake = FakeIp({'eth0': ['10.0.0.1/24']})
+    original = fake.__call__
+
+    def run(cmd, **kwargs):
+        if cmd.startswith('sudo sysctl'):
+            fake.calls.append((cmd, None))
+            return {'success': False, 'output': '', 'error': 'permission denied'}
+        return original(cmd, **kwargs)
+
+    config = BulkInterfaceConfig(run)
+    config.promote_secondaries = lambda iface: False
+    result = config.apply({'eth0': {'addresses': ['10.0.0.2/24']}})
+    assert not result['success'] and 'permission denied' in result['error']
+    assert 'sudo ip -batch -' not in fake.commands()
+
+
+def test_missing_address_after_apply_is_undone():
+    # The batch succeeded but the new address did not survive
+    fake = FakeIp({'eth0': ['10.0.0.1/24']}, drop={'10.0.0.2/24'})
+    result = bulk(fake, True).apply({'eth0': {'addresses': ['10.0.0.2/24']}})
+    assert not result['success']
+    assert result['error'] == 'Addresses missing after apply: 10.0.0.2/24 on eth0'
+    # Re-add the old address; deleting the vanished new one would fail the undo
+    assert fake.calls[-1] == ('sudo ip -batch -', ['addr add 10.0.0.1/24 dev eth0 broadcast 10.0.0.255'])
+    assert fake.links == {'eth0': ['10.0.0.1/24']}
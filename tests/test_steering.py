@@ -0,0 +1,44 @@
+import pytest
+
+from steering import validate
+
+UPLINKS = [{'interface': 'usb0', 'gateway': '192.0.2.1'}, {'interface': 'eth0', 'gateway': '198.51.100.1'}]
+
+
+def config(**spec):
+    return {'uplinks': UPLINKS, 'classes': [dict({'name': 'web', 'uplink': 'usb0'}, **spec)]}
+
+
+def test_validate_normalises_classes():
+    result, error = validate(config(ports=['443', '6881-6889', '53/udp'], cidrs=['10.1.2.3/8'],
+                                    dscp=['ef', 10], fallback='eth0'))
+    assert error is None
+    assert result['classes'] == [{'name': 'web', 'uplink': 'usb0', 'fallback': 'eth0',
+                                  'ports': ['443', '6881-6889', '53/udp'], 'cidrs': ['10.0.0.0/8'],
+                                  'dscp': [46, 10]}]
+
+
+@pytest.mark.parametrize('field, value', [
+    ('ports', '443'),
+    ('ports', 443),
+    ('cidrs', '10.0.0.0/8'),
+    ('dscp', 46),
+    ('dscp', {'ef': True}),
+])
+def test_validate_requires_lists(field, value):
+    result, error = validate(config(**{field: value}))
+    assert result is None
+    assert error == f'web: {field} must be a list'
+
+
+@pytest.mark.parametrize('spec', [
+    {'ports': ['0']},
+    {'ports': ['90-80']},
+    {'cidrs': ['2001:db8::/32']},
+    {'dscp': [64]},
+    {'dscp': ['bogus']},
+    {},
+])
+def test_validate_rejects_bad_match_values(spec):
+    result, error = validate(config(**spec))
+    assert result is None and error.startswith('web: ')
@@ -0,0 +1,575 @@
+#!/usr/bin/env python3
+"""
+Per-uplink throughput measurement for Network Interface Manager
+
+The client opens TCP streams bound to one interface (SO_BINDTODEVICE,
+or its IPv4 address without CAP_NET_RAW) to a test server, another
+instance of this app or `python3 throughput.py server` on a peer, and
+measures for a fixed duration:
+
+- goodput: bytes delivered to the receiving application per second
+- RTT under load: TCP_INFO smoothed RTT sampled on the sending socket,
+  against the RTT measured right after the handshake
+- retransmits: segments and bytes retransmitted by the sender
+
+Each stream starts with a one-line JSON request, {"mode": "download" |
+"upload" | "result", "duration": s, "id": ..., "token": ...}. For a
+download the server is the sender and keeps its TCP_INFO samples, which
+the client fetches afterwards with a "result" request.
+
+Results are appended as JSON lines to throughput.jsonl and read back
+from the end of the file.
+
+    python3 throughput.py server --port 5025
+    python3 throughput.py run --server 192.0.2.10 --interface usb0 --interface eth0 --parallel
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import hmac
+import errno
+import socket
+import struct
+import logging
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+
+from journal import reverse_lines
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+THROUGHPUT_PORT = int(os.environ.get('NIM_THROUGHPUT_PORT', '5025'))
+THROUGHPUT_TOKEN = os.environ.get('NIM_THROUGHPUT_TOKEN', '')
+THROUGHPUT_SERVER = os.environ.get('NIM_THROUGHPUT_SERVER', '0') == '1'
+RESULTS_FILE = os.environ.get('NIM_THROUGHPUT_RESULTS', os.path.join(BASE_DIR, 'throughput.jsonl'))
+
+MAX_DURATION = 30  # seconds, enforced by the server
+MAX_STREAMS = 8
+MAX_CONCURRENT = 16  # streams the server runs at once
+CHUNK = 128 * 1024
+SAMPLE_INTERVAL = 0.1  # seconds between TCP_INFO samples
+SIOCGIFADDR = 0x8915
+
+# struct tcp_info offsets (include/uapi/linux/tcp.h); older kernels return less
+TCP_INFO_FIELDS = (
+    ('rtt_us', 68, 'I'),
+    ('rttvar_us', 72, 'I'),
+    ('snd_cwnd', 80, 'I'),
+    ('rcv_rtt_us', 92, 'I'),
+    ('total_retrans', 100, 'I'),
+    ('bytes_acked', 120, 'Q'),
+    ('bytes_received', 128, 'Q'),
+    ('min_rtt_us', 148, 'I'),
+    ('delivery_rate', 160, 'Q'),
+    ('bytes_sent', 200, 'Q'),
+    ('bytes_retrans', 208, 'Q'),
+)
+TCP_INFO_SIZE = 232
+
+
+def tcp_info(sock):
+    """Selected TCP_INFO fields of a connected socket"""
+    try:
+        data = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO_SIZE)
+    except OSError:
+        return {}
+    info = {}
+    for name, offset, fmt in TCP_INFO_FIELDS:
+        if len(data) >= offset + struct.calcsize(fmt):
+            info[name] = struct.unpack_from(fmt, data, offset)[0]
+    return info
+
+
+def interface_ipv4(iface):
+    """Primary IPv4 address of an interface, or None"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            data = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack('256s', iface.encode()[:15]))
+        return socket.inet_ntoa(data[20:24])
+    except OSError:
+        return None
+
+
+def rtt_summary(samples_us):
+    if not samples_us:
+        return None
+    ordered = sorted(samples_us)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+    return {
+        'p50_ms': round(pick(0.5) / 1000, 2),
+        'p90_ms': round(pick(0.9) / 1000, 2),
+        'max_ms': round(ordered[-1] / 1000, 2),
+        'samples': len(ordered)
+    }
+
+
+def read_line(sock, limit=4096):
+    """Read one newline-terminated line without consuming anything after it"""
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(1)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > limit:
+            raise ValueError('Request line too long')
+    return data
+
+
+class SenderStats:
+    """TCP_INFO sampling for the sending side of a stream"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.idle_rtt_us = tcp_info(sock).get('rtt_us')
+        self.samples = []
+        self.next_sample = time.monotonic() + SAMPLE_INTERVAL
+
+    def maybe_sample(self, now):
+        if now >= self.next_sample:
+            rtt = tcp_info(self.sock).get('rtt_us')
+            if rtt:
+                self.samples.append(rtt)
+            self.next_sample = now + SAMPLE_INTERVAL
+
+    def result(self):
+        info = tcp_info(self.sock)
+        return {
+            'rtt_idle_ms': round(self.idle_rtt_us / 1000, 2) if self.idle_rtt_us else None,
+            'rtt_loaded': rtt_summary(self.samples),
+            'min_rtt_ms': round(info['min_rtt_us'] / 1000, 2) if info.get('min_rtt_us') else None,
+            'retransmits': info.get('total_retrans'),
+            'bytes_retrans': info.get('bytes_retrans'),
+            'cwnd': info.get('snd_cwnd'),
+        }
+
+
+class _StreamHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server.owner
+        sock = self.request
+        sock.settimeout(10)
+        try:
+            request = json.loads(read_line(sock) or b'{}')
+        except (OSError, ValueError):
+            return
+        if not server.authorized(request.get('token')):
+            self._reply({'success': False, 'error': 'Invalid token'})
+            return
+
+        mode = request.get('mode')
+        if mode == 'result':
+            self._reply(server.pop_result(str(request.get('id'))))
+            return
+        if mode not in ('download', 'upload'):
+            self._reply({'success': False, 'error': f'Unknown mode {mode!r}'})
+            return
+        if not server.slots.acquire(blocking=False):
+            self._reply({'success': False, 'error': 'Server busy'})
+            return
+        try:
+            duration = min(max(float(request.get('duration', 5)), 0.5), MAX_DURATION)
+            if mode == 'download':
+                server.store_result(str(request.get('id')), self._send(duration))
+            else:
+                self._reply(self._receive(duration))
+        except OSError as e:
+            logger.debug(f"Throughput stream from {self.client_address[0]} ended: {e}")
+        finally:
+            server.slots.release()
+
+    def _reply(self, data):
+        try:
+            self.request.sendall(json.dumps(data).encode() + b'\n')
+        except OSError:
+            pass
+
+    def _send(self, duration):
+        sock = self.request
+        payload = os.urandom(CHUNK)
+        stats = SenderStats(sock)
+        sent = 0
+        start = time.monotonic()
+        deadline = start + duration
+        now = start
+        while now < deadline:
+            sent += sock.send(payload)
+            now = time.monotonic()
+            stats.maybe_sample(now)
+        result = stats.result()
+        sock.shutdown(socket.SHUT_WR)
+        result.update(success=True, bytes_sent=sent, elapsed_s=round(time.monotonic() - start, 3))
+        return result
+
+    def _receive(self, duration):
+        sock = self.request
+        buffer = bytearray(CHUNK)
+        received = 0
+        first = last = None
+        # Allow for a slow start on the client side, then stop reading
+        sock.settimeout(duration + 10)
+        while True:
+            n = sock.recv_into(buffer)
+            if not n:
+                break
+            last = time.monotonic()
+            if first is None:
+                first = last
+            received += n
+        elapsed = (last - first) if first and last and last > first else 0
+        return {
+            'success': True,
+            'bytes_received': received,
+            'elapsed_s': round(elapsed, 3),
+            'goodput_mbps': round(received * 8 / elapsed / 1e6, 2) if elapsed else 0,
+            'rcv_rtt_ms': round(tcp_info(sock).get('rcv_rtt_us', 0) / 1000, 2)
+        }
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ThroughputServer:
+    """Test endpoint answering download, upload and result requests"""
+
+    def __init__(self, host='0.0.0.0', port=THROUGHPUT_PORT, token=THROUGHPUT_TOKEN):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.slots = threading.BoundedSemaphore(MAX_CONCURRENT)
+        self.results = OrderedDict()
+        self._results_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._server is not None
+
+    def authorized(self, token):
+        return not self.token or hmac.compare_digest(self.token, token or '')
+
+    def store_result(self, test_id, result):
+        with self._results_lock:
+            self.results[test_id] = result
+            while len(self.results) > 256:
+                self.results.popitem(last=False)
+
+    def pop_result(self, test_id):
+        # The client asks right after the stream closes; give the sender a moment
+        for _ in range(20):
+            with self._results_lock:
+                if test_id in self.results:
+                    return self.results.pop(test_id)
+            time.sleep(0.05)
+        return {'success': False, 'error': f'No result for test {test_id}'}
+
+    def start(self):
+        if self.running:
+            return {'success': True, 'message': f'Throughput server already listening on port {self.port}'}
+        try:
+            self._server = _ThreadingServer((self.host, self.port), _StreamHandler)
+        except OSError as e:
+            return {'success': False, 'error': f'Cannot listen on port {self.port}: {e}'}
+        self._server.owner = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name='throughput-server', daemon=True)
+        self._thread.start()
+        logger.info(f"Throughput server listening on {self.host}:{self.port}")
+        return {'success': True, 'message': f'Throughput server listening on port {self.port}'}
+
+    def stop(self):
+        if not self.running:
+            return {'success': True, 'message': 'Throughput server not running'}
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        return {'success': True, 'message': 'Throughput server stopped'}
+
+    def get_status(self):
+        return {'running': self.running, 'port': self.port, 'token_required': bool(self.token)}
+
+
+class ThroughputTester:
+    """Runs timed, interface-bound streams against a test server and keeps the results"""
+
+    def __init__(self, results_file=RESULTS_FILE, token=THROUGHPUT_TOKEN):
+        self.results_file = results_file
+        self.token = token
+        self.running = None
+        self._lock = threading.Lock()
+
+    def _connect(self, iface, server, port, timeout):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, iface.encode())
+        except PermissionError:
+            # Without CAP_NET_RAW, bind the source address and rely on policy routing
+            address = interface_ipv4(iface)
+            if address is None:
+                sock.close()
+                raise OSError(errno.EADDRNOTAVAIL, f'{iface} has no IPv4 address')
+            sock.bind((address, 0))
+        except OSError:
+            sock.close()
+            raise
+        try:
+            sock.connect((server, port))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _request(self, sock, mode, duration, test_id):
+        request = {'mode': mode, 'duration': duration, 'id': test_id, 'token': self.token}
+        sock.sendall(json.dumps(request).encode() + b'\n')
+
+    def download(self, iface, server, port, duration):
+        """One stream where the server sends; returns goodput and the server's sender stats"""
+        test_id = uuid.uuid4().hex
+        with self._connect(iface, server, port, timeout=10) as sock:
+            self._request(sock, 'download', duration, test_id)
+            buffer = bytearray(CHUNK)
+            received = 0
+            first = last = None
+            head = b''
+            while True:
+                n = sock.recv_into(buffer)
+                if not n:
+                    break
+                last = time.monotonic()
+                if first is None:
+                    first = last
+                    head = bytes(buffer[:min(n, 4096)])
+                received += n
+            receiver = tcp_info(sock)
+
+        if received < 4096 and head.startswith(b'{'):
+            # The server refused the stream and answered with an error
+            try:
+                return json.loads(head)
+            except ValueError:
+                pass
+
+        elapsed = (last - first) if first and last and last > first else 0
+        result = {
+            'success': True,
+            'bytes': received,
+            'elapsed_s': round(elapsed, 3),
+            'goodput_mbps': round(received * 8 / elapsed / 1e6, 2) if elapsed else 0,
+            'rcv_rtt_ms': round(receiver.get('rcv_rtt_us', 0) / 1000, 2)
+        }
+        with self._connect(iface, server, port, timeout=5) as sock:
+            self._request(sock, 'result', duration, test_id)
+            sender = json.loads(read_line(sock) or b'{}')
+        for key in ('rtt_idle_ms', 'rtt_loaded', 'min_rtt_ms', 'retransmits', 'bytes_retrans'):
+            result[key] = sender.get(key)
+        return result
+
+    def upload(self, iface, server, port, duration):
+        """One stream where this host sends; goodput is what the server received"""
+        with self._connect(iface, server, port, timeout=10) as sock:
+            self._request(sock, 'upload', duration, uuid.uuid4().hex)
+            payload = os.urandom(CHUNK)
+            stats = SenderStats(sock)
+            start = time.monotonic()
+            deadline = start + duration
+            now = start
+            sent = 0
+            while now < deadline:
+                sent += sock.send(payload)
+                now = time.monotonic()
+                stats.maybe_sample(now)
+            sender = stats.result()
+            sock.shutdown(socket.SHUT_WR)
+            sock.settimeout(duration + 15)
+            receiver = json.loads(read_line(sock) or b'{}')
+
+        if not receiver.get('success'):
+            return {'success': False, 'error': receiver.get('error', 'No response from server')}
+        result = {
+            'success': True,
+            'bytes': receiver['bytes_received'],
+            'elapsed_s': receiver['elapsed_s'],
+            'goodput_mbps': receiver['goodput_mbps'],
+        }
+        result.update(sender)
+        return result
+
+    def _streams(self, method, iface, server, port, duration, streams):
+        """Run `streams` parallel streams of one direction and combine them"""
+        results = [None] * streams
+
+        def worker(index):
+            try:
+                results[index] = method(iface, server, port, duration)
+            except (OSError, ValueError) as e:
+                results[index] = {'success': False, 'error': str(e)}
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(streams)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        ok = [r for r in results if r and r.get('success')]
+        if not ok:
+            return {'success': False, 'error': next((r['error'] for r in results if r), 'No streams ran')}
+
+        loaded = [r['rtt_loaded'] for r in ok if r.get('rtt_loaded')]
+        combined = {
+            'success': True,
+            'streams': len(ok),
+            'bytes': sum(r['bytes'] for r in ok),
+            'goodput_mbps': round(sum(r['goodput_mbps'] for r in ok), 2),
+            'rtt_idle_ms': min((r['rtt_idle_ms'] for r in ok if r.get('rtt_idle_ms')), default=None),
+            'rtt_loaded': {
+                'p50_ms': max(l['p50_ms'] for l in loaded),
+                'p90_ms': max(l['p90_ms'] for l in loaded),
+                'max_ms': max(l['max_ms'] for l in loaded),
+                'samples': sum(l['samples'] for l in loaded)
+            } if loaded else None,
+            'retransmits': sum(r.get('retransmits') or 0 for r in ok),
+            'bytes_retrans': sum(r.get('bytes_retrans') or 0 for r in ok),
+        }
+        if combined['rtt_idle_ms'] and combined['rtt_loaded']:
+            # Queueing delay the load added (bufferbloat)
+            combined['rtt_increase_ms'] = round(combined['rtt_loaded']['p50_ms'] - combined['rtt_idle_ms'], 2)
+        if len(ok) < streams:
+            combined['failed_streams'] = streams - len(ok)
+        return combined
+
+    def test_uplink(self, iface, server, port=THROUGHPUT_PORT, duration=5, direction='both', streams=1):
+        """Measure one uplink: download then upload"""
+        result = {
+            'interface': iface,
+            'server': f'{server}:{port}',
+            'time': round(time.time(), 3),
+            'duration': duration,
+            'streams': streams,
+        }
+        if direction in ('both', 'download'):
+            result['download'] = self._streams(self.download, iface, server, port, duration, streams)
+        if direction in ('both', 'upload'):
+            result['upload'] = self._streams(self.upload, iface, server, port, duration, streams)
+        result['success'] = any(result.get(d, {}).get('success') for d in ('download', 'upload'))
+        return result
+
+    def run(self, interfaces, server, port=THROUGHPUT_PORT, duration=5, direction='both',
+            streams=1, parallel=False):
+        """Test several uplinks one after another, or all at once with parallel=True"""
+        if direction not in ('both', 'download', 'upload'):
+            return {'success': False, 'error': 'direction must be both, download or upload'}
+        if not interfaces:
+            return {'success': False, 'error': 'No interfaces to test'}
+        if not server:
+            return {'success': False, 'error': 'Test server required'}
+        duration = min(max(float(duration), 1), MAX_DURATION)
+        streams = min(max(int(streams), 1), MAX_STREAMS)
+
+        if not self._lock.acquire(blocking=False):
+            return {'success': False, 'error': 'A throughput test is already running'}
+        try:
+            self.running = {'interfaces': list(interfaces), 'server': server, 'started': time.time(),
+                            'parallel': parallel, 'direction': direction}
+            if parallel:
+                results = [None] * len(interfaces)
+
+                def worker(index, iface):
+                    results[index] = self.test_uplink(iface, server, port, duration, direction, streams)
+
+                threads = [threading.Thread(target=worker, args=(i, iface)) for i, iface in enumerate(interfaces)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            else:
+                results = [self.test_uplink(iface, server, port, duration, direction, streams)
+                           for iface in interfaces]
+
+            run_id = uuid.uuid4().hex[:12]
+            for result in results:
+                result['run_id'] = run_id
+                result['parallel'] = parallel
+            self.store(results)
+            return {'success': True, 'run_id': run_id, 'results': results}
+        finally:
+            self.running = None
+            self._lock.release()
+
+    def store(self, results):
+        try:
+            with open(self.results_file, 'a') as f:
+                for result in results:
+                    f.write(json.dumps(result, separators=(',', ':')) + '\n')
+        except OSError as e:
+            logger.error(f"Cannot store throughput results in {self.results_file}: {e}")
+
+    def history(self, interface=None, limit=50):
+        """Most recent stored results, newest first"""
+        results = []
+        try:
+            for line in reverse_lines(self.results_file):
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if interface and result.get('interface') != interface:
+                    continue
+                results.append(result)
+                if len(results) >= limit:
+                    break
+        except FileNotFoundError:
+            pass
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Network Interface Manager throughput test')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve = sub.add_parser('server', help='Run a test server')
+    serve.add_argument('--host', default='0.0.0.0')
+    serve.add_argument('--port', type=int, default=THROUGHPUT_PORT)
+    serve.add_argument('--token', default=THROUGHPUT_TOKEN)
+
+    run = sub.add_parser('run', help='Measure uplinks against a test server')
+    run.add_argument('--server', required=True)
+    run.add_argument('--port', type=int, default=THROUGHPUT_PORT)
+    run.add_argument('--interface', action='append', required=True, help='Repeat for several uplinks')
+    run.add_argument('--duration', type=float, default=5)
+    run.add_argument('--direction', default='both', choices=('both', 'download', 'upload'))
+    run.add_argument('--streams', type=int, default=1)
+    run.add_argument('--parallel', action='store_true', help='Test all uplinks at the same time')
+    run.add_argument('--token', default=THROUGHPUT_TOKEN)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'server':
+        server = ThroughputServer(args.host, args.port, args.token)
+        result = server.start()
+        print(result.get('message') or result.get('error'))
+        if not result['success']:
+            return 1
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        tester = ThroughputTester(token=args.token)
+        print(json.dumps(tester.run(args.interface, args.server, args.port, args.duration, args.direction,
+                                    args.streams, args.parallel), indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,6 +25,18 @@ log_message() {
     echo "[$(date '+%Y-%m-%d %H:%M:%S')] $1"
 }
 
+# Function to record a structured event in the shared event journal (see journal.py)
+journal_event() {
+    local severity="$1"
+    local interface="$2"
+    local message="$3"
+    
+    if [ -f "$SCRIPT_DIR/journal.py" ]; then
+        python3 "$SCRIPT_DIR/journal.py" append --source usb-monitor --category tethering \
+            --severity "$severity" ${interface:+--interface "$interface"} "$message" >/dev/null 2>&1
+    fi
+}
+
 # Function to acquire lock
 acquire_lock() {
     if [ -f "$LOCK_FILE" ]; then
@@ -109,6 +121,11 @@ check_interface_change() {
     
     if [ "$current_interface" != "$last_interface" ]; then
         log_message "USB interface change detected: '$last_interface' -> '$current_interface'"
+        if [ -n "$current_interface" ]; then
+            journal_event info "$current_interface" "USB interface detected (was '${last_interface:-none}')"
+        else
+            journal_event warning "$last_interface" "USB interface removed"
+        fi
         echo "$current_interface" > "$LAST_USB_INTERFACE_FILE"
         return 0
     fi
@@ -134,8 +151,10 @@ reconfigure_routing() {
         
         if [ $? -eq 0 ]; then
             log_message "USB tethering configuration completed successfully"
+            journal_event info "$new_interface" "USB tethering configured"
         else
             log_message "USB tethering configuration failed or timed out"
+            journal_event error "$new_interface" "USB tethering configuration failed or timed out"
             return 1
         fi
     fi
@@ -152,8 +171,10 @@ reconfigure_routing() {
         
         if [ $? -eq 0 ]; then
             log_message "Load balancing setup completed successfully"
+            journal_event info "$new_interface" "Load balancing configured"
         else
             log_message "Load balancing setup failed or timed out"
+            journal_event error "$new_interface" "Load balancing setup failed or timed out"
         fi
     fi
     
@@ -161,8 +182,10 @@ reconfigure_routing() {
     log_message "Testing connectivity..."
     if timeout 10 ping -c 2 8.8.8.8 >/dev/null 2>&1; then
         log_message "✅ Internet connectivity: OK"
+        journal_event info "$new_interface" "Internet connectivity OK after reconfiguration"
     else
         log_message "❌ Internet connectivity: FAILED"
+        journal_event error "$new_interface" "Internet connectivity failed after reconfiguration"
     fi
     
     return 0
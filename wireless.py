@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Wireless scanning support for Network Interface Manager
+Loaded on first use so that startup does not pay for it
+"""
+
+import re
+
+
+class WirelessScanner:
+    def __init__(self, run_command):
+        self.run_command = run_command
+
+    def scan(self, iface_name):
+        """Scan for wireless networks"""
+        if not iface_name.startswith('wl'):
+            return {'success': False, 'error': 'Not a wireless interface'}
+
+        result = self.run_command(f"sudo iwlist {iface_name} scan")
+        if not result['success']:
+            return {'success': False, 'error': result['error']}
+
+        networks = []
+        current_network = {}
+
+        for line in result['output'].split('\n'):
+            line = line.strip()
+            if 'Cell' in line and 'Address:' in line:
+                if current_network:
+                    networks.append(current_network)
+                current_network = {'bssid': line.split('Address: ')[1]}
+            elif 'ESSID:' in line:
+                essid = line.split('ESSID:')[1].strip('"')
+                current_network['ssid'] = essid
+            elif 'Quality=' in line:
+                quality_match = re.search(r'Quality=(\d+/\d+)', line)
+                if quality_match:
+                    current_network['quality'] = quality_match.group(1)
+                signal_match = re.search(r'Signal level=(-?\d+)', line)
+                if signal_match:
+                    current_network['signal'] = f"{signal_match.group(1)} dBm"
+            elif 'Encryption key:' in line:
+                current_network['encrypted'] = 'on' in line.lower()
+
+        if current_network:
+            networks.append(current_network)
+
+        return {'success': True, 'networks': networks}